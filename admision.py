@@ -0,0 +1,233 @@
+"""Control de admisión: presupuestos de concurrencia por clase de petición.
+
+Cada petición se clasifica antes de llegar a la ruta:
+
+- ``escritura``: /insertar, /actualizar y /documentos.
+- ``lectura_pesada``: tablas completas o por stream, búsquedas por lote y
+  reportes.
+- ``lectura``: el resto de /consulta (páginas, filtros, catálogos, cambios).
+
+Cada clase tiene su propio cupo de peticiones simultáneas y una cola acotada
+con espera máxima. Con la cola llena se responde 429 al instante; si el
+turno no llega a tiempo, 503. Ambas llevan ``Retry-After``. Las rutas de
+estado, métricas y caché no pasan por aquí.
+
+Además la clase viaja en un ``contextvar``: ``db`` toma de ahí el timeout de
+las operaciones y no deja que las lecturas usen las conexiones de la
+primaria reservadas para escrituras (``reserva_escritura``), así una
+exportación grande no retrasa los checkouts de las ventas.
+"""
+import asyncio
+import contextvars
+import json
+from collections import deque
+from urllib.parse import parse_qs
+
+import config
+
+ESCRITURA = "escritura"
+LECTURA = "lectura"
+LECTURA_PESADA = "lectura_pesada"
+
+# Clase de la petición en curso (None fuera de una petición, p. ej. la ingesta)
+_clase = contextvars.ContextVar("clase", default=None)
+
+
+class ColaLlena(Exception):
+    """La cola de espera ya tiene el máximo de pendientes."""
+
+
+class EsperaVencida(Exception):
+    """No hubo cupo dentro de la espera máxima."""
+
+
+class Cupos:
+    """Cupos repartidos desde el event loop, con cola FIFO y espera máxima.
+
+    Los ``reservados`` solo los toman los pedidos prioritarios: uno común
+    necesita que queden más libres que la reserva. ``devolver`` pasa el
+    cupo directo al primer pedido que puede usarlo.
+    """
+
+    def __init__(self, total, max_cola=None, reservados=0):
+        if reservados >= total:
+            raise ValueError("La reserva debe dejar al menos un cupo común")
+        self.total = total
+        self.max_cola = max_cola
+        self.reservados = reservados
+        self.libres = total
+        self._espera = deque()  # (futuro, prioritario)
+        self.admitidos = 0
+        self.rechazados = 0
+        self.vencidos = 0
+
+    def _puede(self, prioritario):
+        return self.libres > (0 if prioritario else self.reservados)
+
+    def _despachar(self):
+        for pedido in list(self._espera):
+            futuro, prioritario = pedido
+            if self.libres <= 0:
+                break
+            if futuro.done():
+                self._espera.remove(pedido)
+            elif self._puede(prioritario):
+                self._espera.remove(pedido)
+                self.libres -= 1
+                futuro.set_result(None)
+
+    async def tomar(self, espera, prioritario=False):
+        """Espera un cupo hasta ``espera`` segundos (ColaLlena / EsperaVencida)."""
+        # Tras cada ``devolver`` no queda en la cola nadie que pueda pasar, así
+        # que tomar el cupo libre no se adelanta a ningún pedido anterior
+        if self._puede(prioritario):
+            self.libres -= 1
+            self.admitidos += 1
+            return
+        if self.max_cola is not None and len(self._espera) >= self.max_cola:
+            self.rechazados += 1
+            raise ColaLlena(f"{len(self._espera)} pedidos en espera")
+        loop = asyncio.get_running_loop()
+        futuro = loop.create_future()
+        pedido = (futuro, prioritario)
+        self._espera.append(pedido)
+        vence = loop.call_later(espera, self._vencer, pedido, espera)
+        try:
+            await futuro
+        except BaseException:
+            if pedido in self._espera:
+                self._espera.remove(pedido)
+            elif not futuro.cancelled() and futuro.exception() is None:
+                # El cupo llegó junto con la cancelación: lo pasamos al siguiente
+                self.devolver()
+            raise
+        finally:
+            vence.cancel()
+        self.admitidos += 1
+
+    def _vencer(self, pedido, espera):
+        futuro, _ = pedido
+        if not futuro.done():
+            self._espera.remove(pedido)
+            self.vencidos += 1
+            futuro.set_exception(EsperaVencida(f"Sin cupo tras {espera}s"))
+
+    def devolver(self):
+        self.libres += 1
+        self._despachar()
+
+    def stats(self):
+        return {
+            "total": self.total,
+            "reservados": self.reservados,
+            "en_uso": self.total - self.libres,
+            "en_espera": len(self._espera),
+            "admitidos": self.admitidos,
+            "rechazados": self.rechazados,
+            "vencidos": self.vencidos,
+        }
+
+
+def clase():
+    """Clase de la petición en curso o None."""
+    return _clase.get()
+
+
+def es_lectura():
+    return _clase.get() in (LECTURA, LECTURA_PESADA)
+
+
+def timeout():
+    """Timeout de base de datos de la clase en curso (o el del executor)."""
+    actual = _clase.get()
+    if actual is None:
+        return config.EXECUTOR_CONFIG['timeout']
+    return config.ADMISSION_CONFIG['clases'][actual]['timeout']
+
+
+def classify(metodo, ruta, query_string):
+    """Clase de una petición o None si no pasa por el control de admisión."""
+    partes = ruta.strip("/").split("/")
+    if partes[0] in ("insertar", "actualizar", "documentos"):
+        return ESCRITURA if metodo not in ("GET", "HEAD") else None
+    if partes[0] == "reportes" and len(partes) > 1:
+        return LECTURA_PESADA
+    if partes[0] != "consulta" or len(partes) < 2:
+        return None
+    if len(partes) > 2:
+        # /consulta/{tabla}/lote trae hasta miles de claves; /changes está acotado por limit
+        return LECTURA_PESADA if partes[2] == "lote" else LECTURA
+    params = parse_qs(query_string)
+    if params.get("stream", [""])[0].lower() in ("true", "1", "yes", "on"):
+        return LECTURA_PESADA
+    if "limit" in params or ("campo" in params and "valor" in params):
+        return LECTURA
+    # Tabla completa: liviana solo si es un catálogo que sale de la caché
+    return LECTURA if partes[1] in config.CACHE_CONFIG['tablas'] else LECTURA_PESADA
+
+
+class AdmissionController:
+    """Un ``Cupos`` por clase según ``ADMISSION_CONFIG['clases']``."""
+
+    def __init__(self, clases, retry_after=1):
+        self.clases = {nombre: dict(opciones) for nombre, opciones in clases.items()}
+        self.retry_after = retry_after
+        self._loop = None
+        self._cupos = {}
+
+    def cupos(self, nombre):
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Los cupos son del event loop que los creó (otro TestClient, p. ej.)
+            self._loop = loop
+            self._cupos = {n: Cupos(o['concurrencia'], o['cola']) for n, o in self.clases.items()}
+        return self._cupos[nombre]
+
+    def stats(self):
+        return {nombre: cupos.stats() for nombre, cupos in self._cupos.items()}
+
+    def gauges(self):
+        # Plano para register_gauges: api_admision_{clase}_{campo}
+        return {f"{nombre}_{campo}": valor for nombre, stats in self.stats().items()
+                for campo, valor in stats.items()}
+
+
+class AdmissionMiddleware:
+    """Middleware ASGI: admite, encola o rechaza cada petición según su clase."""
+
+    def __init__(self, app, controlador):
+        self.app = app
+        self.controlador = controlador
+
+    async def _rechazar(self, send, status, detalle):
+        cuerpo = json.dumps({"detail": detalle}, ensure_ascii=False).encode("utf-8")
+        await send({"type": "http.response.start", "status": status, "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(cuerpo)).encode()),
+            (b"retry-after", str(self.controlador.retry_after).encode()),
+        ]})
+        await send({"type": "http.response.body", "body": cuerpo})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        nombre = classify(scope["method"], scope["path"], scope.get("query_string", b"").decode("latin-1"))
+        if nombre is None:
+            await self.app(scope, receive, send)
+            return
+        cupos = self.controlador.cupos(nombre)
+        try:
+            await cupos.tomar(self.controlador.clases[nombre]['espera'])
+        except ColaLlena:
+            await self._rechazar(send, 429, f"Demasiadas peticiones de {nombre} en espera")
+            return
+        except EsperaVencida:
+            await self._rechazar(send, 503, f"Sin capacidad para {nombre}; reintente más tarde")
+            return
+        token = _clase.set(nombre)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _clase.reset(token)
+            cupos.devolver()
@@ -0,0 +1,360 @@
+"""Sustituto local del módulo ``fdb`` para medir la API sin DYNAMO.fdb.
+
+Implementa la parte de la API de fdb que usa la aplicación (connect, cursor,
+prep, execute, executemany, fetch*, commit, rollback, savepoint y
+``fb_cancel_operation`` por los mismos nombres de ``fdb.fbcore`` y
+``fdb.ibase`` que usa ``pool.py``) con latencias configurables en
+``LATENCIA`` y datos sintéticos generados para ``cust``, ``shipto``, ``oe``,
+``oedet`` y los catálogos. Entiende lo justo de SQL para las sentencias que arma la API:
+lista de columnas, ``FIRST ?``, ``clave > ?`` e ``IN (?, ...)``/``= ?``,
+más el log de cambios de ``cambios.py``, los ``GROUP BY`` de ``reportes.py``
+y el ``rowcount`` de los UPDATE.
+"""
+import ctypes
+import datetime
+import itertools
+import re
+import threading
+import time
+import types
+import weakref
+from decimal import Decimal
+
+__version__ = "stub"
+
+# Segundos simulados por operación; 'fetch_row' se paga por cada fila leída
+LATENCIA = {
+    'connect': 0.02,
+    'execute': 0.002,
+    'fetch_row': 0.00001,
+    'commit': 0.003,
+}
+
+# Filas sintéticas por tabla
+FILAS = {
+    'cust': 20000,
+    'shipto': 30000,
+    'oe': 10000,
+    'oedet': 50000,
+    'api_cambios': 5000,
+}
+FILAS_CATALOGO = 200
+
+# DSN que rechazan conexiones (para probar el paso de réplicas a la primaria)
+CAIDOS = set()
+
+# Base sin el log de cambios de cambios.py: sus sentencias fallan al preparar
+SIN_CAMBIOS = False
+
+# Triggers del log ausentes o inactivos (por nombre, ver cambios.trigger_name)
+SIN_TRIGGER = set()
+
+# Valores de parámetro con los que un INSERT/UPDATE falla: RECHAZADOS como una
+# clave foránea violada (error de la fila), CORTES como conexión perdida
+RECHAZADOS = set()
+CORTES = set()
+
+# Contadores globales para el reporte del benchmark
+stats = {'connects': 0, 'executes': 0, 'prepares': 0, 'commits': 0, 'rows_fetched': 0, 'rows_written': 0}
+_lock = threading.Lock()
+
+
+class Error(Exception):
+    pass
+
+
+class DatabaseError(Error):
+    pass
+
+
+class OperationalError(DatabaseError):
+    pass
+
+
+# Conexiones abiertas por handle, para fb_cancel_operation
+_conexiones = weakref.WeakValueDictionary()
+_handles = itertools.count(1)
+
+
+def _fb_cancel_operation(status, db_handle, opcion):
+    # db_handle llega como ctypes.byref(con._db_handle)
+    con = _conexiones.get(db_handle._obj.value)
+    # Como en Firebird, sin una sentencia en curso no hay nada que cancelar
+    if con is not None and con._en_curso and opcion == ibase.fb_cancel_raise:
+        con._cancelada = True
+    return 0
+
+
+ibase = types.SimpleNamespace(ISC_STATUS_ARRAY=ctypes.c_long * 20, fb_cancel_raise=3)
+_api = types.SimpleNamespace(client_library=types.SimpleNamespace(fb_cancel_operation=_fb_cancel_operation))
+fbcore = types.SimpleNamespace(load_api=lambda fb_library_name=None: _api)
+
+
+def _contar(clave, cantidad=1):
+    with _lock:
+        stats[clave] += cantidad
+
+
+def _dormir(segundos):
+    if segundos > 0:
+        time.sleep(segundos)
+
+
+def _valor(tabla, columna, i):
+    """Valor determinista de ``columna`` para la fila ``i``."""
+    if columna in ('ID_N', 'IDVEND', 'ID_VEND', 'CODIGO', 'ID_PAIS', 'ID_DEPTO', 'ID_CIUDAD',
+                   'CODACT', 'NUMBER', 'CONTEO', 'SALESMAN', 'ID_SUCURSAL', 'ID_EMPRESA'):
+        if columna == 'ID_N' and tabla == 'shipto':
+            return i // 3
+        return i
+    if columna == 'SUCCLIENTE':
+        return i % 3
+    if columna.startswith('FECHA') or columna == 'DUEDATE':
+        return datetime.date(2024, 1, 1) + datetime.timedelta(days=i % 365)
+    if columna in ('TOTAL', 'SUBTOTAL', 'SALESTAX', 'COST', 'PRICE', 'EXTEND', 'VLR_PAGO', 'QTYSHIP'):
+        return Decimal(i % 10000) / 100
+    if columna == 'EMAIL':
+        return f"cliente{i}@example.com"
+    return f"{columna.lower()}-{i}"
+
+
+def _por_clave(tabla, valor):
+    """Índices de fila cuyo primer campo de la clave vale ``valor``."""
+    if tabla == 'shipto':
+        return range(valor * 3, valor * 3 + 3)
+    return range(valor, valor + 1)
+
+
+def _despues_de(tabla, params):
+    """Primer índice después del cursor ``after`` (ver tablas.build_select)."""
+    if tabla == 'shipto':
+        # Parámetros: k1 >= ?, k1 > ?, k1 = ?, k2 > ?
+        return int(params[0]) * 3 + int(params[-1]) + 1
+    return int(params[-1]) + 1
+
+
+def _cambios(tabla, desde, limite):
+    """Log de cambios (ver cambios.py): uno por segundo hasta ahora, 1 de cada 10 borrado."""
+    total = FILAS['api_cambios']
+    ahora = datetime.datetime.now()
+    for i in range(desde + 1, min(total, desde + limite) + 1):
+        clave = (i * 7919) % FILAS.get(tabla, FILAS_CATALOGO)
+        clave1, clave2 = (clave // 3, str(clave % 3)) if tabla == 'shipto' else (clave, None)
+        yield (i, str(clave1), clave2, 'D' if i % 10 == 0 else 'U',
+               ahora - datetime.timedelta(seconds=total - i))
+
+
+_SELECT = re.compile(r"SELECT\s+(FIRST\s+\?\s+)?(.*?)\s+FROM\s+([\w$]+)(.*)", re.I | re.S)
+_UPDATE = re.compile(r"UPDATE\s+(\w+)\s+SET\s.*\sWHERE\s+(.*)", re.I | re.S)
+
+
+class PreparedStatement:
+    def __init__(self, sql, cursor):
+        if SIN_CAMBIOS and "API_CAMBIOS" in sql.upper():
+            raise DatabaseError("Dynamic SQL Error\n-SQL error code = -204\n-Table unknown\n-API_CAMBIOS",
+                                -204, 335544580)
+        self.sql = sql
+        self.cursor = cursor
+        self._parse(sql)
+
+    def _parse(self, sql):
+        self.es_select = False
+        # UPDATE simple: cuántos parámetros del final son la clave (para rowcount)
+        m = _UPDATE.match(sql.strip())
+        self.update_tabla = m.group(1).lower() if m else None
+        self.update_claves = m.group(2).count("?") if m else 0
+        m = _SELECT.match(sql.strip())
+        if not m:
+            return
+        self.es_select = True
+        self.con_first = bool(m.group(1))
+        # "expresión AS ALIAS": el driver informa el alias
+        self.columnas = [c.strip().split(" AS ")[-1] for c in m.group(2).split(",")]
+        self.tabla = m.group(3).lower()
+        resto = m.group(4)
+        self.agregado = " GROUP BY " in resto
+        # Columnas agrupadas además del día
+        self.agrupados = resto.split(" GROUP BY ")[1].split(" ORDER BY ")[0].count(",") if self.agregado else 0
+        self.in_cantidad = resto.count("?") if " IN (" in resto else 0
+        self.mayor_que = re.search(r"(\w+) > \?\)*\s*(ORDER|$)", resto) is not None
+        self.igual = re.search(r"WHERE (\w+) = \?", resto) is not None and not self.in_cantidad
+
+    @property
+    def description(self):
+        if not self.es_select:
+            return None
+        # type_code: el tipo Python de la columna, como informa fdb
+        return tuple((c, type(_valor(self.tabla, c, 0)), None, None, None, None, True) for c in self.columnas)
+
+    def close(self):
+        pass
+
+    def afectadas(self, params):
+        """Filas que toca un DML: un UPDATE por clave fuera de los datos sintéticos no toca ninguna."""
+        if self.update_tabla is None:
+            return 1
+        clave = list(params or [])[-self.update_claves]
+        total = FILAS.get(self.update_tabla, FILAS_CATALOGO)
+        return int(str(clave).isdigit() and int(clave) < total)
+
+    def run(self, params):
+        params = list(params or [])
+        if not self.es_select:
+            _contar('rows_written', self.afectadas(params))
+            return []
+        if self.tabla == 'rdb$triggers':
+            return [] if params[0] in SIN_TRIGGER else [(1,)]
+        if self.columnas == ['1']:
+            return [(1,)]
+        if self.tabla == 'rdb$database':
+            # Marca del feed de cambios: CURRENT_TIMESTAMP y el generador
+            return [(datetime.datetime.now(), FILAS['api_cambios'])]
+        if self.tabla == 'api_cambios' and len(params) == 1:
+            # Versión para el ETag: la tabla quieta desde hace una hora, o
+            # ninguna fila si el log está vacío
+            ahora = datetime.datetime.now()
+            if not FILAS['api_cambios']:
+                return []
+            return [(FILAS['api_cambios'], ahora - datetime.timedelta(hours=1), ahora)]
+        if self.tabla == 'api_cambios':
+            limite, tabla, desde = params
+            return list(_cambios(tabla, int(desde), int(limite)))
+        total = FILAS.get(self.tabla, FILAS_CATALOGO)
+        if self.agregado:
+            return self._agregar(params[0], params[1], total)
+        limite = params.pop(0) if self.con_first else None
+        if self.in_cantidad or self.igual:
+            claves = {int(p) for p in params if str(p).isdigit()}
+            indices = sorted(i for v in claves for i in _por_clave(self.tabla, v) if i < total)
+        else:
+            desde = _despues_de(self.tabla, params) if self.mayor_que and params else 0
+            hasta = total if limite is None else min(total, desde + int(limite))
+            indices = range(desde, hasta)
+        return [tuple(_valor(self.tabla, c, i) for c in self.columnas) for i in indices]
+
+
+    def _agregar(self, desde, hasta, total):
+        # Reportes: por día, cuatro valores por dimensión; la base recorre las filas del rango
+        dias = (hasta - desde).days
+        _dormir(LATENCIA['fetch_row'] * total * dias / 365)
+        filas = []
+        for d in range(dias):
+            fecha = desde + datetime.timedelta(days=d)
+            for combinacion in range(4 ** self.agrupados):
+                dimensiones = [(combinacion >> (2 * i)) & 3 for i in range(self.agrupados)]
+                medidas = [Decimal(d * 97 + combinacion) if i else 25
+                           for i in range(len(self.columnas) - 1 - self.agrupados)]
+                filas.append(tuple([fecha] + dimensiones + medidas))
+        return filas
+
+
+class Cursor:
+    def __init__(self, con):
+        self.con = con
+        self._ps = None
+        self._filas = []
+        self._pos = 0
+        self.rowcount = -1
+
+    @property
+    def description(self):
+        return self._ps.description if self._ps is not None else None
+
+    def prep(self, sql):
+        _contar('prepares')
+        _dormir(LATENCIA['execute'] / 2)
+        return PreparedStatement(sql, self)
+
+    def execute(self, operation, parameters=None):
+        self.con._check()
+        if not isinstance(operation, PreparedStatement):
+            _contar('prepares')
+            operation = PreparedStatement(operation, self)
+        self._ps = operation
+        _contar('executes')
+        self.con._en_curso = True
+        try:
+            _dormir(LATENCIA['execute'])
+            self.con._check()
+        finally:
+            # Una cancelación que llega tarde ya no afecta a la sentencia siguiente
+            self.con._en_curso = False
+            self.con._cancelada = False
+        if not operation.es_select and (RECHAZADOS or CORTES):
+            valores = {str(p) for p in parameters or ()}
+            if valores & RECHAZADOS:
+                raise DatabaseError("violation of FOREIGN KEY constraint", -530, 335544466)
+            if valores & CORTES:
+                raise OperationalError("Error writing data to the connection", -902, 335544727)
+        self._filas = operation.run(parameters)
+        self._pos = 0
+        self.rowcount = -1 if operation.es_select else operation.afectadas(parameters)
+        return self
+
+    def executemany(self, operation, seq_of_parameters):
+        if not isinstance(operation, PreparedStatement):
+            operation = self.prep(operation)
+        for parameters in seq_of_parameters:
+            self.execute(operation, parameters)
+        return self
+
+    def _leer(self, cantidad):
+        filas = self._filas[self._pos:self._pos + cantidad]
+        self._pos += len(filas)
+        _contar('rows_fetched', len(filas))
+        _dormir(LATENCIA['fetch_row'] * len(filas))
+        return filas
+
+    def fetchone(self):
+        filas = self._leer(1)
+        return filas[0] if filas else None
+
+    def fetchmany(self, size=1):
+        return self._leer(size)
+
+    def fetchall(self):
+        return self._leer(len(self._filas) - self._pos)
+
+    def close(self):
+        self._filas = []
+
+
+class Connection:
+    def __init__(self):
+        self.closed = False
+        self._en_curso = False
+        self._cancelada = False
+        self._db_handle = ctypes.c_uint(next(_handles))
+        _conexiones[self._db_handle.value] = self
+
+    def _check(self):
+        if self.closed:
+            raise OperationalError("Conexión cerrada", -902, 335544726)
+        if self._cancelada:
+            self._cancelada = False
+            raise DatabaseError("operation was cancelled", -901, 335544794)
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        _contar('commits')
+        _dormir(LATENCIA['commit'])
+
+    def rollback(self, retaining=False, savepoint=None):
+        if self.closed:
+            raise OperationalError("Conexión cerrada", -902, 335544726)
+
+    def savepoint(self, name):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+def connect(dsn=None, user=None, password=None, **kwargs):
+    if dsn in CAIDOS:
+        raise OperationalError(f"Unable to complete network request to host ({dsn})", -902, 335544721)
+    _contar('connects')
+    _dormir(LATENCIA['connect'])
+    return Connection()
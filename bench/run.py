@@ -0,0 +1,418 @@
+"""Benchmark de la API en proceso contra un sustituto de ``fdb``.
+
+Instala el módulo indicado con ``--driver`` (por defecto ``fdb_stub``) como
+``fdb`` antes de importar ``main``, levanta la aplicación con su lifespan y
+la recorre con clientes concurrentes (httpx sobre ASGI, sin sockets). Por
+cada carga informa peticiones por segundo y latencias p50/p95/p99, más la
+memoria RSS máxima del proceso, y guarda todo en ``bench/results/`` para
+comparar contra una corrida anterior.
+
+Uso::
+
+    python bench/run.py --escenario mixto --concurrencia 16 --peticiones 2000 \\
+        --etiqueta v1.4 --comparar bench/results/v1.3.json
+
+Con ``--comparar`` el proceso termina con código 1 si alguna carga pierde
+más de ``--tolerancia`` de throughput o gana otro tanto de p95/p99.
+"""
+import argparse
+import asyncio
+import datetime
+import importlib
+import itertools
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULTADOS = os.path.join(RAIZ, "bench", "results")
+
+# Cargas disponibles: nombre -> función que arma (método, url, json)
+_ids = itertools.count(10_000_000)
+
+
+def _cliente(id_n):
+    return {
+        'ID_N': id_n, 'COMPANY': f"Cliente {id_n}", 'ADDR1': "Calle 1 # 2-3", 'CITY': "MEDELLIN",
+        'PAIS': "CO", 'PHONE1': "6040000000", 'GRAVABLE': "S", 'CLIENTE': "S", 'TIPOEMP': "N",
+        'IDVEND': 1, 'CV': "0", 'FECHA_CREACION': "2024-01-01", 'EMAIL': f"c{id_n}@example.com",
+        'DEPARTAMENTO': "ANTIOQUIA", 'REGIMEN': "C", 'RESIDENTE': "S",
+    }
+
+
+def _sucursal(id_n, suc):
+    return {
+        'ID_N': id_n, 'SUCCLIENTE': suc, 'COMPANY': f"Cliente {id_n}", 'ADDR1': "Calle 1 # 2-3",
+        'PHONE1': "6040000000", 'ID_VEND': 1, 'PAIS': "CO", 'EMAIL': f"c{id_n}@example.com",
+        'DEPARTAMENTO': "ANTIOQUIA", 'PRIMER_APELLIDO': "PEREZ", 'SEGUNDO_APELLIDO': "GOMEZ",
+        'PRIMER_NOMBRE': "ANA", 'SEGUNDO_NOMBRE': "", 'FECHA_NACIMIENTO': "1990-01-01",
+        'COD_DPTO': "05", 'COD_MUNICIPIO': "001", 'CITY': "MEDELLIN", 'ESTADO': "A",
+        'EMAIL_FAC_ELEC': f"c{id_n}@example.com",
+    }
+
+
+def _encabezado(numero):
+    return {
+        'ID_EMPRESA': 1, 'ID_SUCURSAL': 1, 'NUMBER': numero, 'TIPO': "FAC", 'ID_USUARIO': "BENCH",
+        'ID_N': numero % 20000, 'SALESMAN': numero % 20, 'FECHA': "2024-01-01", 'DUEDATE': "2024-01-31",
+        'SUBTOTAL': 100000, 'COST': 60000, 'SALESTAX': 19000, 'DESTOTAL': 0, 'TOTAL': 119000,
+        'PAGOS': 119000, 'DEV_FACTURA': 0, 'DEV_TIPOFACT': "", 'LETRAS': "", 'D': "N", 'PORCENIVA': 19,
+        'FORPAGVAL': 119000, 'FORMAS_PAGO': "EF", 'HORACRE': "12:00", 'CUFE': "", 'PREFIJO_POS': "POS",
+    }
+
+
+def _linea(numero, conteo):
+    return {
+        'CONTEO': conteo, 'ID_EMPRESA': 1, 'ID_SUCURSAL': 1, 'NUMBER': numero, 'TIPO': "FAC",
+        'ID_USUARIO': "BENCH", 'ITEM': f"ITEM{conteo:04d}", 'LOCATION': "01", 'IVA': "S", 'QTYSHIP': 1,
+        'PRICE': 20000, 'EXTEND': 20000, 'COST': 12000, 'TOTALDCT': 0, 'VLR_IVA': 3800, 'PORC_IVA': 19,
+        'PRECIOIVA': 23800, 'VLR_DCTOAD1': 0, 'DPTO': "01", 'CCOST': "01", 'NUMITEM': conteo,
+        'COD_TALLA': "", 'CODBARRASCURVA': "",
+    }
+
+
+def _movimiento(numero):
+    return {
+        'LOCATION': "01", 'ITEM': f"ITEM{numero % 500:04d}", 'TIPO': "FAC", 'BATCH': numero,
+        'FECHA': "2024-01-01", 'QTY': -1, 'NUMITEM': 1, 'COD_TALLA': "", 'VALUNIT': 20000,
+        'COSTOP': 12000, 'TOTPARCIAL': 20000,
+    }
+
+
+def _pago(numero):
+    return {
+        'ID_EMPRESA': 1, 'ID_SUCURSAL': 1, 'NUMERO': numero, 'TIPO': "FAC", 'USUARIO': "BENCH",
+        'ACCT': "110505", 'CONCEPTO': "EF", 'DESCRIPCION': "EFECTIVO", 'PORC': 100, 'FECHA': "2024-01-01",
+        'NUM_DOC': str(numero), 'VLR_PAGO': 119000, 'CONTA': "N", 'ID_N': numero % 20000,
+        'VALORECIB': 120000, 'CONTEO': 1,
+    }
+
+
+def _documento(numero, lineas):
+    return {
+        "oe": _encabezado(numero),
+        "oedet": [{k: v for k, v in _linea(numero, i).items()
+                   if k not in ('ID_EMPRESA', 'ID_SUCURSAL', 'NUMBER', 'TIPO', 'ID_USUARIO')}
+                  for i in range(1, lineas + 1)],
+    }
+
+
+def _hace(dias):
+    return datetime.date.today() - datetime.timedelta(days=dias)
+
+
+# Último ETag recibido por URL, para las cargas condicionales
+_etags = {}
+
+
+def _condicional(url):
+    etag = _etags.get(url)
+    return {"If-None-Match": etag} if etag else {}
+
+
+CARGAS = {
+    "catalogo": lambda r: ("GET", "/consulta/paises", None),
+    "cust_pagina": lambda r: ("GET", f"/consulta/cust?limit=100&after={r.randrange(19000)}&format=json", None),
+    "cust_filtro": lambda r: ("GET", f"/consulta/cust?campo=ID_N&valor={r.randrange(20000)}", None),
+    "cust_completa": lambda r: ("GET", "/consulta/cust?format=json", None),
+    # Sucursal que ya tiene la tabla: revalida con If-None-Match (304 si no cambió)
+    "cust_condicional": lambda r: ("GET", "/consulta/cust?format=json", None,
+                                   _condicional("/consulta/cust?format=json")),
+    "catalogo_condicional": lambda r: ("GET", "/consulta/paises", None, _condicional("/consulta/paises")),
+    "cust_stream": lambda r: ("GET", "/consulta/cust?stream=true&fields=ID_N,COMPANY&format=ndjson", None),
+    "cust_cambios": lambda r: ("GET", f"/consulta/cust/changes?since={r.randrange(4900)}&limit=100", None),
+    "shipto_lote": lambda r: ("POST", "/consulta/shipto/lote",
+                              {"campo": "ID_N", "valores": r.sample(range(10000), 50)}),
+    "insertar_cust": lambda r: ("POST", "/insertar/cust", _cliente(next(_ids))),
+    "insertar_shipto": lambda r: ("POST", "/insertar/shipto", _sucursal(next(_ids), 0)),
+    "insertar_oe": lambda r: ("POST", "/insertar/oe", _encabezado(next(_ids))),
+    "insertar_oedet_lote": lambda r: ("POST", "/insertar/oedet/lote",
+                                      [_linea(n, i) for n in [next(_ids)] for i in range(1, 21)]),
+    "documento": lambda r: ("POST", "/documentos", _documento(next(_ids), 5)),
+    "insertar_itemact": lambda r: ("POST", "/insertar/itemact", _movimiento(next(_ids))),
+    "insertar_pagos": lambda r: ("POST", "/insertar/pagos", _pago(next(_ids))),
+    # Sincronización del CRM: cambios parciales por lote sobre clientes existentes y nuevos
+    "cust_upsert": lambda r: ("PUT", "/actualizar/cust/lote",
+                              [{'ID_N': r.randrange(25000), 'EMAIL': "crm@example.com", 'PHONE1': "6041111111"}
+                               for _ in range(100)]),
+    # Tableros: últimos 30 días por vendedor, el día en curso siempre se recalcula
+    "reporte_ventas": lambda r: ("GET", f"/reportes/ventas?desde={_hace(30)}&por=vendedor", None),
+    "reporte_pagos": lambda r: ("GET", f"/reportes/pagos?desde={_hace(r.randrange(7, 90))}&por=sucursal,medio_pago",
+                                None),
+    "itemact_asincrono": lambda r: ("POST", "/insertar/itemact?asincrono=true", _movimiento(next(_ids))),
+    "pagos_asincrono": lambda r: ("POST", "/insertar/pagos?asincrono=true", _pago(next(_ids))),
+}
+
+# Escenarios: carga -> peso relativo
+ESCENARIOS = {
+    "lectura": {"catalogo": 4, "cust_pagina": 3, "cust_filtro": 3, "shipto_lote": 1, "cust_stream": 1},
+    # Sincronización de terminales: feed de cambios contra descarga completa
+    "sincronizacion": {"cust_cambios": 1},
+    "escritura": {"insertar_cust": 3, "insertar_shipto": 2, "insertar_oe": 2,
+                  "insertar_oedet_lote": 1, "documento": 2},
+    "crm": {"cust_upsert": 1},
+    "tableros": {"reporte_ventas": 2, "reporte_pagos": 1},
+    # Exportaciones de tablas completas mientras las cajas siguen vendiendo
+    "exportacion": {"cust_completa": 1, "cust_stream": 1, "insertar_oe": 4, "insertar_pagos": 4},
+    # Sucursales por WAN: descargas completas contra revalidaciones con ETag
+    "sucursales": {"cust_completa": 1, "cust_stream": 1, "cust_condicional": 4, "catalogo_condicional": 4},
+    "mixto": {"catalogo": 3, "cust_pagina": 2, "cust_filtro": 3, "shipto_lote": 1,
+              "insertar_cust": 2, "insertar_oe": 1, "documento": 1},
+    # Ráfagas de movimientos y pagos: comparar con "ingesta" (?asincrono=true)
+    "rafaga": {"insertar_itemact": 2, "insertar_pagos": 1},
+    "ingesta": {"itemact_asincrono": 2, "pagos_asincrono": 1},
+}
+
+
+def peak_rss_mb():
+    """RSS máxima del proceso en MB, o None si la plataforma no la expone."""
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        memoria = psutil.Process().memory_info()
+        return getattr(memoria, "peak_wset", memoria.rss) / 2 ** 20
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux informa KB y macOS bytes
+    return maximo / 2 ** 20 if sys.platform == "darwin" else maximo / 1024
+
+
+def percentil(ordenados, p):
+    if not ordenados:
+        return None
+    indice = max(0, min(len(ordenados) - 1, int(round(p / 100 * len(ordenados) + 0.5)) - 1))
+    return ordenados[indice]
+
+
+def resumen(latencias, errores, duracion, descargados=0):
+    ordenados = sorted(latencias)
+    ms = [None if v is None else v * 1000 for v in (percentil(ordenados, p) for p in (50, 95, 99, 100))]
+    return {
+        "peticiones": len(ordenados),
+        "errores": errores,
+        "rps": len(ordenados) / duracion if duracion else 0.0,
+        "kb_por_peticion": descargados / 1024 / len(ordenados) if ordenados else None,
+        "p50_ms": ms[0],
+        "p95_ms": ms[1],
+        "p99_ms": ms[2],
+        "max_ms": ms[3],
+    }
+
+
+class lifespan:
+    """Corre el protocolo lifespan de ASGI (startup/shutdown) sobre ``app``."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __aenter__(self):
+        self._entrada = asyncio.Queue()
+        self._salida = asyncio.Queue()
+        scope = {"type": "lifespan", "asgi": {"version": "3.0"}}
+        self._tarea = asyncio.ensure_future(self.app(scope, self._entrada.get, self._salida.put))
+        await self._entrada.put({"type": "lifespan.startup"})
+        mensaje = await self._salida.get()
+        if mensaje["type"] != "lifespan.startup.complete":
+            raise RuntimeError(f"Falló el arranque de la aplicación: {mensaje}")
+
+    async def __aexit__(self, *exc):
+        await self._entrada.put({"type": "lifespan.shutdown"})
+        await self._salida.get()
+        await self._tarea
+
+
+async def correr(app, escenario, concurrencia, peticiones, semilla, calentamiento, accept_encoding):
+    import httpx
+
+    pesos = ESCENARIOS[escenario]
+    nombres, valores = list(pesos), list(pesos.values())
+    transporte = httpx.ASGITransport(app=app)
+    # Por carga: latencias, errores y bytes recibidos (comprimidos, como en la red)
+    medidas = {nombre: ([], [0], [0]) for nombre in nombres}
+
+    async with httpx.AsyncClient(transport=transporte, base_url="http://bench", timeout=120,
+                                 headers={"Accept-Encoding": accept_encoding}) as cliente:
+        async def una(carga, azar, registrar):
+            metodo, url, cuerpo, *encabezados = CARGAS[carga](azar)
+            inicio = time.perf_counter()
+            descargados = 0
+            try:
+                respuesta = await cliente.request(metodo, url, json=cuerpo,
+                                                  headers=encabezados[0] if encabezados else None)
+                ok = respuesta.status_code < 400
+                descargados = respuesta.num_bytes_downloaded
+                if "etag" in respuesta.headers:
+                    _etags[url] = respuesta.headers["etag"]
+            except Exception:
+                ok = False
+            duracion = time.perf_counter() - inicio
+            if registrar:
+                latencias, errores, recibidos = medidas[carga]
+                latencias.append(duracion)
+                recibidos[0] += descargados
+                if not ok:
+                    errores[0] += 1
+
+        # Calentamiento: conexiones del pool, sentencias preparadas y caché
+        azar = random.Random(semilla)
+        for carga in nombres:
+            await asyncio.gather(*[una(carga, azar, False) for _ in range(calentamiento)])
+
+        pendientes = itertools.count()
+
+        async def trabajador(numero):
+            azar = random.Random(semilla * 1000 + numero)
+            while next(pendientes) < peticiones:
+                await una(azar.choices(nombres, valores)[0], azar, True)
+
+        inicio = time.perf_counter()
+        await asyncio.gather(*[trabajador(i) for i in range(concurrencia)])
+        duracion = time.perf_counter() - inicio
+
+        pool = (await cliente.get("/estado/pool")).json()
+
+    todas = [d for latencias, _, _ in medidas.values() for d in latencias]
+    return {
+        "duracion_s": duracion,
+        "total": resumen(todas, sum(e[0] for _, e, _ in medidas.values()), duracion,
+                         sum(b[0] for _, _, b in medidas.values())),
+        "cargas": {nombre: resumen(lat, err[0], duracion, recibidos[0])
+                   for nombre, (lat, err, recibidos) in medidas.items()},
+        "pool": pool,
+    }
+
+
+def version_git():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=RAIZ, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def imprimir(resultado):
+    print(f"\nEscenario {resultado['escenario']} — {resultado['concurrencia']} clientes, "
+          f"{resultado['duracion_s']:.2f}s, RSS máx {resultado['peak_rss_mb'] or 'n/d'} MB")
+    print(f"{'carga':<22}{'pet.':>7}{'err.':>6}{'pet/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+          f"{'KB/pet.':>10}")
+    filas = list(resultado["cargas"].items()) + [("TOTAL", resultado["total"])]
+    for nombre, r in filas:
+        if not r["peticiones"]:
+            continue
+        print(f"{nombre:<22}{r['peticiones']:>7}{r['errores']:>6}{r['rps']:>10.1f}"
+              f"{r['p50_ms']:>10.2f}{r['p95_ms']:>10.2f}{r['p99_ms']:>10.2f}{r['kb_por_peticion']:>10.1f}")
+
+
+def comparar(actual, anterior, tolerancia):
+    """Imprime las diferencias contra ``anterior`` y devuelve las regresiones."""
+    regresiones = []
+    print(f"\nComparación contra {anterior.get('etiqueta')} ({anterior.get('version')})")
+    filas = list(actual["cargas"].items()) + [("TOTAL", actual["total"])]
+    for nombre, r in filas:
+        previo = anterior["total"] if nombre == "TOTAL" else anterior["cargas"].get(nombre)
+        if not previo or not previo["peticiones"] or not r["peticiones"]:
+            continue
+        cambios = []
+        for metrica, peor_si_sube in (("rps", False), ("p95_ms", True), ("p99_ms", True)):
+            if not previo[metrica]:
+                continue
+            delta = (r[metrica] - previo[metrica]) / previo[metrica]
+            cambios.append(f"{metrica} {delta:+.1%}")
+            if (delta > tolerancia) if peor_si_sube else (delta < -tolerancia):
+                regresiones.append(f"{nombre}: {metrica} {previo[metrica]:.2f} -> {r[metrica]:.2f}")
+        print(f"  {nombre:<22}" + "  ".join(cambios))
+    return regresiones
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--escenario", choices=sorted(ESCENARIOS), default="mixto")
+    parser.add_argument("--concurrencia", type=int, default=16)
+    parser.add_argument("--peticiones", type=int, default=2000)
+    parser.add_argument("--calentamiento", type=int, default=5, help="peticiones por carga sin medir")
+    parser.add_argument("--semilla", type=int, default=1)
+    parser.add_argument("--driver", default="fdb_stub", help="módulo que reemplaza a fdb")
+    parser.add_argument("--connect-ms", type=float, default=20.0)
+    parser.add_argument("--execute-ms", type=float, default=2.0)
+    parser.add_argument("--fetch-us", type=float, default=10.0, help="microsegundos por fila leída")
+    parser.add_argument("--commit-ms", type=float, default=3.0)
+    parser.add_argument("--pool-max", type=int, help="reemplaza POOL_CONFIG['max_size']")
+    parser.add_argument("--replicas", type=int, default=0, help="réplicas de lectura simuladas")
+    parser.add_argument("--sin-cambios", action="store_true",
+                        help="la base no tiene el log de cambios (sin ETag ni /changes)")
+    parser.add_argument("--accept-encoding", default="gzip", help="'identity' para respuestas sin comprimir")
+    parser.add_argument("--etiqueta", help="nombre del archivo de resultados (por defecto la fecha)")
+    parser.add_argument("--comparar", help="resultados anteriores (JSON) para detectar regresiones")
+    parser.add_argument("--tolerancia", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    sys.path.insert(0, RAIZ)
+    driver = importlib.import_module(args.driver)
+    if hasattr(driver, "LATENCIA"):
+        driver.LATENCIA.update({
+            'connect': args.connect_ms / 1000,
+            'execute': args.execute_ms / 1000,
+            'fetch_row': args.fetch_us / 1e6,
+            'commit': args.commit_ms / 1000,
+        })
+    if args.sin_cambios:
+        driver.SIN_CAMBIOS = True
+    # Debe quedar instalado antes de que pool.py haga ``import fdb``
+    sys.modules["fdb"] = driver
+
+    import config
+    # Journal de la ingesta asíncrona aparte, para no reanudar corridas anteriores
+    config.INGEST_CONFIG['journal'] = os.path.join(tempfile.mkdtemp(prefix="bench-"), "ingesta.journal")
+    if args.pool_max:
+        config.POOL_CONFIG['max_size'] = args.pool_max
+    config.DB_CONFIG['replicas'] = [{'dsn': f"replica{i}:bench.fdb"} for i in range(1, args.replicas + 1)]
+    config.EXECUTOR_CONFIG['max_workers'] = config.POOL_CONFIG['max_size'] * (1 + args.replicas)
+    import main as api
+
+    async def todo():
+        async with lifespan(api.app):
+            return await correr(api.app, args.escenario, args.concurrencia, args.peticiones,
+                                args.semilla, args.calentamiento, args.accept_encoding)
+
+    resultado = asyncio.run(todo())
+    rss = peak_rss_mb()
+    etiqueta = args.etiqueta or datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+    resultado = dict({
+        "etiqueta": etiqueta,
+        "version": version_git(),
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "escenario": args.escenario,
+        "concurrencia": args.concurrencia,
+        "accept_encoding": args.accept_encoding,
+        "latencia": dict(getattr(driver, "LATENCIA", {})),
+        "peak_rss_mb": round(rss, 1) if rss is not None else None,
+        "driver": dict(getattr(driver, "stats", {})),
+    }, **resultado)
+
+    imprimir(resultado)
+    os.makedirs(RESULTADOS, exist_ok=True)
+    destino = os.path.join(RESULTADOS, f"{etiqueta}.json")
+    with open(destino, "w", encoding="utf-8") as f:
+        json.dump(resultado, f, indent=2, ensure_ascii=False, default=str)
+    print(f"\nResultados guardados en {destino}")
+
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as f:
+            regresiones = comparar(resultado, json.load(f), args.tolerancia)
+        if regresiones:
+            print("\nRegresiones:\n  " + "\n  ".join(regresiones))
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,138 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+def _cantidad(valor):
+    # Se aceptan listas de filas o resultados con atributo ``filas``
+    return len(getattr(valor, "filas", valor))
+
+
+class QueryCache:
+    """Caché en memoria de resultados de consultas sobre tablas de catálogo.
+
+    - Cada tabla tiene su propio TTL (``ttl_por_tabla``); las que no aparecen
+      no se cachean.
+    - Se desaloja por LRU al superar ``max_entries`` entradas o ``max_rows``
+      filas en total.
+    - Carga "single-flight": si varias peticiones fallan a la vez sobre la
+      misma clave, solo una va a Firebird y las demás esperan su resultado.
+    - ``invalidate(tabla)`` descarta lo cacheado y lo que esté cargándose en
+      ese momento, para que una lectura previa a un INSERT no quede guardada.
+    """
+
+    def __init__(self, ttl_por_tabla, max_entries=256, max_rows=200000):
+        self.ttl_por_tabla = dict(ttl_por_tabla)
+        self.max_entries = max_entries
+        self.max_rows = max_rows
+        self._entradas = OrderedDict()  # clave -> (expira, filas)
+        self._cargando = {}  # clave -> asyncio.Task
+        self._generacion = {}  # tabla -> contador de invalidaciones
+        self._filas = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def enabled(self, tabla):
+        return self.ttl_por_tabla.get(tabla, 0) > 0
+
+    def _get(self, clave):
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                return None
+            expira, filas = entrada
+            if expira < time.monotonic():
+                self._quitar(clave)
+                return None
+            self._entradas.move_to_end(clave)
+            return filas
+
+    def _quitar(self, clave):
+        _, valor = self._entradas.pop(clave)
+        self._filas -= _cantidad(valor)
+
+    def _put(self, tabla, clave, filas, generacion):
+        with self._lock:
+            if self._generacion.get(tabla, 0) != generacion:
+                # Hubo una escritura mientras se cargaba
+                return
+            if _cantidad(filas) > self.max_rows:
+                return
+            if clave in self._entradas:
+                self._quitar(clave)
+            self._entradas[clave] = (time.monotonic() + self.ttl_por_tabla[tabla], filas)
+            self._filas += _cantidad(filas)
+            while len(self._entradas) > self.max_entries or self._filas > self.max_rows:
+                self._quitar(next(iter(self._entradas)))
+                self.evictions += 1
+
+    async def get_or_load(self, tabla, query, params, loader):
+        """Devuelve las filas cacheadas o las carga con ``await loader()``."""
+        if not self.enabled(tabla):
+            return await loader()
+        clave = (tabla, query, tuple(params))
+        filas = self._get(clave)
+        if filas is not None:
+            self.hits += 1
+            return filas
+
+        self.misses += 1
+        tarea = self._cargando.get(clave)
+        if tarea is not None:
+            self.coalesced += 1
+        else:
+            generacion = self._generacion.get(tabla, 0)
+            tarea = asyncio.ensure_future(self._cargar(tabla, clave, loader, generacion))
+            # Marca la excepción como leída aunque todos los que esperaban se hayan ido
+            tarea.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._cargando[clave] = tarea
+        # shield: si esta petición se cancela, la carga sigue para las demás
+        return await asyncio.shield(tarea)
+
+    async def _cargar(self, tabla, clave, loader, generacion):
+        try:
+            filas = await loader()
+            self._put(tabla, clave, filas, generacion)
+            return filas
+        finally:
+            # Tras una invalidación puede haber otra carga más nueva para la clave
+            if self._cargando.get(clave) is asyncio.current_task():
+                del self._cargando[clave]
+
+    def invalidate(self, tabla=None):
+        """Descarta las entradas de ``tabla`` (o todas si es None)."""
+        if tabla is not None and not self.enabled(tabla):
+            return
+        with self._lock:
+            self.invalidations += 1
+            tablas = [tabla] if tabla is not None else list(self.ttl_por_tabla)
+            for t in tablas:
+                self._generacion[t] = self._generacion.get(t, 0) + 1
+            for clave in [c for c in self._entradas if tabla is None or c[0] == tabla]:
+                self._quitar(clave)
+            # Las lecturas nuevas no deben unirse a una carga iniciada antes de la escritura
+            for clave in [c for c in self._cargando if tabla is None or c[0] == tabla]:
+                del self._cargando[clave]
+
+    def stats(self):
+        with self._lock:
+            consultas = self.hits + self.misses
+            return {
+                "entries": len(self._entradas),
+                "rows": self._filas,
+                "max_entries": self.max_entries,
+                "max_rows": self.max_rows,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / consultas if consultas else 0.0,
+                "coalesced": self.coalesced,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "loading": len(self._cargando),
+                "ttl": dict(self.ttl_por_tabla),
+            }
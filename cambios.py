@@ -0,0 +1,220 @@
+"""Feed de cambios para sincronizar terminales (/consulta/{tabla}/changes).
+
+Los cambios salen de una tabla de log que llenan triggers AFTER INSERT,
+UPDATE y DELETE con un ID tomado de un generador; ``python cambios.py``
+imprime el script completo (tabla, generador, índice y un trigger por tabla
+de ``TABLAS``).
+
+El generador asigna el ID al escribir, no al confirmar: un cambio con ID
+bajo puede hacerse visible después de otro más alto si su transacción era
+larga. Por eso la marca ``since`` solo avanza sobre cambios con más de
+``margen`` segundos; los más recientes se entregan igual y vuelven a salir
+en la consulta siguiente (aplicarlos por clave en la terminal es
+idempotente).
+
+Sincronización inicial: pedir la marca sin ``since``, descargar la tabla con
+/consulta/{tabla} y desde ahí pedir solo los cambios.
+
+El último ID del log de una tabla sirve también de versión para el ETag de
+/consulta/{tabla} (``table_version``); el índice descendente permite leerlo
+sin recorrer el log.
+"""
+import datetime
+from collections import OrderedDict
+
+import fdb
+
+import config
+from db import fetch_all, fetch_in
+from metricas import count_rows, medir
+from tablas import TABLAS, build_lookup, get_tabla
+
+LOG = config.CHANGES_CONFIG['tabla']
+GENERADOR = config.CHANGES_CONFIG['generador']
+
+DDL = f"""CREATE GENERATOR {GENERADOR};
+
+CREATE TABLE {LOG} (
+    ID BIGINT NOT NULL PRIMARY KEY,
+    TABLA VARCHAR(31) NOT NULL,
+    CLAVE1 VARCHAR(60) NOT NULL,
+    CLAVE2 VARCHAR(60),
+    OPERACION CHAR(1) NOT NULL,
+    FECHA TIMESTAMP DEFAULT CURRENT_TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IDX_{LOG}_TABLA ON {LOG} (TABLA, ID);
+
+CREATE DESCENDING INDEX IDX_{LOG}_VERSION ON {LOG} (TABLA, ID);
+"""
+
+_SQL_MARCA = f"SELECT CURRENT_TIMESTAMP, GEN_ID({GENERADOR}, 0) FROM RDB$DATABASE"
+_SQL_CAMBIOS = (f"SELECT FIRST ? ID, CLAVE1, CLAVE2, OPERACION, FECHA FROM {LOG} "
+                f"WHERE TABLA = ? AND ID > ? ORDER BY ID")
+_SQL_VERSION = (f"SELECT FIRST 1 ID, FECHA, CURRENT_TIMESTAMP FROM {LOG} "
+                f"WHERE TABLA = ? ORDER BY TABLA DESC, ID DESC")
+_SQL_TRIGGER = ("SELECT 1 FROM RDB$TRIGGERS "
+                "WHERE RDB$TRIGGER_NAME = ? AND COALESCE(RDB$TRIGGER_INACTIVE, 0) = 0")
+
+# isc_dsql_relation_err: la sentencia nombra una tabla que no existe
+_GDS_TABLA_DESCONOCIDA = 335544580
+
+# Aviso de log ausente ya impreso (solo evita repetirlo en cada consulta)
+_avisado = False
+
+
+def trigger_sql(tabla):
+    """Trigger que registra en el log cada cambio de ``tabla``."""
+    clave = get_tabla(tabla)["clave"]
+    if len(clave) > 2:
+        raise ValueError(f"{tabla}: el log admite claves de hasta dos columnas")
+
+    def insertar(registro, operacion):
+        claves = [f"{registro}.{c}" for c in clave] + ["NULL"] * (2 - len(clave))
+        return (f"INSERT INTO {LOG} (ID, TABLA, CLAVE1, CLAVE2, OPERACION) "
+                f"VALUES (GEN_ID({GENERADOR}, 1), '{tabla}', {', '.join(claves)}, {operacion});")
+
+    cambio_clave = " OR ".join(f"NEW.{c} IS DISTINCT FROM OLD.{c}" for c in clave)
+    return "\n".join([
+        f"CREATE OR ALTER TRIGGER {trigger_name(tabla)} FOR {tabla.upper()}",
+        "ACTIVE AFTER INSERT OR UPDATE OR DELETE POSITION 100 AS",
+        "BEGIN",
+        "  IF (DELETING) THEN",
+        "    " + insertar("OLD", "'D'"),
+        "  ELSE",
+        "  BEGIN",
+        "    -- Si cambió la clave, la anterior desaparece para las terminales",
+        f"    IF (UPDATING AND ({cambio_clave})) THEN",
+        "      " + insertar("OLD", "'D'"),
+        "    " + insertar("NEW", "IIF(INSERTING, 'I', 'U')"),
+        "  END",
+        "END",
+    ])
+
+
+def trigger_name(tabla):
+    # Firebird limita los identificadores a 31 caracteres
+    return f"{LOG}_{tabla.upper()}"[:31]
+
+
+def script():
+    """DDL del log más un trigger por tabla expuesta, separados con SET TERM para isql."""
+    nombres = [trigger_name(tabla) for tabla in TABLAS]
+    if len(set(nombres)) != len(nombres):
+        raise ValueError("Nombres de trigger repetidos al recortarlos a 31 caracteres")
+    triggers = "\n^\n\n".join(trigger_sql(tabla) for tabla in TABLAS)
+    return f"{DDL}\nSET TERM ^ ;\n\n{triggers}\n^\n\nSET TERM ; ^\n"
+
+
+def read_changes(conn, tabla, columnas, since, limite, margen):
+    """Cambios de ``tabla`` posteriores a ``since`` con la fila vigente de cada clave.
+
+    Varios cambios de una misma clave se reducen al último: ``"U"`` con la
+    fila actual (alta o modificación) o ``"D"`` (borrada). ``columnas`` debe
+    incluir la clave.
+
+    ``"mas"`` indica que la página se llenó y hay más cambios después de
+    ella. ``siguiente`` solo pasa cambios con más de ``margen`` segundos, que
+    debe ser mayor que la transacción de escritura más larga; si la página
+    entera es más reciente, vuelve con ``"mas"`` y ``siguiente == since``: la
+    terminal espera y repite la consulta.
+    """
+    clave = get_tabla(tabla)["clave"]
+    cursor, sentencia = conn.statement(_SQL_MARCA)
+    with medir("execute", _SQL_MARCA):
+        cursor.execute(sentencia)
+    ahora, ultimo = cursor.fetchone()
+    if since is None:
+        # Marca para empezar después de una descarga completa
+        return {"tabla": tabla, "since": None, "siguiente": ultimo, "mas": False,
+                "columnas": columnas, "cambios": []}
+
+    cursor, sentencia = conn.statement(_SQL_CAMBIOS)
+    params = (limite, tabla, since)
+    with medir("execute", _SQL_CAMBIOS, params):
+        cursor.execute(sentencia, params)
+    with medir("fetch"):
+        log = cursor.fetchall()
+    count_rows(len(log), LOG)
+
+    # La marca avanza hasta el primer cambio que todavía puede tener huecos antes
+    firme = ahora - datetime.timedelta(seconds=margen)
+    siguiente = since
+    for id_cambio, _, _, _, fecha in log:
+        if fecha > firme:
+            break
+        siguiente = id_cambio
+
+    ultimos = OrderedDict()
+    for _, clave1, clave2, operacion, _ in log:
+        llave = tuple(str(v).strip() for v in (clave1, clave2)[:len(clave)])
+        ultimos.pop(llave, None)
+        ultimos[llave] = operacion.strip()
+
+    vigentes = {}
+    valores = list(dict.fromkeys(llave[0] for llave, operacion in ultimos.items() if operacion != "D"))
+    if valores:
+        # Tamaños en potencias de dos: pocas sentencias preparadas distintas
+        tamano = min(config.LOOKUP_CONFIG['chunk_size'], 1 << (len(valores) - 1).bit_length())
+        posiciones = [columnas.index(c) for c in clave]
+        for fila in fetch_in(conn, build_lookup(tabla, columnas, clave[0], tamano), valores, tamano):
+            vigentes[tuple(str(fila[p]).strip() for p in posiciones)] = list(fila)
+
+    cambios = []
+    for llave, operacion in ultimos.items():
+        fila = vigentes.get(llave) if operacion != "D" else None
+        if fila is None:
+            # Ya no existe: se borró en un cambio posterior a esta página
+            cambios.append({"op": "D", "clave": list(llave)})
+        else:
+            cambios.append({"op": "U", "clave": list(llave), "fila": fila})
+    return {"tabla": tabla, "since": since, "siguiente": siguiente,
+            "mas": len(log) == limite,
+            "columnas": columnas, "cambios": cambios}
+
+
+def table_version(conn, tabla, margen):
+    """Último ID del log de ``tabla``, o None si no hay versión confiable.
+
+    Un cambio con menos de ``margen`` segundos todavía puede tener antes
+    cambios sin confirmar que no moverían el último ID al hacerse visibles;
+    mientras tanto no hay versión y la respuesta va sin ETag. Tampoco hay
+    versión si la base no tiene el log (script de este módulo sin instalar).
+    Una tabla sin cambios en el log tiene versión 0 solo si su trigger está
+    instalado y activo: sin él el log no se movería al escribirla.
+    """
+    global _avisado
+    params = (tabla,)
+    try:
+        cursor, sentencia = conn.statement(_SQL_VERSION)
+        with medir("execute", _SQL_VERSION, params):
+            cursor.execute(sentencia, params)
+    except fdb.DatabaseError as e:
+        if len(e.args) < 3 or e.args[2] != _GDS_TABLA_DESCONOCIDA:
+            raise
+        # La transacción sigue sirviendo: la consulta de filas corre igual
+        if not _avisado:
+            _avisado = True
+            print(f"Sin log de cambios {LOG}: /consulta responde sin ETag (ver python cambios.py): {e}")
+        return None
+    fila = cursor.fetchone()
+    if fila is None:
+        params = (trigger_name(tabla),)
+        cursor, sentencia = conn.statement(_SQL_TRIGGER)
+        with medir("execute", _SQL_TRIGGER, params):
+            cursor.execute(sentencia, params)
+        return 0 if cursor.fetchone() is not None else None
+    id_cambio, fecha, ahora = fila
+    if fecha > ahora - datetime.timedelta(seconds=margen):
+        return None
+    return id_cambio
+
+
+def fetch_versioned(conn, tabla, query, params, margen):
+    """``fetch_all`` con la versión de ``tabla`` leída en la misma transacción."""
+    version = table_version(conn, tabla, margen)
+    return fetch_all(conn, query, params)._replace(version=version)
+
+
+if __name__ == "__main__":
+    print(script())
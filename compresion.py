@@ -0,0 +1,141 @@
+"""Compresión de respuestas negociada con ``Accept-Encoding``.
+
+Se ofrece ``gzip`` siempre y ``zstd`` si está instalado el paquete
+``zstandard`` (a igual calidad en ``Accept-Encoding`` se prefiere zstd).
+
+Las respuestas por stream se comprimen bloque a bloque y cada bloque sale
+con flush, de modo que el cliente lo recibe sin esperar al siguiente. Una
+respuesta completa menor que ``min_bytes`` va tal cual, igual que las que
+ya traen ``Content-Encoding`` o no tienen cuerpo (204, 304). Los bloques
+grandes se comprimen fuera del event loop.
+"""
+import zlib
+
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import MutableHeaders
+
+try:
+    import zstandard
+except ImportError:  # opcional: sin el paquete solo se ofrece gzip
+    zstandard = None
+
+# Bloques desde este tamaño se comprimen en el threadpool
+_EN_HILO = 64 * 1024
+
+
+class _Gzip:
+    def __init__(self, nivel):
+        # wbits 31: formato gzip (cabecera y CRC) en vez de zlib
+        self._z = zlib.compressobj(nivel, zlib.DEFLATED, 31)
+
+    def chunk(self, datos):
+        return self._z.compress(datos) + self._z.flush(zlib.Z_SYNC_FLUSH)
+
+    def end(self, datos):
+        return self._z.compress(datos) + self._z.flush()
+
+
+class _Zstd:
+    def __init__(self, nivel):
+        self._z = zstandard.ZstdCompressor(level=nivel).compressobj()
+
+    def chunk(self, datos):
+        return self._z.compress(datos) + self._z.flush(zstandard.COMPRESSOBJ_FLUSH_BLOCK)
+
+    def end(self, datos):
+        return self._z.compress(datos) + self._z.flush()
+
+
+def available_encodings():
+    """Codificaciones ofrecidas, en orden de preferencia."""
+    return ("zstd", "gzip") if zstandard is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding, disponibles):
+    """La codificación de ``disponibles`` con mayor calidad en ``Accept-Encoding``, o None."""
+    calidades = {}
+    for parte in accept_encoding.split(","):
+        nombre, _, parametros = parte.strip().partition(";")
+        calidad = 1.0
+        for parametro in parametros.split(";"):
+            clave, _, valor = parametro.strip().partition("=")
+            if clave == "q":
+                try:
+                    calidad = float(valor)
+                except ValueError:
+                    calidad = 0.0
+        calidades[nombre.strip().lower()] = calidad
+    mejor = None
+    for nombre in disponibles:
+        calidad = calidades.get(nombre, calidades.get("*", 0.0))
+        if calidad > 0 and (mejor is None or calidad > mejor[0]):
+            mejor = (calidad, nombre)
+    return mejor[1] if mejor else None
+
+
+class CompressionMiddleware:
+    """Middleware ASGI: comprime el cuerpo de la respuesta con gzip o zstd."""
+
+    def __init__(self, app, min_bytes=1024, gzip_nivel=6, zstd_nivel=3):
+        self.app = app
+        self.min_bytes = min_bytes
+        self.niveles = {"gzip": gzip_nivel, "zstd": zstd_nivel}
+        self.disponibles = available_encodings()
+
+    def _compresor(self, codificacion):
+        clase = _Zstd if codificacion == "zstd" else _Gzip
+        return clase(self.niveles[codificacion])
+
+    async def _comprimir(self, funcion, datos):
+        if len(datos) >= _EN_HILO:
+            return await run_in_threadpool(funcion, datos)
+        return funcion(datos)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        pedida = dict(scope["headers"]).get(b"accept-encoding", b"").decode("latin-1")
+        codificacion = choose_encoding(pedida, self.disponibles) if pedida else None
+        if codificacion is None:
+            await self.app(scope, receive, send)
+            return
+        estado = {"inicio": None, "compresor": None, "directo": False}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                # Sale con el primer bloque, cuando ya se sabe si se comprime
+                estado["inicio"] = mensaje
+                return
+            if mensaje["type"] != "http.response.body" or estado["directo"]:
+                await send(mensaje)
+                return
+            cuerpo = mensaje.get("body", b"")
+            mas = mensaje.get("more_body", False)
+            compresor = estado["compresor"]
+            if compresor is None:
+                inicio = estado["inicio"]
+                headers = MutableHeaders(raw=inicio["headers"])
+                if ("content-encoding" in headers or inicio["status"] in (204, 304)
+                        or (not mas and len(cuerpo) < self.min_bytes)):
+                    estado["directo"] = True
+                    await send(inicio)
+                    await send(mensaje)
+                    return
+                compresor = estado["compresor"] = self._compresor(codificacion)
+                if "content-length" in headers:
+                    del headers["content-length"]
+                headers["content-encoding"] = codificacion
+                headers.add_vary_header("Accept-Encoding")
+                if not mas:
+                    datos = await self._comprimir(compresor.end, cuerpo)
+                    headers["content-length"] = str(len(datos))
+                    await send(inicio)
+                    await send({"type": "http.response.body", "body": datos})
+                    return
+                await send(inicio)
+            datos = await self._comprimir(compresor.chunk if mas else compresor.end, cuerpo)
+            if datos or not mas:
+                await send({"type": "http.response.body", "body": datos, "more_body": mas})
+
+        await self.app(scope, receive, enviar)
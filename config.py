@@ -1,5 +1,143 @@
 DB_CONFIG = {
     'dsn': 'localhost:L:/DYNAMO.fdb',
     'user': 'SYSDBA',
-    'password': 'masterkey'
-}
\ No newline at end of file
+    'password': 'masterkey',
+    # Réplicas de solo lectura para /consulta; cada una tiene su pool. 'user',
+    # 'password' y 'pool' (claves de POOL_CONFIG) son opcionales, p. ej.
+    # {'dsn': 'replica1:L:/DYNAMO.fdb', 'pool': {'max_size': 20}}
+    'replicas': []
+}
+
+# Pool de conexiones (segundos para los tiempos)
+POOL_CONFIG = {
+    'min_size': 2,
+    'max_size': 10,
+    'idle_timeout': 300,
+    'checkout_timeout': 10,
+    'validation_interval': 5,
+    'statement_cache_size': 64,  # sentencias preparadas por conexión (0 = sin caché)
+    'statement_timeouts': False  # Firebird 4+: el servidor corta cada sentencia al vencer su timeout
+}
+
+# Hilos dedicados a las llamadas fdb; por defecto uno por conexión de la
+# primaria y de cada réplica. 'timeout' es el máximo en segundos de cada
+# operación antes de cancelarla.
+EXECUTOR_CONFIG = {
+    'max_workers': sum(dict(POOL_CONFIG, **r.get('pool', {}))['max_size']
+                       for r in [{}] + DB_CONFIG['replicas']),
+    'timeout': 30
+}
+
+# Respuestas por bloques de /consulta/{tabla}?stream=true (filas por fetchmany)
+STREAM_CONFIG = {
+    'chunk_size': 500
+}
+
+# Paginación por clave de /consulta/{tabla}?limit=&after=
+PAGINATION_CONFIG = {
+    'max_limit': 5000
+}
+
+# Caché en memoria de /consulta/{tabla}: TTL en segundos por tabla (las que no
+# aparecen van siempre a la base) y límites para el desalojo LRU
+CACHE_CONFIG = {
+    'max_entries': 256,
+    'max_rows': 200000,
+    'tablas': {
+        'paises': 3600,
+        'departamentos_elect': 3600,
+        'ciudades_elect': 3600,
+        'tributos': 3600,
+        'obligaciones_rut': 3600,
+        'actividad_eco_enc': 3600,
+        'tributaria_tipodocumento': 3600,
+        'tributaria_tipocontribuyente': 3600
+    }
+}
+
+# Inserción por lotes (/insertar/{tabla}/lote): máximo de filas por petición
+BULK_CONFIG = {
+    'max_batch': 1000
+}
+
+# Búsqueda por lote (/consulta/{tabla}/lote): valores por IN (...) y máximo por petición
+LOOKUP_CONFIG = {
+    'chunk_size': 100,
+    'max_keys': 5000
+}
+
+# Métricas (/metrics): sentencias que tardan más que esto (segundos) van al log
+# "api.slow_query" con su SQL y parámetros
+METRICS_CONFIG = {
+    'slow_query_seconds': 1.0
+}
+
+# Ingesta asíncrona (/insertar/*?asincrono=true): journal local, registros por
+# commit, espera en segundos para juntar un lote, tabla de control contra
+# duplicados al reanudar (None la desactiva) y errores seguidos de la base con
+# un lote antes de marcar sus tickets como fallidos
+INGEST_CONFIG = {
+    'journal': 'ingesta.journal',
+    'max_lote': 500,
+    'espera': 0.05,
+    'max_pendientes': 100000,
+    'fsync': True,
+    'tabla_control': 'API_INGESTA',
+    'retener': 10000,
+    'max_reintentos': 5
+}
+
+# Feed de cambios (/consulta/{tabla}/changes): tabla y generador que llenan los
+# triggers (script en cambios.py), máximo de cambios por respuesta y segundos
+# que debe tener un cambio para avanzar la marca (mayor que la transacción de
+# escritura más larga). Con 'etag', /consulta/{tabla} usa el último cambio de
+# la tabla como versión para ETag / If-None-Match (304).
+CHANGES_CONFIG = {
+    'tabla': 'API_CAMBIOS',
+    'generador': 'GEN_API_CAMBIOS',
+    'max_limit': 5000,
+    'margen': 60,
+    'etag': True
+}
+
+# Compresión de las respuestas según Accept-Encoding (gzip, o zstd si está
+# instalado zstandard): bytes mínimos de una respuesta completa para
+# comprimirla y nivel de cada algoritmo
+COMPRESSION_CONFIG = {
+    'min_bytes': 1024,
+    'gzip_nivel': 6,
+    'zstd_nivel': 3
+}
+
+# Lecturas en réplicas: 'estrategia' es 'round_robin' o 'least_connections';
+# una réplica sale tras 'max_fallos' errores seguidos y se vuelve a probar cada
+# 'health_interval' segundos. Las escrituras siempre van a la primaria.
+ROUTING_CONFIG = {
+    'estrategia': 'least_connections',
+    'max_fallos': 3,
+    'health_interval': 5
+}
+
+# Reportes agregados (/reportes/{reporte}): días máximos por consulta, segundos
+# que se guardan el día en curso y los días cerrados, y días cerrados en memoria
+REPORTS_CONFIG = {
+    'max_dias': 366,
+    'ttl_hoy': 30,
+    'ttl_cerrados': 21600,
+    'max_entries': 20000
+}
+
+# Control de admisión (ver admision.py). Por clase: peticiones simultáneas,
+# máximo en cola (más allá, 429), segundos de espera en cola (después, 503) y
+# timeout en segundos de sus operaciones de base de datos. 'reserva_escritura'
+# son conexiones de la primaria que las lecturas no pueden tomar y
+# 'retry_after' los segundos que se sugieren al cliente rechazado.
+ADMISSION_CONFIG = {
+    'clases': {
+        'escritura': {'concurrencia': 32, 'cola': 500, 'espera': 5, 'timeout': 30},
+        'lectura': {'concurrencia': 32, 'cola': 200, 'espera': 2, 'timeout': 10},
+        'lectura_pesada': {'concurrencia': 4, 'cola': 16, 'espera': 10, 'timeout': 60},
+    },
+    'reserva_escritura': 3,
+    'retry_after': 1
+}
@@ -0,0 +1,419 @@
+import asyncio
+import contextvars
+import threading
+import weakref
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+
+import admision
+import config  #  DB Parms
+from admision import Cupos, EsperaVencida
+from metricas import count_rows, medir
+from pool import ConnectionPool, PoolTimeout
+from replicas import ReplicaRouter
+
+pool = ConnectionPool(dsn=config.DB_CONFIG['dsn'],
+                      user=config.DB_CONFIG['user'],
+                      password=config.DB_CONFIG['password'],
+                      **config.POOL_CONFIG)
+
+# Réplicas de solo lectura; las escrituras siempre usan ``pool`` (la primaria)
+router = ReplicaRouter(pool,
+                       [ConnectionPool(dsn=replica['dsn'],
+                                       user=replica.get('user', config.DB_CONFIG['user']),
+                                       password=replica.get('password', config.DB_CONFIG['password']),
+                                       **dict(config.POOL_CONFIG, **replica.get('pool', {})))
+                        for replica in config.DB_CONFIG.get('replicas', [])],
+                       estrategia=config.ROUTING_CONFIG['estrategia'],
+                       max_fallos=config.ROUTING_CONFIG['max_fallos'],
+                       health_interval=config.ROUTING_CONFIG['health_interval'])
+
+# fdb es bloqueante: todo el trabajo de base de datos corre en estos hilos y
+# no en el event loop de uvicorn
+# Filas de una consulta con los nombres de columna de cursor.description (y la
+# versión de la tabla si se leyó con ``cambios.fetch_versioned``)
+Resultado = namedtuple("Resultado", ["columnas", "filas", "version"], defaults=(None,))
+
+db_executor = ThreadPoolExecutor(max_workers=config.EXECUTOR_CONFIG['max_workers'],
+                                 thread_name_prefix="fdb")
+
+# fb_cancel_operation es una llamada de red: corre en su propio hilo para que
+# un servidor lento no frene el event loop justo cuando vencen los timeouts
+_cancelador = ThreadPoolExecutor(max_workers=1, thread_name_prefix="fdb-cancel")
+
+
+def _error_conexion(e):
+    if isinstance(e, PoolTimeout):
+        print(f"Pool saturado: {e}")
+        return HTTPException(status_code=503, detail=f"Database pool exhausted: {str(e)}")
+    print(f"Error de conexión: {e}")
+    return HTTPException(status_code=500, detail=f"Database connection error: {str(e)}")
+
+
+def column_names(description):
+    return [columna[0] for columna in description or []]
+
+
+def fetch_all(conn, query, params=()):
+    """Ejecuta ``query`` con su sentencia preparada y devuelve un ``Resultado``."""
+    cursor, sentencia = conn.statement(query)
+    with medir("execute", query, params):
+        cursor.execute(sentencia, params)
+    with medir("fetch"):
+        filas = cursor.fetchall()
+    count_rows(len(filas))
+    return Resultado(column_names(cursor.description), filas)
+
+
+def fetch_in(conn, query, valores, tamano):
+    """Ejecuta ``query`` (un ``IN`` de ``tamano`` marcadores) por bloques de ``valores``.
+
+    El último bloque se rellena repitiendo un valor para que todos usen el
+    mismo texto SQL y la misma sentencia preparada.
+    """
+    cursor, sentencia = conn.statement(query)
+    filas = []
+    for inicio in range(0, len(valores), tamano):
+        bloque = valores[inicio:inicio + tamano]
+        bloque += [bloque[-1]] * (tamano - len(bloque))
+        with medir("execute", query, bloque):
+            cursor.execute(sentencia, bloque)
+        with medir("fetch"):
+            filas.extend(cursor.fetchall())
+    count_rows(len(filas))
+    return filas
+
+
+def _submit(fn, *args):
+    # Copiamos el contexto para que las métricas sepan la ruta y la tabla
+    return db_executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+# Conexiones repartidas desde el event loop, un ``Cupos`` por loop y por pool.
+# Una operación toma su cupo antes de ocupar un hilo del executor y lo devuelve
+# cuando ya soltó la conexión. Sin esto los hilos podían quedar todos
+# bloqueados en ``pool.acquire`` mientras las conexiones las tenían streams que
+# necesitaban un hilo libre para leer el bloque siguiente o devolverlas. Con
+# tantos hilos como conexiones (``EXECUTOR_CONFIG``) quien tiene cupo siempre
+# encuentra hilo. En la primaria, ``reserva_escritura`` cupos quedan para lo
+# que no es lectura.
+_cupos = weakref.WeakKeyDictionary()
+
+
+def _cupos_de(destino):
+    loop = asyncio.get_running_loop()
+    por_pool = _cupos.setdefault(loop, {})
+    if destino not in por_pool:
+        reserva = config.ADMISSION_CONFIG['reserva_escritura'] if destino is pool else 0
+        por_pool[destino] = Cupos(destino.max_size, reservados=min(reserva, destino.max_size - 1))
+    return por_pool[destino]
+
+
+async def _tomar(destino):
+    # Devuelve los cupos tomados y una función para soltarlos desde cualquier hilo
+    cupos = _cupos_de(destino)
+    try:
+        await cupos.tomar(destino.checkout_timeout, prioritario=not admision.es_lectura())
+    except EsperaVencida:
+        raise PoolTimeout(f"Sin conexiones disponibles tras {destino.checkout_timeout}s "
+                          f"(max_size={destino.max_size})")
+    loop = asyncio.get_running_loop()
+
+    def soltar():
+        try:
+            loop.call_soon_threadsafe(cupos.devolver)
+        except RuntimeError:
+            # El loop ya cerró (apagado de la app)
+            pass
+    return cupos, soltar
+
+
+async def _en_hilo(destino, fn, *args):
+    """Corre ``fn`` en el executor con un cupo de ``destino``.
+
+    El cupo se devuelve cuando termina el hilo, aunque la corrutina haya
+    dejado de esperar por timeout o cancelación.
+    """
+    cupos, soltar = await _tomar(destino)
+    try:
+        futuro = _submit(fn, *args)
+    except BaseException:
+        cupos.devolver()
+        raise
+    futuro.add_done_callback(lambda _: soltar())
+    return await asyncio.wrap_future(futuro)
+
+
+class _Reintentar(Exception):
+    """La réplica no atendió la lectura; se repite en la primaria."""
+
+
+def _conectar(destino, lectura):
+    # En el hilo, con el cupo ya tomado; si una réplica falla la lectura pasa a la primaria
+    try:
+        conn = destino.acquire()
+    except Exception as e:
+        if destino is pool:
+            raise _error_conexion(e)
+        if isinstance(e, PoolTimeout):
+            router.saturated(destino)
+        else:
+            router.unavailable(destino, e)
+        raise _Reintentar() from e
+    if lectura:
+        router.read(destino)
+    return conn
+
+
+class _Operacion:
+    """Estado compartido entre la corrutina y el hilo que ejecuta la operación."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.conn = None
+        self.cancelada = False
+
+    def cancelar(self):
+        """Marca la operación cancelada y aborta su sentencia sin esperar."""
+        with self.lock:
+            self.cancelada = True
+            en_curso = self.conn is not None
+        if en_curso:
+            _cancelador.submit(self._abortar)
+
+    def _abortar(self):
+        # Con el lock tomado el hilo de trabajo no devuelve la conexión al
+        # pool a mitad de la cancelación (no se aborta la sentencia de otro)
+        with self.lock:
+            if self.conn is not None:
+                try:
+                    self.conn.cancel()
+                except Exception as e:
+                    print(f"Error al cancelar la operación: {e}")
+
+
+def _ejecutar(op, destino, conn, fn, args, timeout):
+    # Corre ``fn`` sobre ``conn`` dejándola cancelable y la devuelve a ``destino``
+    try:
+        with op.lock:
+            if op.cancelada:
+                return None
+            op.conn = conn
+        try:
+            if destino.statement_timeouts:
+                conn.set_statement_timeout(timeout)
+            return fn(conn, *args)
+        finally:
+            with op.lock:
+                op.conn = None
+    finally:
+        destino.release(conn)
+
+
+async def run_db(fn, *args, timeout=None, lectura=False):
+    """Ejecuta ``fn(conn, *args)`` en el executor de base de datos.
+
+    Si la operación supera ``timeout`` segundos (por defecto el de la clase
+    de la petición, ver ``admision``) o la petición se cancela, se aborta la
+    sentencia en Firebird y se responde 504. Con ``lectura`` puede correr en
+    una réplica; si allí falla se repite en la primaria.
+    """
+    if timeout is None:
+        timeout = admision.timeout()
+    op = _Operacion()
+
+    def trabajo(destino):
+        if op.cancelada:
+            # La petición expiró mientras esperaba un hilo libre
+            return None
+        conn = _conectar(destino, lectura)
+        if destino is pool:
+            return _ejecutar(op, pool, conn, fn, args, timeout)
+        try:
+            resultado = _ejecutar(op, destino, conn, fn, args, timeout)
+        except HTTPException:
+            raise
+        except Exception as e:
+            if op.cancelada:
+                raise
+            router.failed(destino, e)
+            raise _Reintentar() from e
+        router.succeeded(destino)
+        return resultado
+
+    async def ejecutar():
+        replica = router.choose() if lectura else None
+        if replica is not None:
+            try:
+                return await _en_hilo(replica.pool, trabajo, replica.pool)
+            except PoolTimeout:
+                router.saturated(replica.pool)
+            except _Reintentar:
+                pass
+            # Una lectura se puede repetir: la seguimos en la primaria
+        return await _en_hilo(pool, trabajo, pool)
+
+    try:
+        return await asyncio.wait_for(ejecutar(), timeout)
+    except asyncio.TimeoutError:
+        op.cancelar()
+        raise HTTPException(status_code=504, detail=f"Database operation timed out after {timeout}s")
+    except asyncio.CancelledError:
+        op.cancelar()
+        raise
+    except PoolTimeout as e:
+        raise _error_conexion(e)
+
+
+def _esperar(futuro, timeout, op):
+    """Espera un futuro del executor aplicando timeout y cancelación."""
+    async def esperar():
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(futuro), timeout)
+        except asyncio.TimeoutError:
+            op.cancelar()
+            raise HTTPException(status_code=504, detail=f"Database operation timed out after {timeout}s")
+        except asyncio.CancelledError:
+            op.cancelar()
+            raise
+    return esperar()
+
+
+class StreamedQuery:
+    """Consulta leída por bloques con ``fetchmany`` sobre una conexión del pool.
+
+    ``open()`` toma la conexión y ejecuta la sentencia, de modo que los
+    errores se reportan antes de empezar la respuesta; ``chunks()`` entrega
+    listas de filas y devuelve la conexión al pool al terminar, al fallar o
+    cuando el cliente se desconecta.
+
+    ``version(conn)``, si se pasa, corre en la misma conexión antes de la
+    consulta y su resultado queda en ``self.version``.
+    """
+
+    def __init__(self, query, params=None, chunk_size=500, timeout=None, lectura=False, version=None):
+        self.query = query
+        self.params = params or ()
+        self.chunk_size = chunk_size
+        self.timeout = admision.timeout() if timeout is None else timeout
+        self.lectura = lectura
+        self._leer_version = version
+        self.version = None
+        self.columnas = None
+        self._op = _Operacion()
+        self._pool = pool
+        self._soltar = None
+        self._cursor = None
+        self._ultimo = None
+        self._cerrada = False
+
+    def _abrir(self, destino):
+        conn = _conectar(destino, self.lectura)
+        self._pool = destino
+        with self._op.lock:
+            self._op.conn = conn
+        try:
+            if destino.statement_timeouts:
+                # En Firebird el límite cuenta hasta el último fetch y cortaría una
+                # exportación larga; aquí rige el timeout por bloque de ``_esperar``
+                conn.set_statement_timeout(0)
+            if self._leer_version is not None:
+                self.version = self._leer_version(conn)
+            cursor, sentencia = conn.statement(self.query)
+            with medir("execute", self.query, self.params):
+                cursor.execute(sentencia, self.params)
+        except Exception as e:
+            if destino is pool or self._op.cancelada:
+                raise
+            # Igual que en run_db: la réplica cuenta el fallo y se abre en la primaria
+            router.failed(destino, e)
+            with self._op.lock:
+                self._op.conn = None
+            destino.release(conn)
+            raise _Reintentar() from e
+        if destino is not pool:
+            router.succeeded(destino)
+        return cursor
+
+    def _fetch(self):
+        with medir("fetch"):
+            filas = self._cursor.fetchmany(self.chunk_size)
+        count_rows(len(filas))
+        return filas
+
+    def _liberar(self):
+        with self._op.lock:
+            conn, self._op.conn = self._op.conn, None
+        try:
+            if conn is not None:
+                self._pool.release(conn)
+        finally:
+            if self._soltar is not None:
+                self._soltar()
+
+    async def _conectar(self, destino):
+        # El cupo queda tomado hasta que ``_liberar`` devuelva la conexión
+        cupos, self._soltar = await _tomar(destino)
+        self._ultimo = _submit(self._abrir, destino)
+        try:
+            self._cursor = await _esperar(self._ultimo, self.timeout, self._op)
+        except _Reintentar:
+            self._soltar = None
+            cupos.devolver()
+            raise
+
+    async def open(self):
+        try:
+            replica = router.choose() if self.lectura else None
+            if replica is not None:
+                try:
+                    await self._conectar(replica.pool)
+                except PoolTimeout:
+                    router.saturated(replica.pool)
+                except _Reintentar:
+                    pass
+            if self._cursor is None:
+                await self._conectar(pool)
+        except PoolTimeout as e:
+            self.close()
+            raise _error_conexion(e)
+        except BaseException:
+            self.close()
+            raise
+        self.columnas = column_names(self._cursor.description)
+        return self
+
+    async def chunks(self, request=None):
+        try:
+            while True:
+                if request is not None and await request.is_disconnected():
+                    # El cliente se fue: no seguimos leyendo de Firebird
+                    break
+                self._ultimo = _submit(self._fetch)
+                filas = await _esperar(self._ultimo, self.timeout, self._op)
+                if not filas:
+                    break
+                yield filas
+        finally:
+            self.close()
+
+    def close(self):
+        if self._cerrada:
+            return
+        self._cerrada = True
+        # Liberamos solo cuando termine la última llamada en curso sobre la
+        # conexión, para no hacer rollback mientras otro hilo la usa
+        if self._ultimo is None or self._ultimo.done():
+            db_executor.submit(self._liberar)
+        else:
+            self._ultimo.add_done_callback(lambda _: db_executor.submit(self._liberar))
+
+
+def close():
+    """Libera los hilos y las conexiones; se llama al apagar la app."""
+    db_executor.shutdown(wait=False)
+    _cancelador.shutdown(wait=False)
+    router.close()
+    pool.close()
@@ -0,0 +1,384 @@
+from functools import lru_cache
+from itertools import groupby
+
+import fdb
+from fastapi import HTTPException
+
+from metricas import count_rows, medir
+from tablas import TABLAS
+
+# Sentencias INSERT por tabla. 'campos' son los campos requeridos del payload
+# en el orden de los parámetros; 'columnas' traduce los que se llaman distinto
+# en la tabla y 'fijos' agrega columnas con valor constante.
+INSERTS = {
+    "cust": {
+        "campos": [
+            'ID_N', 'COMPANY', 'ADDR1', 'CITY', 'PAIS', 'PHONE1', 'GRAVABLE', 'CLIENTE',
+            'TIPOEMP', 'IDVEND', 'CV', 'FECHA_CREACION', 'EMAIL', 'DEPARTAMENTO', 'REGIMEN', 'RESIDENTE'
+        ],
+        "fijos": {'INACTIVO': "'N'"},
+    },
+    "shipto": {
+        "campos": [
+            'ID_N', 'SUCCLIENTE', 'COMPANY', 'ADDR1', 'PHONE1', 'ID_VEND', 'PAIS', 'EMAIL', 'DEPARTAMENTO',
+            'PRIMER_APELLIDO', 'SEGUNDO_APELLIDO', 'PRIMER_NOMBRE', 'SEGUNDO_NOMBRE', 'FECHA_NACIMIENTO',
+            'COD_DPTO', 'COD_MUNICIPIO', 'CITY', 'ESTADO', 'EMAIL_FAC_ELEC'
+        ],
+    },
+    "tributaria": {
+        "campos": [
+            'ID_N', 'COMPANY', 'TDOC', 'CV', 'TIPO_CONTRIBUYENTE', 'PRIMER_NOMBRE', 'SEGUNDO_NOMBRE',
+            'PRIMER_APELLIDO', 'SEGUNDO_APELLIDO'
+        ],
+    },
+    "actividad_eco_det": {
+        "campos": ['CODACT', 'ID_N', 'PRINCIPAL', 'COD_INTERNACIONAL'],
+    },
+    "obligaciones_rutdet": {
+        "campos": ['CODIGO', 'ID_N'],
+    },
+    "tributosdet": {
+        "campos": ['CODIGO', 'ID_N'],
+    },
+    "oe": {
+        "campos": [
+            'ID_EMPRESA', 'ID_SUCURSAL', 'NUMBER', 'TIPO', 'ID_USUARIO', 'ID_N',
+            'SALESMAN', 'FECHA', 'DUEDATE', 'SUBTOTAL', 'COST', 'SALESTAX', 'DESTOTAL',
+            'TOTAL', 'PAGOS', 'DEV_FACTURA', 'DEV_TIPOFACT', 'LETRAS', 'D', 'PORCENIVA',
+            'FORPAGVAL', 'FORMAS_PAGO', 'HORACRE', 'CUFE', 'PREFIJO_POS'
+        ],
+        "columnas": {'DEV_TIPOFACT': 'DEV_TIPOFAC', 'HORACRE': 'HORCRE'},
+    },
+    "oedet": {
+        "campos": [
+            'CONTEO', 'ID_EMPRESA', 'ID_SUCURSAL', 'NUMBER', 'TIPO', 'ID_USUARIO', 'ITEM',
+            'LOCATION', 'IVA', 'QTYSHIP', 'PRICE', 'EXTEND', 'COST', 'TOTALDCT', 'VLR_IVA',
+            'PORC_IVA', 'PRECIOIVA', 'VLR_DCTOAD1', 'DPTO', 'CCOST', 'NUMITEM', 'COD_TALLA', 'CODBARRASCURVA'
+        ],
+    },
+    "pagos": {
+        "campos": [
+            'ID_EMPRESA', 'ID_SUCURSAL', 'NUMERO', 'TIPO', 'USUARIO', 'ACCT', 'CONCEPTO',
+            'DESCRIPCION', 'PORC', 'FECHA', 'NUM_DOC', 'VLR_PAGO', 'CONTA', 'ID_N', 'VALORECIB', 'CONTEO'
+        ],
+        "columnas": {'ID_EMPRESA': 'EMPRESA', 'ID_SUCURSAL': 'SUCURSAL', 'VALORECIB': 'VALRECIB'},
+    },
+    "itemact": {
+        "campos": [
+            'LOCATION', 'ITEM', 'TIPO', 'BATCH', 'FECHA', 'QTY', 'NUMITEM',
+            'COD_TALLA', 'VALUNIT', 'COSTOP', 'TOTPARCIAL'
+        ],
+    },
+}
+
+
+def _build_insert(tabla, definicion):
+    alias = definicion.get("columnas", {})
+    fijos = definicion.get("fijos", {})
+    columnas = [alias.get(c, c) for c in definicion["campos"]] + list(fijos)
+    valores = ["?"] * len(definicion["campos"]) + list(fijos.values())
+    return f"INSERT INTO {tabla} ({', '.join(columnas)}) VALUES ({', '.join(valores)})"
+
+
+# El texto de cada INSERT se arma una sola vez: siempre es el mismo para la tabla
+for _tabla, _definicion in INSERTS.items():
+    _definicion["sql"] = _build_insert(_tabla, _definicion)
+
+
+def missing_field(tabla, datos):
+    """Primer campo requerido que falta en ``datos`` o None."""
+    if not isinstance(datos, dict):
+        return "(se esperaba un objeto)"
+    for field in INSERTS[tabla]["campos"]:
+        if field not in datos:
+            return field
+    return None
+
+
+def check_required(tabla, datos):
+    # Verificar que todos los campos requeridos estén presentes
+    field = missing_field(tabla, datos)
+    if field is not None:
+        raise HTTPException(status_code=400, detail=f"Falta el campo requerido: {field}")
+
+
+# SQLCODE de las fallas de conexión o del servidor y GDS de la sentencia cancelada
+_SQLCODE_SERVIDOR = -902
+_GDS_CANCELADA = 335544794
+
+
+def row_error(e):
+    """True si ``e`` es un rechazo de los datos de la fila y no una falla del servidor.
+
+    Restricciones, claves foráneas, conversiones y textos demasiado largos
+    van como error de la fila (fdb valida tipos y largos antes de enviar,
+    con ValueError/TypeError); la conexión perdida o la cancelación cortan
+    el lote.
+    """
+    if isinstance(e, (ValueError, TypeError)):
+        return True
+    if not isinstance(e, fdb.DatabaseError):
+        return False
+    sqlcode = e.args[1] if len(e.args) > 1 else None
+    gdscode = e.args[2] if len(e.args) > 2 else None
+    return sqlcode != _SQLCODE_SERVIDOR and gdscode != _GDS_CANCELADA
+
+
+def insert_params(tabla, datos):
+    return tuple(datos[field] for field in INSERTS[tabla]["campos"])
+
+
+def insert_row(conn, tabla, datos):
+    sql = INSERTS[tabla]["sql"]
+    params = insert_params(tabla, datos)
+    cursor, sentencia = conn.statement(sql)
+    with medir("execute", sql, params, tabla):
+        cursor.execute(sentencia, params)
+    count_rows(1, tabla)
+
+
+def _execute_many(conn, tabla, sql, params):
+    """``executemany`` de ``sql`` dentro de la transacción en curso.
+
+    Si falla, deshace el lote y lo repite fila por fila con un savepoint por
+    fila para saber cuáles fallan; las filas válidas quedan aplicadas.
+    Devuelve los errores como ``[{"fila": indice, "error": mensaje}]``; un
+    error que no es de la fila (ver ``row_error``) se propaga.
+    """
+    cursor, sentencia = conn.statement(sql)
+    conn.savepoint("LOTE")
+    try:
+        with medir("execute", sql, params[0] if params else None, tabla, filas=len(params)):
+            cursor.executemany(sentencia, params)
+        count_rows(len(params), tabla)
+        return []
+    except Exception:
+        conn.rollback(savepoint="LOTE")
+
+    # Camino lento: solo se recorre cuando el lote tiene filas inválidas
+    errores = []
+    for indice, fila in enumerate(params):
+        conn.savepoint("FILA_LOTE")
+        try:
+            with medir("execute", sql, fila, tabla):
+                cursor.execute(sentencia, fila)
+            count_rows(1, tabla)
+        except Exception as e:
+            if not row_error(e):
+                raise
+            conn.rollback(savepoint="FILA_LOTE")
+            errores.append({"fila": indice, "error": str(e)})
+    return errores
+
+
+def _insert_many(conn, tabla, params):
+    return _execute_many(conn, tabla, INSERTS[tabla]["sql"], params)
+
+
+def insert_batch(conn, tabla, filas, parcial=False):
+    """Inserta ``filas`` con un solo ``executemany`` y un solo commit.
+
+    Con ``parcial`` se confirman las filas válidas; si no, basta un error
+    para no insertar nada. Devuelve ``(insertadas, errores)``.
+    """
+    params = [insert_params(tabla, datos) for datos in filas]
+    errores = _insert_many(conn, tabla, params)
+    if errores and not parcial:
+        conn.rollback()
+        return 0, errores
+    conn.commit()
+    return len(params) - len(errores), errores
+
+
+def insert_group(conn, registros):
+    """Inserta ``registros`` (``[(tabla, datos), ...]``) en la transacción en curso.
+
+    Cada tramo consecutivo de la misma tabla va en un ``executemany``, así se
+    respeta el orden de llegada. No confirma; devuelve ``{indice: mensaje}``
+    de las filas que fallaron (las demás quedan aplicadas).
+    """
+    errores = {}
+    posicion = 0
+    for tabla, tramo in groupby(registros, key=lambda registro: registro[0]):
+        indices, params = [], []
+        for _, datos in tramo:
+            # Un registro inválido es un error de su fila, no de todo el grupo
+            field = missing_field(tabla, datos) if tabla in INSERTS else None
+            if tabla not in INSERTS:
+                errores[posicion] = f"Tabla no admitida: {tabla}"
+            elif field is not None:
+                errores[posicion] = f"Falta el campo requerido: {field}"
+            else:
+                indices.append(posicion)
+                params.append(insert_params(tabla, datos))
+            posicion += 1
+        if params:
+            for error in _insert_many(conn, tabla, params):
+                errores[indices[error["fila"]]] = error["error"]
+    return errores
+
+
+# Secciones de /documentos en el orden en que se escriben
+SECCIONES_DOCUMENTO = ["oedet", "pagos", "itemact"]
+
+# Campos de las líneas que se toman del encabezado oe cuando no vienen
+HEREDADOS_OE = {
+    "oedet": ['ID_EMPRESA', 'ID_SUCURSAL', 'NUMBER', 'TIPO', 'ID_USUARIO'],
+}
+
+
+def prepare_document(documento):
+    """Valida un documento completo antes de tocar la base.
+
+    Completa las líneas con los campos del encabezado y devuelve la lista
+    de errores por sección y fila (vacía si todo está bien).
+    """
+    errores = []
+    if not isinstance(documento.get("oe"), dict):
+        return [{"seccion": "oe", "error": "Falta el encabezado oe"}]
+    field = missing_field("oe", documento["oe"])
+    if field is not None:
+        errores.append({"seccion": "oe", "error": f"Falta el campo requerido: {field}"})
+
+    for seccion in SECCIONES_DOCUMENTO:
+        filas = documento.setdefault(seccion, [])
+        if not isinstance(filas, list):
+            errores.append({"seccion": seccion, "error": "Se esperaba una lista"})
+            continue
+        for indice, datos in enumerate(filas):
+            if isinstance(datos, dict):
+                for campo in HEREDADOS_OE.get(seccion, []):
+                    if campo not in datos and campo in documento["oe"]:
+                        datos[campo] = documento["oe"][campo]
+            field = missing_field(seccion, datos)
+            if field is not None:
+                errores.append({"seccion": seccion, "fila": indice,
+                                "error": f"Falta el campo requerido: {field}"})
+    return errores
+
+
+def insert_document(conn, documento):
+    """Escribe encabezado, líneas, pagos y movimientos en una sola transacción.
+
+    Cada sección va en un ``executemany``. Si algo falla se deshace todo y se
+    devuelven los errores por sección y fila; si no, se confirma una vez.
+    """
+    try:
+        insert_row(conn, "oe", documento["oe"])
+    except Exception as e:
+        if not row_error(e):
+            raise
+        conn.rollback()
+        return [{"seccion": "oe", "error": str(e)}]
+
+    errores = []
+    for seccion in SECCIONES_DOCUMENTO:
+        params = [insert_params(seccion, datos) for datos in documento[seccion]]
+        if params:
+            for error in _insert_many(conn, seccion, params):
+                errores.append(dict(error, seccion=seccion))
+    if errores:
+        conn.rollback()
+        return errores
+    conn.commit()
+    return []
+
+
+# /actualizar/{tabla}/lote: las columnas admitidas y la clave salen de TABLAS
+
+
+@lru_cache(maxsize=256)
+def build_upsert(tabla, campos, insertar=True):
+    """Sentencia para actualizar ``campos`` (tupla ordenada) de ``tabla`` por clave.
+
+    Con ``insertar`` es un ``UPDATE OR INSERT ... MATCHING (clave)``: la fila
+    que no existe se crea solo con esos campos, la que existe cambia solo
+    esos campos. Sin ``insertar`` es un ``UPDATE`` que no crea filas. Devuelve
+    ``(sql, orden)`` con los campos en el orden de los parámetros; el texto
+    queda cacheado por juego de campos.
+    """
+    clave = TABLAS[tabla]["clave"]
+    valores = [c for c in campos if c not in clave]
+    if insertar:
+        orden = list(clave) + valores
+        sql = (f"UPDATE OR INSERT INTO {tabla} ({', '.join(orden)}) "
+               f"VALUES ({', '.join(['?'] * len(orden))}) MATCHING ({', '.join(clave)})")
+    else:
+        orden = valores + list(clave)
+        sql = (f"UPDATE {tabla} SET {', '.join(f'{c} = ?' for c in valores)} "
+               f"WHERE {' AND '.join(f'{c} = ?' for c in clave)}")
+    return sql, tuple(orden)
+
+
+def upsert_error(tabla, datos):
+    """Motivo por el que ``datos`` no sirve para actualizar ``tabla``, o None."""
+    if not isinstance(datos, dict):
+        return "Se esperaba un objeto"
+    info = TABLAS[tabla]
+    for campo in info["clave"]:
+        if datos.get(campo) is None:
+            return f"Falta el campo de la clave: {campo}"
+    for campo in datos:
+        if campo not in info["columnas"]:
+            return f"Campo no permitido para {tabla}: {campo}"
+    if len(datos) == len(info["clave"]):
+        return "No hay campos para actualizar"
+    return None
+
+
+def _update_rows(conn, tabla, sql, params):
+    """Ejecuta el ``UPDATE`` fila por fila para saber cuáles no encontraron la clave.
+
+    En Firebird cada sentencia es atómica: la que falla no deja cambios y la
+    transacción sigue. Devuelve ``(errores, indices_sin_fila)``.
+    """
+    cursor, sentencia = conn.statement(sql)
+    errores = []
+    sin_fila = []
+    for indice, fila in enumerate(params):
+        try:
+            with medir("execute", sql, fila, tabla):
+                cursor.execute(sentencia, fila)
+        except Exception as e:
+            if not row_error(e):
+                raise
+            errores.append({"fila": indice, "error": str(e)})
+            continue
+        if cursor.rowcount == 0:
+            sin_fila.append(indice)
+        else:
+            count_rows(1, tabla)
+    return errores, sin_fila
+
+
+def upsert_batch(conn, tabla, filas, insertar=True, parcial=False):
+    """Actualiza (o crea, con ``insertar``) ``filas`` en una sola transacción.
+
+    Cada fila trae la clave y solo los campos que cambian. Los tramos
+    consecutivos con el mismo juego de campos comparten sentencia preparada
+    y ``executemany``, respetando el orden de llegada. Con ``parcial`` se
+    confirman las filas válidas; si no, basta un error para deshacer todo.
+    Devuelve ``(resultados, errores)``: un estado por fila (``"ok"``,
+    ``"no_encontrada"`` o ``"error"``) y el detalle de los errores.
+    """
+    resultados = ["ok"] * len(filas)
+    errores = []
+    posicion = 0
+    for campos, tramo in groupby(filas, key=lambda datos: tuple(sorted(datos))):
+        sql, orden = build_upsert(tabla, campos, insertar)
+        params = [tuple(datos[c] for c in orden) for datos in tramo]
+        if insertar:
+            fallidas, sin_fila = _execute_many(conn, tabla, sql, params), []
+        else:
+            fallidas, sin_fila = _update_rows(conn, tabla, sql, params)
+        for error in fallidas:
+            errores.append(dict(error, fila=posicion + error["fila"]))
+            resultados[posicion + error["fila"]] = "error"
+        for indice in sin_fila:
+            resultados[posicion + indice] = "no_encontrada"
+        posicion += len(params)
+    if errores and not parcial:
+        conn.rollback()
+        return ["error" if r == "error" else "sin_aplicar" for r in resultados], errores
+    conn.commit()
+    return resultados, errores
@@ -0,0 +1,282 @@
+"""Codificadores de salida para /consulta/{tabla}.
+
+Todos trabajan por bloques: ``start(columnas)`` devuelve la cabecera,
+``rows(filas)`` el bloque codificado y ``end()`` el cierre, de modo que sirven
+igual para la respuesta completa que para ``stream=true``.
+
+En JSON y NDJSON los NUMERIC/DECIMAL (importes como TOTAL o VLR_PAGO) van
+como texto con su escala exacta (``"1520.50"``), no como número: un float
+de JSON redondearía en binario.
+
+Formato binario columnar (``application/vnd.api1.columnar``), little-endian:
+
+- Cabecera: ``b"API1COL1"``, ``uint16`` cantidad de columnas y por cada una
+  ``uint16`` largo + nombre UTF-8.
+- Bloques: ``uint32`` cantidad de filas (0 marca el fin) y por cada columna
+  un byte de tipo, un mapa de nulos de ``ceil(filas / 8)`` bytes (bit 1 =
+  NULL) y los valores:
+  ``q`` int64; ``d`` float64; ``D`` decimal como ``int8`` escala + int64
+  escalados; ``s`` texto y ``b`` binario como ``uint32`` largos + datos.
+  Los nulos ocupan su lugar con 0 o largo 0.
+"""
+import base64
+import csv
+import datetime
+import hashlib
+import io
+import json
+import struct
+import sys
+from array import array
+from decimal import Decimal
+
+from fastapi import HTTPException
+
+
+# Código de array con 4 bytes sin signo en esta plataforma
+_UINT32 = "I" if array("I").itemsize == 4 else "L"
+
+
+def _json_default(valor):
+    if isinstance(valor, Decimal):
+        return str(valor)
+    if isinstance(valor, (datetime.date, datetime.time)):
+        return valor.isoformat()
+    if isinstance(valor, bytes):
+        return base64.b64encode(valor).decode("ascii")
+    raise TypeError(f"Tipo no serializable: {type(valor).__name__}")
+
+
+def _dumps(valor):
+    return json.dumps(valor, default=_json_default, ensure_ascii=False, separators=(",", ":"))
+
+
+class TextEncoder:
+    """Formato original: ``str(fila)`` una por línea."""
+
+    media_type = "text/plain"
+
+    def __init__(self):
+        self._primero = True
+
+    def start(self, columnas):
+        return b""
+
+    def rows(self, filas):
+        if not filas:
+            return b""
+        texto = "\n".join([str(row) for row in filas])
+        if not self._primero:
+            texto = "\n" + texto
+        self._primero = False
+        return texto.encode("utf-8")
+
+    def end(self):
+        return b""
+
+
+class NdjsonEncoder:
+    """Un objeto JSON por fila con los nombres de columna."""
+
+    media_type = "application/x-ndjson"
+
+    def start(self, columnas):
+        self._columnas = columnas
+        return b""
+
+    def rows(self, filas):
+        columnas = self._columnas
+        return "".join([_dumps(dict(zip(columnas, fila))) + "\n" for fila in filas]).encode("utf-8")
+
+    def end(self):
+        return b""
+
+
+class CsvEncoder:
+    media_type = "text/csv"
+
+    def _escribir(self, filas):
+        salida = io.StringIO()
+        csv.writer(salida, lineterminator="\n").writerows(filas)
+        return salida.getvalue().encode("utf-8")
+
+    def start(self, columnas):
+        return self._escribir([columnas])
+
+    def rows(self, filas):
+        return self._escribir(filas)
+
+    def end(self):
+        return b""
+
+
+class JsonColumnsEncoder:
+    """``{"columns": [...], "rows": [[...], ...]}`` sin repetir las claves."""
+
+    media_type = "application/json"
+
+    def __init__(self):
+        self._primero = True
+
+    def start(self, columnas):
+        return ('{"columns":' + _dumps(columnas) + ',"rows":[').encode("utf-8")
+
+    def rows(self, filas):
+        if not filas:
+            return b""
+        texto = ",".join([_dumps(list(fila)) for fila in filas])
+        if not self._primero:
+            texto = "," + texto
+        self._primero = False
+        return texto.encode("utf-8")
+
+    def end(self):
+        return b"]}"
+
+
+class ColumnarEncoder:
+    """Formato binario columnar descrito al inicio del módulo."""
+
+    media_type = "application/vnd.api1.columnar"
+
+    def start(self, columnas):
+        partes = [b"API1COL1", struct.pack("<H", len(columnas))]
+        for nombre in columnas:
+            dato = nombre.encode("utf-8")
+            partes.append(struct.pack("<H", len(dato)) + dato)
+        return b"".join(partes)
+
+    @staticmethod
+    def _numeros(codigo, valores):
+        datos = array(codigo, valores)
+        if sys.byteorder != "little":
+            datos.byteswap()
+        return datos.tobytes()
+
+    def _columna(self, valores):
+        nulos = bytearray((len(valores) + 7) // 8)
+        presentes = []
+        for i, valor in enumerate(valores):
+            if valor is None:
+                nulos[i >> 3] |= 1 << (i & 7)
+            else:
+                presentes.append(valor)
+
+        tipos = {type(v) for v in presentes}
+        if tipos and tipos <= {int} and all(-2 ** 63 <= v < 2 ** 63 for v in presentes):
+            return b"q" + bytes(nulos) + self._numeros("q", [0 if v is None else v for v in valores])
+        if float in tipos and tipos <= {float, int}:
+            # Columnas DOUBLE o calculadas pueden traer enteros mezclados
+            return b"d" + bytes(nulos) + self._numeros("d", [0.0 if v is None else v for v in valores])
+        if tipos and tipos <= {Decimal, int}:
+            escala = max(max(-Decimal(v).as_tuple().exponent, 0) for v in presentes)
+            escalados = [0 if v is None else int(Decimal(v).scaleb(escala)) for v in valores]
+            if escala < 128 and all(-2 ** 63 <= v < 2 ** 63 for v in escalados):
+                return b"D" + bytes(nulos) + struct.pack("<b", escala) + self._numeros("q", escalados)
+
+        codigo = b"b" if tipos and tipos <= {bytes} else b"s"
+        datos = []
+        for valor in valores:
+            if valor is None:
+                datos.append(b"")
+            elif isinstance(valor, bytes):
+                datos.append(valor)
+            elif isinstance(valor, (datetime.date, datetime.time)):
+                datos.append(valor.isoformat().encode("utf-8"))
+            else:
+                datos.append(str(valor).encode("utf-8"))
+        largos = self._numeros(_UINT32, [len(d) for d in datos])
+        return codigo + bytes(nulos) + largos + b"".join(datos)
+
+    def rows(self, filas):
+        if not filas:
+            return b""
+        partes = [struct.pack("<I", len(filas))]
+        for columna in zip(*filas):
+            partes.append(self._columna(columna))
+        return b"".join(partes)
+
+    def end(self):
+        return struct.pack("<I", 0)
+
+
+# Nombre corto (?format=) -> codificador
+FORMATOS = {
+    "text": TextEncoder,
+    "ndjson": NdjsonEncoder,
+    "csv": CsvEncoder,
+    "json": JsonColumnsEncoder,
+    "columnar": ColumnarEncoder,
+}
+
+
+def negotiate(formato=None, accept=None):
+    """Elige el codificador por ``?format=`` o, si no viene, por ``Accept``.
+
+    Sin preferencia reconocible se mantiene el texto plano de siempre, y
+    también cuando ``text/plain`` empata con el mejor tipo aceptado (como en
+    el ``Accept`` por defecto de muchos clientes HTTP).
+    """
+    if formato:
+        if formato not in FORMATOS:
+            raise HTTPException(status_code=406,
+                                detail=f"Formato no soportado: {formato} ({', '.join(FORMATOS)})")
+        return FORMATOS[formato]()
+    if accept:
+        por_tipo = {cls.media_type: cls for cls in FORMATOS.values()}
+        pedidos = []
+        for i, parte in enumerate(accept.split(",")):
+            tipo, _, parametros = parte.strip().partition(";")
+            calidad = 1.0
+            for parametro in parametros.split(";"):
+                nombre, _, valor = parametro.strip().partition("=")
+                if nombre == "q":
+                    try:
+                        calidad = float(valor)
+                    except ValueError:
+                        calidad = 0.0
+            pedidos.append((-calidad, i, tipo.strip().lower()))
+        conocidos = [(c, i, tipo) for c, i, tipo in sorted(pedidos) if c < 0 and tipo in por_tipo]
+        if conocidos:
+            mejor = conocidos[0][0]
+            if any(c == mejor and tipo == TextEncoder.media_type for c, _, tipo in conocidos):
+                return TextEncoder()
+            return por_tipo[conocidos[0][2]]()
+    return TextEncoder()
+
+
+def json_bytes(valor):
+    """JSON compacto de una respuesta armada a mano (sin ``jsonable_encoder``)."""
+    return _dumps(valor).encode("utf-8")
+
+
+def encode_all(encoder, columnas, filas):
+    """Codifica un resultado completo (respuesta sin streaming)."""
+    return encoder.start(columnas) + encoder.rows(filas) + encoder.end()
+
+
+def make_etag(version, *partes):
+    """ETag débil: versión de la tabla más un resumen de la consulta y el formato.
+
+    Sin versión (``None``) no hay ETag y la respuesta no se puede revalidar.
+    """
+    if version is None:
+        return None
+    resumen = hashlib.sha1(repr(partes).encode("utf-8")).hexdigest()[:16]
+    return f'W/"{version}-{resumen}"'
+
+
+def etag_matches(if_none_match, etag):
+    """Comparación débil de ``If-None-Match`` con ``etag`` (la que pide GET)."""
+    if not if_none_match or etag is None:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    propia = etag[2:] if etag.startswith("W/") else etag
+    for candidata in if_none_match.split(","):
+        candidata = candidata.strip()
+        if candidata.startswith("W/"):
+            candidata = candidata[2:]
+        if candidata == propia:
+            return True
+    return False
@@ -0,0 +1,400 @@
+"""Ingesta asíncrona (write-behind) de ``/insertar/*?asincrono=true``.
+
+Cada registro validado se agrega a un journal local (un JSON por línea, con
+fsync) y la petición responde 202 con un ticket. Un worker toma los
+pendientes en lotes, los inserta con ``executemany`` y confirma una sola vez
+por lote (group commit); el resultado de cada ticket también va al journal.
+
+Al arrancar se relee el journal y se reencolan los tickets sin resultado.
+Para no duplicarlos si la caída ocurrió entre el commit y la anotación, cada
+lote registra sus tickets en la tabla de control dentro de la misma
+transacción y los reencolados se buscan ahí antes de insertarlos::
+
+    CREATE TABLE API_INGESTA (
+        TICKET VARCHAR(32) NOT NULL PRIMARY KEY,
+        FECHA TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+Lo mismo vale para un lote cuyo ``run_db`` falla cuando el commit pudo
+haber llegado a la base (timeout o conexión perdida al confirmar): el
+reintento busca sus tickets en la tabla de control. ``start`` falla si la
+tabla no existe.
+
+Con ``tabla_control=None`` no se usa la tabla y la reanudación queda "al
+menos una vez".
+
+Los lotes que fallan por falta de conexión o timeout se reintentan sin
+límite; si la base rechaza el lote ``max_reintentos`` veces seguidas, sus
+tickets quedan en "error". Un lote rechazado por sus datos (validación o
+error de fila fuera del ``executemany``) queda en "error" al primer intento:
+reintentarlo no lo arreglaría y bloquearía la cola.
+"""
+import asyncio
+import itertools
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from db import run_db
+from escrituras import INSERTS, insert_group, missing_field, row_error
+from metricas import medir
+
+
+class Journal:
+    """Archivo de solo agregado; cada ``append`` queda en disco al volver.
+
+    Los ``append`` concurrentes comparten el fsync: quien llega a sincronizar
+    cubre también lo que otros escribieron antes.
+    """
+
+    def __init__(self, ruta, fsync=True):
+        self.ruta = ruta
+        self.fsync = fsync
+        self._archivo = None
+        self._lock = threading.Lock()
+        self._lock_sync = threading.Lock()
+        self._escritos = 0
+        self._sincronizados = 0
+
+    def open(self):
+        """Abre el journal y devuelve los registros que ya tenía."""
+        registros = []
+        completo = 0
+        if os.path.exists(self.ruta):
+            with open(self.ruta, "rb") as f:
+                for linea in f:
+                    if not linea.endswith(b"\n"):
+                        # Última línea a medio escribir por una caída
+                        break
+                    completo += len(linea)
+                    try:
+                        registros.append(json.loads(linea))
+                    except ValueError:
+                        continue
+        self._archivo = open(self.ruta, "ab")
+        if self._archivo.tell() > completo:
+            # Sin el resto cortado, el próximo append no queda pegado a él
+            self._archivo.truncate(completo)
+        return registros
+
+    @staticmethod
+    def _escribir(archivo, registros):
+        archivo.write(b"".join(json.dumps(r, ensure_ascii=False).encode("utf-8") + b"\n"
+                               for r in registros))
+        archivo.flush()
+
+    def append(self, *registros):
+        with self._lock:
+            self._escribir(self._archivo, registros)
+            self._escritos += 1
+            propio = self._escritos
+        if not self.fsync:
+            return
+        with self._lock_sync:
+            if self._sincronizados >= propio:
+                return
+            hasta = self._escritos
+            os.fsync(self._archivo.fileno())
+            self._sincronizados = hasta
+
+    def rewrite(self, registros, desde):
+        """Reemplaza el contenido de forma atómica (archivo temporal + rename).
+
+        ``registros`` resume los primeros ``desde`` bytes del journal; lo que
+        se agregó después se copia al final antes del reemplazo. La copia se
+        escribe sin tomar los locks, así los ``append`` siguen mientras tanto.
+        """
+        temporal = self.ruta + ".tmp"
+        with open(temporal, "wb") as f:
+            self._escribir(f, registros)
+            os.fsync(f.fileno())
+            with self._lock_sync, self._lock:
+                with open(self.ruta, "rb") as actual:
+                    actual.seek(desde)
+                    f.write(actual.read())
+                f.flush()
+                os.fsync(f.fileno())
+                self._archivo.close()
+                os.replace(temporal, self.ruta)
+                self._archivo = open(self.ruta, "ab")
+                self._sincronizados = self._escritos
+
+    def size(self):
+        with self._lock:
+            return self._archivo.tell() if self._archivo else 0
+
+    def close(self):
+        with self._lock_sync, self._lock:
+            if self._archivo is not None:
+                self._archivo.close()
+                self._archivo = None
+
+
+def _estado(registro):
+    return {
+        "ticket": registro["ticket"],
+        "tabla": registro["tabla"],
+        "estado": registro.get("estado", "pendiente"),
+        "error": registro.get("error"),
+        "creado": registro.get("creado"),
+        "procesado": registro.get("procesado"),
+    }
+
+
+class IngestQueue:
+    """Cola durable de inserciones con un worker que confirma por lotes.
+
+    - ``max_lote``: registros por transacción.
+    - ``espera``: segundos que el worker junta registros antes de un lote
+      incompleto.
+    - ``max_pendientes``: por encima se responde 503 en vez de encolar.
+    - ``retener``: tickets terminados cuyo estado se sigue informando.
+    - ``max_reintentos``: errores seguidos de la base con un lote antes de
+      dar sus tickets por fallidos.
+    - ``max_bytes``: al superarlo se compacta el journal.
+    - ``on_commit(tablas)``: se llama tras cada lote (p. ej. para la caché).
+    """
+
+    def __init__(self, ruta, max_lote=500, espera=0.05, max_pendientes=100000, fsync=True,
+                 tabla_control="API_INGESTA", retener=10000, max_bytes=64 * 2 ** 20,
+                 reintento=1.0, max_reintentos=5, on_commit=None):
+        self.journal = Journal(ruta, fsync)
+        self.max_lote = max_lote
+        self.espera = espera
+        self.max_pendientes = max_pendientes
+        self.tabla_control = tabla_control
+        self.retener = retener
+        self.max_bytes = max_bytes
+        self.reintento = reintento
+        self.max_reintentos = max_reintentos
+        self.on_commit = on_commit
+        self._pendientes = OrderedDict()  # ticket -> registro "alta"
+        self._escribiendo = {}  # ticket -> registro aún no confirmado en el journal
+        self._tickets = OrderedDict()  # ticket -> estado informado
+        self._reanudados = set()  # tickets que pueden estar ya confirmados (releídos o de un lote fallido)
+        self._fallos_lote = 0  # errores seguidos de la base con el lote en curso
+        self._hay_trabajo = None
+        self._tarea = None
+        self.recibidos = 0
+        self.confirmados = 0
+        self.fallidos = 0
+        self.lotes = 0
+        self.reintentos = 0
+
+    def _control_existe(self, conn):
+        sql = "SELECT 1 FROM RDB$RELATIONS WHERE RDB$RELATION_NAME = ?"
+        cursor, sentencia = conn.statement(sql)
+        cursor.execute(sentencia, (self.tabla_control.upper(),))
+        return cursor.fetchone() is not None
+
+    async def start(self):
+        if self.tabla_control:
+            try:
+                existe = await run_db(self._control_existe)
+            except Exception as e:
+                # Sin base al arrancar: los lotes se reintentan hasta que conecte
+                print(f"Ingesta: no se pudo verificar la tabla {self.tabla_control}: {e}")
+            else:
+                if not existe:
+                    raise RuntimeError(f"No existe la tabla de control {self.tabla_control} "
+                                       f"(ver ingesta.py) o use tabla_control=None")
+        registros = await run_in_threadpool(self.journal.open)
+        for registro in registros:
+            ticket = registro["ticket"]
+            if registro["op"] == "alta":
+                self._pendientes[ticket] = registro
+                self._reanudados.add(ticket)
+                self._tickets[ticket] = _estado(registro)
+            else:
+                self._pendientes.pop(ticket, None)
+                self._reanudados.discard(ticket)
+                estado = self._tickets.pop(ticket, None) or _estado(registro)
+                estado.update(estado=registro["estado"], error=registro.get("error"),
+                              procesado=registro.get("procesado"))
+                self._tickets[ticket] = estado
+        for ticket, registro in list(self._pendientes.items()):
+            # Un registro que no se puede insertar bloquearía la cola para siempre
+            if registro["tabla"] not in INSERTS or missing_field(registro["tabla"], registro["datos"]):
+                del self._pendientes[ticket]
+                self._tickets[ticket].update(estado="error", error="Registro inválido en el journal",
+                                             procesado=time.time())
+        self._recortar()
+        if registros:
+            await self._compactar()
+        self._hay_trabajo = asyncio.Event()
+        if self._pendientes:
+            print(f"Ingesta: {len(self._pendientes)} registros pendientes del journal")
+            self._hay_trabajo.set()
+        self._tarea = asyncio.ensure_future(self._trabajar())
+
+    async def stop(self):
+        # Lo pendiente queda en el journal para el próximo arranque
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+            self._tarea = None
+        self.journal.close()
+
+    async def submit(self, tabla, datos):
+        """Registra ``datos`` en el journal y devuelve el ticket."""
+        if self._tarea is None:
+            raise HTTPException(status_code=503, detail="La ingesta asíncrona no está disponible")
+        if len(self._pendientes) + len(self._escribiendo) >= self.max_pendientes:
+            raise HTTPException(status_code=503, detail="La cola de ingesta está llena")
+        ticket = uuid.uuid4().hex
+        registro = {"op": "alta", "ticket": ticket, "tabla": tabla, "datos": datos, "creado": time.time()}
+        self._escribiendo[ticket] = registro
+        try:
+            await run_in_threadpool(self.journal.append, registro)
+        finally:
+            del self._escribiendo[ticket]
+        # Solo se acepta (y se procesa) lo que ya está en disco
+        self._pendientes[ticket] = registro
+        self._tickets[ticket] = _estado(registro)
+        self.recibidos += 1
+        self._hay_trabajo.set()
+        return ticket
+
+    def status(self, ticket):
+        return self._tickets.get(ticket)
+
+    async def _trabajar(self):
+        while True:
+            await self._hay_trabajo.wait()
+            if len(self._pendientes) < self.max_lote:
+                # Ventana corta para que la ráfaga entre en el mismo commit
+                await asyncio.sleep(self.espera)
+            self._hay_trabajo.clear()
+            lote = list(itertools.islice(self._pendientes.values(), self.max_lote))
+            if not lote:
+                continue
+            revisar = [r["ticket"] for r in lote if r["ticket"] in self._reanudados]
+            try:
+                errores = await run_db(self._aplicar, lote, revisar)
+            except Exception as e:
+                # El commit pudo llegar a la base antes del error: el reintento
+                # revisa el lote completo en la tabla de control
+                self._reanudados.update(r["ticket"] for r in lote)
+                if row_error(e) or isinstance(e, HTTPException) and e.status_code < 500:
+                    # Rechazo de los datos, no de la base: el mismo lote fallaría igual
+                    mensaje = e.detail if isinstance(e, HTTPException) else str(e)
+                    print(f"Ingesta: lote de {len(lote)} registros rechazado: {mensaje}")
+                    await self._finalizar(lote, {r["ticket"]: mensaje for r in lote})
+                    if self._pendientes:
+                        self._hay_trabajo.set()
+                    continue
+                if not isinstance(e, HTTPException):
+                    # La base rechazó el lote (no es falta de conexión ni timeout)
+                    self._fallos_lote += 1
+                    if self._fallos_lote > self.max_reintentos:
+                        self._fallos_lote = 0
+                        print(f"Ingesta: lote de {len(lote)} registros descartado tras "
+                              f"{self.max_reintentos} reintentos: {e}")
+                        mensaje = f"No se pudo confirmar tras {self.max_reintentos} reintentos: {e}"
+                        await self._finalizar(lote, {r["ticket"]: mensaje for r in lote})
+                        if self._pendientes:
+                            self._hay_trabajo.set()
+                        continue
+                self.reintentos += 1
+                print(f"Error en la ingesta, se reintenta en {self.reintento}s: {e}")
+                self._hay_trabajo.set()
+                await asyncio.sleep(self.reintento)
+                continue
+            self._fallos_lote = 0
+            await self._finalizar(lote, errores)
+            if self._pendientes:
+                self._hay_trabajo.set()
+
+    def _aplicados(self, conn, tickets):
+        """Tickets que ya están en la tabla de control (lote confirmado antes de una caída)."""
+        aplicados = set()
+        for inicio in range(0, len(tickets), 100):
+            bloque = tickets[inicio:inicio + 100]
+            sql = (f"SELECT TICKET FROM {self.tabla_control} "
+                   f"WHERE TICKET IN ({', '.join(['?'] * len(bloque))})")
+            cursor, sentencia = conn.statement(sql)
+            with medir("execute", sql, bloque, self.tabla_control):
+                cursor.execute(sentencia, bloque)
+            aplicados.update(fila[0].strip() for fila in cursor.fetchall())
+        return aplicados
+
+    def _aplicar(self, conn, lote, revisar):
+        aplicados = self._aplicados(conn, revisar) if revisar and self.tabla_control else set()
+        nuevos = [r for r in lote if r["ticket"] not in aplicados]
+        errores = insert_group(conn, [(r["tabla"], r["datos"]) for r in nuevos])
+        if self.tabla_control:
+            tickets = [(r["ticket"],) for i, r in enumerate(nuevos) if i not in errores]
+            if tickets:
+                sql = f"INSERT INTO {self.tabla_control} (TICKET) VALUES (?)"
+                cursor, sentencia = conn.statement(sql)
+                with medir("execute", sql, tickets[0], self.tabla_control, filas=len(tickets)):
+                    cursor.executemany(sentencia, tickets)
+        conn.commit()
+        return {nuevos[i]["ticket"]: mensaje for i, mensaje in errores.items()}
+
+    async def _finalizar(self, lote, errores):
+        ahora = time.time()
+        fines = [{"op": "fin", "ticket": r["ticket"], "tabla": r["tabla"],
+                  "estado": "error" if r["ticket"] in errores else "ok",
+                  "error": errores.get(r["ticket"]), "procesado": ahora} for r in lote]
+        try:
+            await run_in_threadpool(self.journal.append, *fines)
+        except Exception as e:
+            # Ya está confirmado; al reanudar lo resuelve la tabla de control
+            print(f"Error al anotar el lote en el journal: {e}")
+        for fin in fines:
+            ticket = fin["ticket"]
+            del self._pendientes[ticket]
+            self._reanudados.discard(ticket)
+            estado = self._tickets.pop(ticket, None) or _estado(fin)
+            estado.update(estado=fin["estado"], error=fin["error"], procesado=ahora)
+            self._tickets[ticket] = estado
+        self.lotes += 1
+        self.fallidos += len(errores)
+        self.confirmados += len(lote) - len(errores)
+        self._recortar()
+        if self.on_commit is not None:
+            self.on_commit({r["tabla"] for r in lote})
+        if self.journal.size() > self.max_bytes:
+            await self._compactar()
+
+    def _recortar(self):
+        # Estados terminados más viejos fuera; los pendientes no se descartan
+        terminados = len(self._tickets) - len(self._pendientes)
+        for ticket in list(self._tickets):
+            if terminados <= self.retener:
+                break
+            if ticket not in self._pendientes:
+                del self._tickets[ticket]
+                terminados -= 1
+
+    async def _compactar(self):
+        # La foto se toma en el event loop: así ningún alta aceptada queda
+        # fuera; lo escrito desde ``desde`` lo agrega rewrite (repetir un
+        # registro al releer no cambia nada)
+        desde = self.journal.size()
+        registros = [dict(estado, op="fin") for ticket, estado in self._tickets.items()
+                     if ticket not in self._pendientes]
+        registros += list(self._pendientes.values()) + list(self._escribiendo.values())
+        await run_in_threadpool(self.journal.rewrite, registros, desde)
+
+    def stats(self):
+        return {
+            "pendientes": len(self._pendientes),
+            "recibidos": self.recibidos,
+            "confirmados": self.confirmados,
+            "fallidos": self.fallidos,
+            "lotes": self.lotes,
+            "filas_por_lote": (self.confirmados + self.fallidos) / self.lotes if self.lotes else 0.0,
+            "reintentos": self.reintentos,
+            "journal_bytes": self.journal.size(),
+        }
@@ -1,451 +1,644 @@
-from fastapi import FastAPI, HTTPException, Query
-from fastapi.responses import PlainTextResponse
-import fdb
-import config  #  DB Parms
+import datetime
+from collections import OrderedDict
+from typing import List
+from urllib.parse import urlencode
+
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+import config
+import db
+from admision import AdmissionController, AdmissionMiddleware
+from compresion import CompressionMiddleware
+from cache import QueryCache
+from cambios import fetch_versioned, read_changes, table_version
+from db import StreamedQuery, fetch_all, fetch_in, pool, router, run_db
+from formatos import encode_all, etag_matches, json_bytes, make_etag, negotiate
+from ingesta import IngestQueue
+from metricas import MetricsMiddleware, medir, register_gauges, render, set_table
+from reportes import REPORTES, RollupCache, build_report, day_of, get_reporte, parse_por, report_rows, tramos
+from replicas import ReadAfterWriteMiddleware
+from escrituras import (SECCIONES_DOCUMENTO, check_required, insert_batch, insert_document, insert_row,
+                        missing_field, prepare_document, upsert_batch, upsert_error)
+from tablas import (TABLAS, build_lookup, build_select, check_column, get_tabla, key_value, lookup_columns,
+                    parse_fields)
 
 app = FastAPI()
-
-def get_db_connection():
+control_admision = AdmissionController(config.ADMISSION_CONFIG['clases'],
+                                       retry_after=config.ADMISSION_CONFIG['retry_after'])
+# Las peticiones rechazadas también pasan por las métricas, que cuentan los
+# bytes ya comprimidos
+app.add_middleware(CompressionMiddleware, min_bytes=config.COMPRESSION_CONFIG['min_bytes'],
+                   gzip_nivel=config.COMPRESSION_CONFIG['gzip_nivel'],
+                   zstd_nivel=config.COMPRESSION_CONFIG['zstd_nivel'])
+app.add_middleware(AdmissionMiddleware, controlador=control_admision)
+app.add_middleware(ReadAfterWriteMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+query_cache = QueryCache(config.CACHE_CONFIG['tablas'],
+                         max_entries=config.CACHE_CONFIG['max_entries'],
+                         max_rows=config.CACHE_CONFIG['max_rows'])
+
+# Reportes: días cerrados por día en ``rollups``; el día en curso, con TTL corto
+rollups = RollupCache(ttl=config.REPORTS_CONFIG['ttl_cerrados'],
+                      max_entries=config.REPORTS_CONFIG['max_entries'])
+reportes_hoy = QueryCache({reporte: config.REPORTS_CONFIG['ttl_hoy'] for reporte in REPORTES})
+
+
+def invalidar_tablas(tablas):
+    for tabla in tablas:
+        query_cache.invalidate(tabla)
+
+
+ingesta = IngestQueue(config.INGEST_CONFIG['journal'],
+                      max_lote=config.INGEST_CONFIG['max_lote'],
+                      espera=config.INGEST_CONFIG['espera'],
+                      max_pendientes=config.INGEST_CONFIG['max_pendientes'],
+                      fsync=config.INGEST_CONFIG['fsync'],
+                      tabla_control=config.INGEST_CONFIG['tabla_control'],
+                      retener=config.INGEST_CONFIG['retener'],
+                      max_reintentos=config.INGEST_CONFIG['max_reintentos'],
+                      on_commit=invalidar_tablas)
+
+register_gauges("api_pool", pool.stats)
+register_gauges("api_cache", query_cache.stats)
+register_gauges("api_ingesta", ingesta.stats)
+register_gauges("api_reportes", rollups.stats)
+register_gauges("api_admision", control_admision.gauges)
+for _numero, _replica in enumerate(router.replicas, 1):
+    register_gauges(f"api_replica{_numero}", _replica.stats)
+
+@app.on_event("startup")
+def abrir_pool():
+    # Precalentamos las conexiones mínimas; si la base no responde aún, el pool
+    # conectará bajo demanda
     try:
-        # Usamos los parámetros del archivo Config.py
-        con = fdb.connect(dsn=config.DB_CONFIG['dsn'], 
-                          user=config.DB_CONFIG['user'], 
-                          password=config.DB_CONFIG['password'])
-        print("Conexión exitosa")
-        return con
+        pool.open()
     except Exception as e:
         print(f"Error de conexión: {e}")
-        raise HTTPException(status_code=500, detail=f"Database connection error: {str(e)}")
+    # Las réplicas que no respondan quedan fuera hasta la siguiente revisión
+    router.open()
+
+
+@app.on_event("startup")
+async def iniciar_ingesta():
+    # Relee el journal y reencola lo que quedó sin confirmar
+    try:
+        await ingesta.start()
+    except Exception as e:
+        print(f"Error al iniciar la ingesta: {e}")
+
+
+@app.on_event("shutdown")
+async def detener_ingesta():
+    await ingesta.stop()
+
+
+@app.on_event("shutdown")
+def cerrar_pool():
+    db.close()
+
+
+@app.get("/estado/pool")
+async def estado_pool():
+    # Tamaño, saturación y tiempos de espera del pool de conexiones
+    return pool.stats()
+
+
+@app.get("/estado/replicas")
+async def estado_replicas():
+    # Salud, lecturas y pool de cada réplica; lecturas atendidas por la primaria
+    return router.stats()
+
+
+@app.get("/metrics")
+async def metrics():
+    # Formato de texto de Prometheus
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
+
+
+@app.get("/estado/cache")
+async def estado_cache():
+    # Aciertos, fallos y tamaño de la caché de catálogos
+    return query_cache.stats()
+
+
+@app.delete("/cache")
+async def invalidar_cache():
+    query_cache.invalidate()
+    return {"message": "Caché invalidada"}
+
+
+@app.delete("/cache/reportes")
+async def invalidar_cache_reportes():
+    # Para ver ajustes con fecha pasada antes de que venzan los días cerrados
+    rollups.invalidate()
+    reportes_hoy.invalidate()
+    return {"message": "Caché de reportes invalidada"}
+
+
+@app.delete("/cache/{tabla}")
+async def invalidar_cache_tabla(tabla: str):
+    get_tabla(tabla)
+    query_cache.invalidate(tabla)
+    return {"message": f"Caché de {tabla} invalidada"}
+
+
+@app.get("/estado/admision")
+async def estado_admision():
+    # Por clase: cupos en uso, cola y peticiones rechazadas o vencidas en espera
+    return control_admision.stats()
+
+
+@app.get("/estado/reportes")
+async def estado_reportes():
+    return {"cerrados": rollups.stats(), "hoy": reportes_hoy.stats()}
+
+
+@app.get("/estado/ingesta")
+async def estado_ingesta():
+    # Pendientes, lotes confirmados y tamaño del journal de la ingesta asíncrona
+    return ingesta.stats()
+
+
+@app.get("/ingesta/{ticket}")
+async def estado_ticket(ticket: str):
+    estado = ingesta.status(ticket)
+    if estado is None:
+        raise HTTPException(status_code=404, detail="Ticket no encontrado")
+    return estado
+
+
+def cabeceras_etag(etag):
+    # no-cache: el cliente puede guardar la respuesta pero la revalida siempre
+    return {"ETag": etag, "Cache-Control": "no-cache"} if etag else {}
+
+
+def no_modificado(etag):
+    return Response(status_code=304, headers=cabeceras_etag(etag))
+
+
+async def revalidar(request, tabla, partes):
+    """304 si el ``If-None-Match`` coincide con la versión actual de ``tabla``, si no None."""
+    condicion = request.headers.get("if-none-match")
+    if not condicion or not config.CHANGES_CONFIG['etag']:
+        return None
+    version = await run_db(table_version, tabla, config.CHANGES_CONFIG['margen'], lectura=True)
+    etag = make_etag(version, *partes)
+    return no_modificado(etag) if etag_matches(condicion, etag) else None
 
 
 @app.get("/consulta/{tabla}")
-async def get_data(tabla: str, campo: str = Query(None), valor: str = Query(None)):
-    query_mapping = {
-        "fatipdoc": "SELECT ID_USUARIO, CLAVE, PREFIJO, TIPODEV FROM fatipdoc",
-        "vendedor": "SELECT IDVEND, NOMBRE FROM vendedor",
-        "actividad_eco_enc": "SELECT CODACT, DESCRIPCION, COD_INTERNACIONAL FROM actividad_eco_enc",
-        "obligaciones_rut": "SELECT CODIGO, DESCRIPCION FROM obligaciones_rut",
-        "tributos": "SELECT CODIGO, DESCRIPCION FROM tributos",
-        "tributaria_tipocontribuyente": "SELECT CODIGO, DESCRIPCION FROM tributaria_tipocontribuyente",
-        "tributaria_tipodocumento": "SELECT TDOC, DESCRIPCION FROM tributaria_tipodocumento",
-        "paises": "SELECT ID_PAIS, PAIS FROM paises",
-        "departamentos_elect": "SELECT ID_DEPTO, DEPARTAMENTO FROM departamentos_elect",
-        "ciudades_elect": "SELECT ID_CIUDAD, CIUDAD FROM ciudades_elect",
-        "cust": "SELECT ID_N, COMPANY, ADDR1, CITY, PAIS, PHONE1, GRAVABLE, CLIENTE, TIPOEMP, IDVEND, CV, FECHA_CREACION, EMAIL, DEPARTAMENTO, INACTIVO, REGIMEN, RESIDENTE FROM cust",
-        "shipto": "SELECT ID_N, SUCCLIENTE, COMPANY, ADDR1, PHONE1, ID_VEND, PAIS, EMAIL, DEPARTAMENTO, PRIMER_APELLIDO, SEGUNDO_APELLIDO, PRIMER_NOMBRE, SEGUNDO_NOMBRE, FECHA_NACIMIENTO, COD_DPTO, COD_MUNICIPIO, CITY, ESTADO, EMAIL_FAC_ELEC FROM shipto",
-        # Add the rest of the tables here as in your original code...
-    }
-
-    if tabla not in query_mapping:
-        raise HTTPException(status_code=404, detail="Tabla no encontrada")
-
-    query = query_mapping[tabla]
-    
-    # Apply dynamic filters based on fields for each table
+async def get_data(request: Request, tabla: str, campo: str = Query(None), valor: str = Query(None),
+                   stream: bool = Query(False), chunk_size: int = Query(None, gt=0),
+                   fields: str = Query(None), limit: int = Query(None, gt=0),
+                   after: List[str] = Query(None), formato: str = Query(None, alias="format")):
+    info = get_tabla(tabla)
+    set_table(tabla)
+    # Formato de salida por ?format= o por el encabezado Accept
+    encoder = negotiate(formato, request.headers.get("accept"))
+
+    # Solo las columnas pedidas; al paginar la clave siempre va incluida
+    columnas = parse_fields(tabla, fields)
+    if limit is not None:
+        if limit > config.PAGINATION_CONFIG['max_limit']:
+            raise HTTPException(status_code=400,
+                                detail=f"limit no puede superar {config.PAGINATION_CONFIG['max_limit']}")
+        columnas = [c for c in info["clave"] if c not in columnas] + columnas
+    elif after:
+        raise HTTPException(status_code=400, detail="'after' requiere 'limit'")
+
+    # Apply dynamic filters based on fields for each table; el valor va como
+    # parámetro para que Firebird reutilice el plan con cualquier valor
     filters = []
+    params = []
     if campo and valor:
-        filters.append(f"{campo} = '{valor}'")
-    
-    # Combine filters if any
-    if filters:
-        query += " WHERE " + " AND ".join(filters)
+        filters.append(f"{check_column(tabla, campo)} = ?")
+        params.append(valor)
 
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute(query)
-        result = cursor.fetchall()
-        conn.close()
+    query, params = build_select(tabla, columnas, filters, params, after=after, limit=limit)
 
-        # Convert the result into plain text
-        result_text = "\n".join([str(row) for row in result])
-        return PlainTextResponse(result_text, media_type="text/plain")
+    if stream:
+        return await stream_data(request, tabla, query, params, encoder,
+                                 chunk_size or config.STREAM_CONFIG['chunk_size'])
 
+    # Las lecturas van a una réplica, salvo las cargas de la caché: una réplica
+    # atrasada dejaría guardado un catálogo viejo hasta que venza el TTL
+    lectura = not query_cache.enabled(tabla)
+    partes = (query, params, encoder.media_type)
+    try:
+        if lectura:
+            # Si el cliente ya tiene la versión vigente no leemos ninguna fila
+            respuesta = await revalidar(request, tabla, partes)
+            if respuesta is not None:
+                return respuesta
+        if config.CHANGES_CONFIG['etag']:
+            cargar = lambda: run_db(fetch_versioned, tabla, query, params, config.CHANGES_CONFIG['margen'],
+                                    lectura=lectura)
+        else:
+            cargar = lambda: run_db(fetch_all, query, params, lectura=lectura)
+        # La consulta corre en el executor de base de datos; los catálogos salen de la caché
+        result = await query_cache.get_or_load(tabla, query, params, cargar)
+        etag = make_etag(result.version, *partes)
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return no_modificado(etag)
+
+        # Serializamos fuera del event loop: los resultados grandes toman tiempo
+        with medir("serialize"):
+            body = await run_in_threadpool(encode_all, encoder, result.columnas, result.filas)
+        headers = cabeceras_etag(etag)
+        if limit is not None and len(result.filas) == limit:
+            # Cursor para la página siguiente: valores de clave de la última fila
+            ultima = result.filas[-1]
+            headers["X-Next-After"] = urlencode(
+                [("after", ultima[columnas.index(c)]) for c in info["clave"]])
+        return Response(body, media_type=encoder.media_type, headers=headers)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error during query execution: {str(e)}")
     
-# Bloque 1
-@app.post("/insertar/cust")
-async def insertar_cust(cliente: dict):
-    # Verificar que todos los campos requeridos estén presentes
-    required_fields = [
-        'ID_N', 'COMPANY', 'ADDR1', 'CITY', 'PAIS', 'PHONE1', 'GRAVABLE', 'CLIENTE', 
-        'TIPOEMP', 'IDVEND', 'CV', 'FECHA_CREACION', 'EMAIL', 'DEPARTAMENTO', 'REGIMEN', 'RESIDENTE'
-    ]
-
-    for field in required_fields:
-        if field not in cliente:
-            raise HTTPException(status_code=400, detail=f"Falta el campo requerido: {field}")
+@app.post("/consulta/{tabla}/lote")
+async def get_data_lote(tabla: str, lote: dict, fields: str = Query(None)):
+    # Búsqueda de muchas claves en una sola petición: {"campo": "ID_N", "valores": [...]}
+    info = get_tabla(tabla)
+    set_table(tabla)
+    campo = check_column(tabla, lote.get("campo") or info["clave"][0], lookup_columns(tabla))
+    valores = lote.get("valores")
+    if not isinstance(valores, list) or not valores:
+        raise HTTPException(status_code=400, detail="Falta el campo requerido: valores")
+    max_keys = config.LOOKUP_CONFIG['max_keys']
+    if len(valores) > max_keys:
+        raise HTTPException(status_code=413, detail=f"La búsqueda supera el máximo de {max_keys} valores")
+
+    columnas = parse_fields(tabla, fields)
+    if campo not in columnas:
+        columnas = [campo] + columnas
+    posicion = columnas.index(campo)
+
+    # Bloques de tamaño fijo para reutilizar una sola sentencia preparada
+    tamano = min(config.LOOKUP_CONFIG['chunk_size'], len(valores))
+    query = build_lookup(tabla, columnas, campo, tamano)
+
+    def buscar(conn):
+        # Los valores se convierten una vez al tipo de la columna que informa
+        # la sentencia preparada
+        _, sentencia = conn.statement(query)
+        tipo = sentencia.description[posicion][1]
+        try:
+            claves = [key_value(v, tipo) for v in valores]
+        except (ValueError, ArithmeticError):
+            raise HTTPException(status_code=400, detail=f"Valor no válido para {campo}")
+        return claves, fetch_in(conn, query, list(dict.fromkeys(claves)), tamano)
 
     try:
-        # Conexión a la base de datos Firebird
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Insertar en la tabla cust
-        insert_query = """
-        INSERT INTO cust (ID_N, COMPANY, ADDR1, CITY, PAIS, PHONE1, GRAVABLE, CLIENTE, 
-                          TIPOEMP, IDVEND, CV, FECHA_CREACION, EMAIL, DEPARTAMENTO, INACTIVO, REGIMEN, RESIDENTE)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'N', ?, ?)
-        """
-        cursor.execute(insert_query, (
-            cliente['ID_N'], cliente['COMPANY'], cliente['ADDR1'], cliente['CITY'], cliente['PAIS'], 
-            cliente['PHONE1'], cliente['GRAVABLE'], cliente['CLIENTE'], cliente['TIPOEMP'], cliente['IDVEND'], 
-            cliente['CV'], cliente['FECHA_CREACION'], cliente['EMAIL'], cliente['DEPARTAMENTO'], 
-            cliente['REGIMEN'], cliente['RESIDENTE']
-        ))
-        conn.commit()
+        claves, filas = await run_db(buscar, lectura=True)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error during query execution: {str(e)}")
 
-        # Retornar los valores insertados
-        result_text = "\n".join([f"{key}: {value}" for key, value in cliente.items()])
-        conn.close()
-        return PlainTextResponse(result_text, media_type="text/plain")
+    # Filas agrupadas por el valor que devuelve el driver (los CHAR vienen con
+    # relleno); cada valor pedido recibe las de su clave, o vacío
+    grupos = {}
+    for fila in filas:
+        clave = fila[posicion]
+        grupos.setdefault(clave.rstrip() if isinstance(clave, str) else clave, []).append(list(fila))
+    resultados = {str(valor): grupos.get(clave, []) for valor, clave in zip(valores, claves)}
+    # Mismo JSON que /consulta: los decimales conservan su escala
+    body = await run_in_threadpool(json_bytes, {"campo": campo, "columnas": columnas,
+                                                "resultados": resultados})
+    return Response(body, media_type="application/json")
+
+
+@app.get("/consulta/{tabla}/changes")
+async def get_changes(tabla: str, since: int = Query(None, ge=0), limit: int = Query(None, gt=0),
+                      fields: str = Query(None)):
+    # Solo lo que cambió después de la marca 'since'; sin 'since' devuelve la
+    # marca actual para empezar después de una descarga completa
+    info = get_tabla(tabla)
+    set_table(tabla)
+    max_limit = config.CHANGES_CONFIG['max_limit']
+    if limit is not None and limit > max_limit:
+        raise HTTPException(status_code=400, detail=f"limit no puede superar {max_limit}")
+    columnas = parse_fields(tabla, fields)
+    columnas = [c for c in info["clave"] if c not in columnas] + columnas
 
+    try:
+        resultado = await run_db(read_changes, tabla, columnas, since, limit or max_limit,
+                                 config.CHANGES_CONFIG['margen'], lectura=True)
+        with medir("serialize"):
+            body = await run_in_threadpool(json_bytes, resultado)
+        return Response(body, media_type="application/json")
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al insertar en la tabla cust: {str(e)}")
-    
-@app.post("/insertar/shipto")
-async def insertar_shipto(shipto: dict):
-    # Verificar que todos los campos requeridos estén presentes
-    required_fields = [
-        'ID_N', 'SUCCLIENTE', 'COMPANY', 'ADDR1', 'PHONE1', 'ID_VEND', 'PAIS', 'EMAIL', 'DEPARTAMENTO',
-        'PRIMER_APELLIDO', 'SEGUNDO_APELLIDO', 'PRIMER_NOMBRE', 'SEGUNDO_NOMBRE', 'FECHA_NACIMIENTO', 
-        'COD_DPTO', 'COD_MUNICIPIO', 'CITY', 'ESTADO', 'EMAIL_FAC_ELEC'
-    ]
-    
-    for field in required_fields:
-        if field not in shipto:
-            raise HTTPException(status_code=400, detail=f"Falta el campo requerido: {field}")
+        raise HTTPException(status_code=500, detail=f"Error al leer los cambios de {tabla}: {str(e)}")
+
+
+@app.get("/reportes")
+async def listar_reportes():
+    # Dimensiones admitidas en ``por`` y medidas de cada reporte
+    return {nombre: {"por": list(info["dimensiones"]), "medidas": list(info["medidas"])}
+            for nombre, info in REPORTES.items()}
+
+
+@app.get("/reportes/{reporte}")
+async def get_reporte_agregado(reporte: str, desde: datetime.date = Query(...),
+                               hasta: datetime.date = Query(None), por: str = Query(None)):
+    # Totales por día (y por ``por``) calculados en Firebird; ``hasta`` por defecto es hoy
+    info = get_reporte(reporte)
+    set_table(info["tabla"])
+    dimensiones = parse_por(reporte, por)
+    hoy = datetime.date.today()
+    hasta = min(hasta or hoy, hoy)
+    if hasta < desde:
+        raise HTTPException(status_code=400, detail="'desde' no puede ser posterior a 'hasta'")
+    max_dias = config.REPORTS_CONFIG['max_dias']
+    if (hasta - desde).days >= max_dias:
+        raise HTTPException(status_code=400, detail=f"El rango no puede superar {max_dias} días")
+    sql, columnas = build_report(reporte, dimensiones)
 
     try:
-        # Conexión a la base de datos Firebird
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Insertar en la tabla shipto
-        insert_query = """
-        INSERT INTO shipto (ID_N, SUCCLIENTE, COMPANY, ADDR1, PHONE1, ID_VEND, PAIS, EMAIL, DEPARTAMENTO, 
-                           PRIMER_APELLIDO, SEGUNDO_APELLIDO, PRIMER_NOMBRE, SEGUNDO_NOMBRE, FECHA_NACIMIENTO, 
-                           COD_DPTO, COD_MUNICIPIO, CITY, ESTADO, EMAIL_FAC_ELEC)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        cursor.execute(insert_query, (
-            shipto['ID_N'], shipto['SUCCLIENTE'], shipto['COMPANY'], shipto['ADDR1'], shipto['PHONE1'], 
-            shipto['ID_VEND'], shipto['PAIS'], shipto['EMAIL'], shipto['DEPARTAMENTO'], shipto['PRIMER_APELLIDO'], 
-            shipto['SEGUNDO_APELLIDO'], shipto['PRIMER_NOMBRE'], shipto['SEGUNDO_NOMBRE'], 
-            shipto['FECHA_NACIMIENTO'], shipto['COD_DPTO'], shipto['COD_MUNICIPIO'], shipto['CITY'], 
-            shipto['ESTADO'], shipto['EMAIL_FAC_ELEC']
-        ))
-        conn.commit()
-
-        # Retornar los valores insertados
-        result_text = "\n".join([f"{key}: {value}" for key, value in shipto.items()])
-        conn.close()
-        return PlainTextResponse(result_text, media_type="text/plain")
-
+        por_dia = OrderedDict()
+        faltan = []
+        for i in range((hasta - desde).days + 1):
+            dia = desde + datetime.timedelta(days=i)
+            por_dia[dia] = rollups.get((reporte, dimensiones, dia)) if dia < hoy else None
+            if por_dia[dia] is None and dia < hoy:
+                faltan.append(dia)
+
+        # Los días cerrados que faltan, en una consulta por tramo consecutivo y
+        # desde la primaria: lo que se guarda no debe venir de una réplica atrasada
+        for inicio, fin in tramos(faltan):
+            generacion = rollups.generation()
+            filas = await run_db(report_rows, sql, inicio, fin, info["tabla"])
+            nuevos = {dia: [] for dia in faltan if inicio <= dia <= fin}
+            for fila in filas:
+                nuevos.setdefault(day_of(fila[0]), []).append(fila)
+            for dia, filas_dia in nuevos.items():
+                por_dia[dia] = filas_dia
+                rollups.put((reporte, dimensiones, dia), filas_dia, generacion)
+
+        if hasta == hoy:
+            por_dia[hoy] = await reportes_hoy.get_or_load(
+                reporte, sql, [hoy], lambda: run_db(report_rows, sql, hoy, hoy, info["tabla"], lectura=True))
+
+        resultado = {"reporte": reporte, "desde": desde, "hasta": hasta, "por": list(dimensiones),
+                     "columnas": columnas, "filas": [fila for filas in por_dia.values() for fila in filas]}
+        with medir("serialize"):
+            body = await run_in_threadpool(json_bytes, resultado)
+        return Response(body, media_type="application/json")
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al insertar en la tabla shipto: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error al calcular el reporte {reporte}: {str(e)}")
 
-@app.post("/insertar/tributaria")
-async def insertar_tributaria(tributaria: dict):
-    # Verificar que todos los campos requeridos estén presentes
-    required_fields = [
-        'ID_N', 'COMPANY', 'TDOC', 'CV', 'TIPO_CONTRIBUYENTE', 'PRIMER_NOMBRE', 'SEGUNDO_NOMBRE', 
-        'PRIMER_APELLIDO', 'SEGUNDO_APELLIDO'
-    ]
-    
-    for field in required_fields:
-        if field not in tributaria:
-            raise HTTPException(status_code=400, detail=f"Falta el campo requerido: {field}")
 
+async def stream_data(request, tabla, query, params, encoder, chunk_size):
+    # Leemos por bloques con fetchmany para que la memoria no crezca con la tabla
+    partes = (query, params, encoder.media_type, chunk_size)
+    version = None
+    if config.CHANGES_CONFIG['etag']:
+        # En la misma transacción que la consulta: el ETag corresponde a las filas enviadas
+        version = lambda conn: table_version(conn, tabla, config.CHANGES_CONFIG['margen'])
     try:
-        # Conexión a la base de datos Firebird
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Insertar en la tabla tributaria
-        insert_query = """
-        INSERT INTO tributaria (ID_N, COMPANY, TDOC, CV, TIPO_CONTRIBUYENTE, PRIMER_NOMBRE, SEGUNDO_NOMBRE, 
-                               PRIMER_APELLIDO, SEGUNDO_APELLIDO)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        cursor.execute(insert_query, (
-            tributaria['ID_N'], tributaria['COMPANY'], tributaria['TDOC'], tributaria['CV'], 
-            tributaria['TIPO_CONTRIBUYENTE'], tributaria['PRIMER_NOMBRE'], tributaria['SEGUNDO_NOMBRE'], 
-            tributaria['PRIMER_APELLIDO'], tributaria['SEGUNDO_APELLIDO']
-        ))
-        conn.commit()
-
-        # Retornar los valores insertados
-        result_text = "\n".join([f"{key}: {value}" for key, value in tributaria.items()])
-        conn.close()
-        return PlainTextResponse(result_text, media_type="text/plain")
-
+        respuesta = await revalidar(request, tabla, partes)
+        if respuesta is not None:
+            return respuesta
+        consulta = StreamedQuery(query, params, chunk_size=chunk_size, lectura=True, version=version)
+        await consulta.open()
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al insertar en la tabla tributaria: {str(e)}")
-
-# Bloque 2
-@app.post("/insertar/actividad_eco_det")
-async def insertar_actividad_eco_det(actividad_eco: dict):
-    # Verificar que todos los campos requeridos estén presentes
-    required_fields = ['CODACT', 'ID_N', 'PRINCIPAL', 'COD_INTERNACIONAL']
+        raise HTTPException(status_code=500, detail=f"Error during query execution: {str(e)}")
 
-    for field in required_fields:
-        if field not in actividad_eco:
-            raise HTTPException(status_code=400, detail=f"Falta el campo requerido: {field}")
+    async def cuerpo():
+        # Mismo formato que la respuesta completa, bloque por bloque
+        yield encoder.start(consulta.columnas)
+        async for filas in consulta.chunks(request):
+            with medir("serialize"):
+                bloque = encoder.rows(filas)
+            yield bloque
+        yield encoder.end()
+
+    return StreamingResponse(cuerpo(), media_type=encoder.media_type,
+                             headers=cabeceras_etag(make_etag(consulta.version, *partes)))
+
+async def insertar_lote(tabla, filas, parcial):
+    # Un lote se valida completo, se inserta con executemany y se confirma una vez
+    max_batch = config.BULK_CONFIG['max_batch']
+    if len(filas) > max_batch:
+        raise HTTPException(status_code=413, detail=f"El lote supera el máximo de {max_batch} filas")
+
+    errores = []
+    for indice, datos in enumerate(filas):
+        field = missing_field(tabla, datos)
+        if field is not None:
+            errores.append({"fila": indice, "error": f"Falta el campo requerido: {field}"})
+    if errores:
+        raise HTTPException(status_code=400, detail={"message": "Lote inválido", "errores": errores})
+    if not filas:
+        return {"insertados": 0, "errores": []}
 
     try:
-        # Conexión a la base de datos Firebird
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Insertar en la tabla actividad_eco_det
-        insert_query = """
-        INSERT INTO actividad_eco_det (CODACT, ID_N, PRINCIPAL, COD_INTERNACIONAL)
-        VALUES (?, ?, ?, ?)
-        """
-        cursor.execute(insert_query, (
-            actividad_eco['CODACT'], actividad_eco['ID_N'], actividad_eco['PRINCIPAL'], actividad_eco['COD_INTERNACIONAL']
-        ))
+        insertados, errores = await run_db(insert_batch, tabla, filas, parcial)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al insertar en la tabla {tabla}: {str(e)}")
+
+    if insertados:
+        query_cache.invalidate(tabla)
+    if errores and not parcial:
+        # Filas que la base rechazó (restricciones, claves, largos): error del cliente
+        raise HTTPException(status_code=400, detail={
+            "message": f"Error al insertar en la tabla {tabla}; no se insertó ninguna fila",
+            "errores": errores})
+    return {"insertados": insertados, "errores": errores}
+
+async def encolar(tabla, datos):
+    # Modo asíncrono: el registro queda en el journal y el worker lo inserta en
+    # el siguiente lote; el resultado se consulta en /ingesta/{ticket}
+    ticket = await ingesta.submit(tabla, datos)
+    return JSONResponse(status_code=202, content={
+        "ticket": ticket, "estado": "pendiente", "url": f"/ingesta/{ticket}"})
+
+async def insertar_fila(tabla, datos, asincrono, mensaje=None):
+    # Una fila: se inserta y confirma en el executor de base de datos, o con
+    # ``asincrono`` pasa a la ingesta. Responde ``mensaje`` o, si no viene,
+    # los valores insertados como texto
+    check_required(tabla, datos)
+    if asincrono:
+        return await encolar(tabla, datos)
+
+    def insertar(conn):
+        insert_row(conn, tabla, datos)
         conn.commit()
-        conn.close()
-
-        return {"message": "Actividad económica insertada correctamente"}
 
+    try:
+        await run_db(insertar)
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al insertar en la tabla actividad_eco_det: {str(e)}")
-
-@app.post("/insertar/obligaciones_rutdet")
-async def insertar_obligaciones_rutdet(obligacion: dict):
-    # Verificar que todos los campos requeridos estén presentes
-    required_fields = ['CODIGO', 'ID_N']
+        raise HTTPException(status_code=500, detail=f"Error al insertar en la tabla {tabla}: {str(e)}")
 
-    for field in required_fields:
-        if field not in obligacion:
-            raise HTTPException(status_code=400, detail=f"Falta el campo requerido: {field}")
+    if tabla in TABLAS:
+        # Solo las tablas de /consulta pueden estar en caché
+        query_cache.invalidate(tabla)
+    if mensaje is not None:
+        return {"message": mensaje}
+    result_text = "\n".join([f"{key}: {value}" for key, value in datos.items()])
+    return PlainTextResponse(result_text, media_type="text/plain")
 
-    try:
-        # Conexión a la base de datos Firebird
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Insertar en la tabla obligaciones_rutdet
-        insert_query = """
-        INSERT INTO obligaciones_rutdet (CODIGO, ID_N)
-        VALUES (?, ?)
-        """
-        cursor.execute(insert_query, (
-            obligacion['CODIGO'], obligacion['ID_N']
-        ))
-        conn.commit()
-        conn.close()
+# Bloque 1
+@app.post("/insertar/cust")
+async def insertar_cust(cliente: dict, asincrono: bool = Query(False)):
+    return await insertar_fila("cust", cliente, asincrono)
 
-        return {"message": "Obligación RUT insertada correctamente"}
+@app.post("/insertar/cust/lote")
+async def insertar_cust_lote(clientes: List[dict], parcial: bool = Query(False)):
+    return await insertar_lote("cust", clientes, parcial)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al insertar en la tabla obligaciones_rutdet: {str(e)}")
+@app.post("/insertar/shipto")
+async def insertar_shipto(shipto: dict, asincrono: bool = Query(False)):
+    return await insertar_fila("shipto", shipto, asincrono)
 
-@app.post("/insertar/tributos_det")
-async def insertar_tributos_det(tributo: dict):
-    # Verificar que todos los campos requeridos estén presentes
-    required_fields = ['CODIGO', 'ID_N']
+@app.post("/insertar/shipto/lote")
+async def insertar_shipto_lote(sucursales: List[dict], parcial: bool = Query(False)):
+    return await insertar_lote("shipto", sucursales, parcial)
 
-    for field in required_fields:
-        if field not in tributo:
-            raise HTTPException(status_code=400, detail=f"Falta el campo requerido: {field}")
+@app.post("/insertar/tributaria")
+async def insertar_tributaria(tributaria: dict, asincrono: bool = Query(False)):
+    return await insertar_fila("tributaria", tributaria, asincrono)
 
-    try:
-        # Conexión a la base de datos Firebird
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Insertar en la tabla tributos_det
-        insert_query = """
-        INSERT INTO tributosdet (CODIGO, ID_N)
-        VALUES (?, ?)
-        """
-        cursor.execute(insert_query, (
-            tributo['CODIGO'], tributo['ID_N']
-        ))
-        conn.commit()
-        conn.close()
+# Bloque 2
+@app.post("/insertar/actividad_eco_det")
+async def insertar_actividad_eco_det(actividad_eco: dict, asincrono: bool = Query(False)):
+    return await insertar_fila("actividad_eco_det", actividad_eco, asincrono,
+                               "Actividad económica insertada correctamente")
 
-        return {"message": "Tributo insertado correctamente"}
+@app.post("/insertar/obligaciones_rutdet")
+async def insertar_obligaciones_rutdet(obligacion: dict, asincrono: bool = Query(False)):
+    return await insertar_fila("obligaciones_rutdet", obligacion, asincrono,
+                               "Obligación RUT insertada correctamente")
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al insertar en la tabla tributos_det: {str(e)}")
+@app.post("/insertar/tributos_det")
+async def insertar_tributos_det(tributo: dict, asincrono: bool = Query(False)):
+    return await insertar_fila("tributosdet", tributo, asincrono,
+                               "Tributo insertado correctamente")
 
 # Bloque 3
 @app.post("/insertar/oe")
-async def insertar_oe(datos_oe: dict):
-    # Verificar que todos los campos requeridos estén presentes
-    required_fields = [
-        'ID_EMPRESA', 'ID_SUCURSAL', 'NUMBER', 'TIPO', 'ID_USUARIO', 'ID_N', 
-        'SALESMAN', 'FECHA', 'DUEDATE', 'SUBTOTAL', 'COST', 'SALESTAX', 'DESTOTAL',
-        'TOTAL', 'PAGOS', 'DEV_FACTURA', 'DEV_TIPOFACT', 'LETRAS', 'D', 'PORCENIVA',
-        'FORPAGVAL', 'FORMAS_PAGO', 'HORACRE', 'CUFE', 'PREFIJO_POS'
-    ]
-    
-    for field in required_fields:
-        if field not in datos_oe:
-            raise HTTPException(status_code=400, detail=f"Falta el campo requerido: {field}")
-    
-    try:
-        # Conexión a la base de datos Firebird
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Insertar en la tabla oe.
-        insert_query = """
-        INSERT INTO oe (
-            ID_EMPRESA, ID_SUCURSAL, NUMBER, TIPO, ID_USUARIO, ID_N, SALESMAN, FECHA,
-            DUEDATE, SUBTOTAL, COST, SALESTAX, DESTOTAL, TOTAL, PAGOS, DEV_FACTURA,
-            DEV_TIPOFAC, LETRAS, D, PORCENIVA, FORPAGVAL, FORMAS_PAGO, HORCRE, CUFE, PREFIJO_POS
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        cursor.execute(insert_query, (
-            datos_oe['ID_EMPRESA'], datos_oe['ID_SUCURSAL'], datos_oe['NUMBER'], datos_oe['TIPO'],
-            datos_oe['ID_USUARIO'], datos_oe['ID_N'], datos_oe['SALESMAN'], datos_oe['FECHA'],
-            datos_oe['DUEDATE'], datos_oe['SUBTOTAL'], datos_oe['COST'], datos_oe['SALESTAX'],
-            datos_oe['DESTOTAL'], datos_oe['TOTAL'], datos_oe['PAGOS'], datos_oe['DEV_FACTURA'],
-            datos_oe['DEV_TIPOFAC'], datos_oe['LETRAS'], datos_oe['D'], datos_oe['PORCENIVA'],
-            datos_oe['FORPAGVAL'], datos_oe['FORMAS_PAGO'], datos_oe['HORCRE'], datos_oe['CUFE'],
-            datos_oe['PREFIJO_POS']
-        ))
-        conn.commit()
+async def insertar_oe(datos_oe: dict, asincrono: bool = Query(False)):
+    return await insertar_fila("oe", datos_oe, asincrono)
 
-        # Retornar los valores insertados
-        result_text = "\n".join([f"{key}: {value}" for key, value in datos_oe.items()])
-        conn.close()
+@app.post("/insertar/oedet")
+async def insertar_oedet(datos_oedet: dict, asincrono: bool = Query(False)):
+    return await insertar_fila("oedet", datos_oedet, asincrono,
+                               "Registro de oedet insertado correctamente")
 
-        return PlainTextResponse(result_text, media_type="text/plain")
+@app.post("/insertar/oedet/lote")
+async def insertar_oedet_lote(lineas: List[dict], parcial: bool = Query(False)):
+    return await insertar_lote("oedet", lineas, parcial)
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al insertar en la tabla oe: {str(e)}")
+@app.post("/insertar/pagos")
+async def insertar_pagos(datos_pagos: dict, asincrono: bool = Query(False)):
+    return await insertar_fila("pagos", datos_pagos, asincrono,
+                               "Registro de pagos insertado correctamente")
 
-@app.post("/insertar/oedet")
-async def insertar_oedet(datos_oedet: dict):
-    # Verificar que todos los campos requeridos estén presentes
-    required_fields = [
-        'CONTEO', 'ID_EMPRESA', 'ID_SUCURSAL', 'NUMBER', 'TIPO', 'ID_USUARIO', 'ITEM', 
-        'LOCATION', 'IVA', 'QTYSHIP', 'PRICE', 'EXTEND', 'COST', 'TOTALDCT', 'VLR_IVA', 
-        'PORC_IVA', 'PRECIOIVA', 'VLR_DCTOAD1', 'DPTO', 'CCOST', 'NUMITEM', 'COD_TALLA', 'CODBARRASCURVA'
-    ]
-    
-    for field in required_fields:
-        if field not in datos_oedet:
-            raise HTTPException(status_code=400, detail=f"Falta el campo requerido: {field}")
-    
-    try:
-        # Conexión a la base de datos Firebird
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Insertar en la tabla oedet.
-        insert_query = """
-        INSERT INTO oedet (
-            CONTEO, ID_EMPRESA, ID_SUCURSAL, NUMBER, TIPO, ID_USUARIO, ITEM, LOCATION, 
-            IVA, QTYSHIP, PRICE, EXTEND, COST, TOTALDCT, VLR_IVA, PORC_IVA, PRECIOIVA, 
-            VLR_DCTOAD1, DPTO, CCOST, NUMITEM, COD_TALLA, CODBARRASCURVA
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        cursor.execute(insert_query, (
-            datos_oedet['CONTEO'], datos_oedet['ID_EMPRESA'], datos_oedet['ID_SUCURSAL'], 
-            datos_oedet['NUMBER'], datos_oedet['TIPO'], datos_oedet['ID_USUARIO'], 
-            datos_oedet['ITEM'], datos_oedet['LOCATION'], datos_oedet['IVA'], 
-            datos_oedet['QTYSHIP'], datos_oedet['PRICE'], datos_oedet['EXTEND'], 
-            datos_oedet['COST'], datos_oedet['TOTALDCT'], datos_oedet['VLR_IVA'], 
-            datos_oedet['PORC_IVA'], datos_oedet['PRECIOIVA'], datos_oedet['VLR_DCTOAD1'], 
-            datos_oedet['DPTO'], datos_oedet['CCOST'], datos_oedet['NUMITEM'], 
-            datos_oedet['COD_TALLA'], datos_oedet['CODBARRASCURVA']
-        ))
-        conn.commit()
-        conn.close()
+@app.post("/insertar/pagos/lote")
+async def insertar_pagos_lote(pagos: List[dict], parcial: bool = Query(False)):
+    return await insertar_lote("pagos", pagos, parcial)
 
-        return {"message": "Registro de oedet insertado correctamente"}
+@app.post("/insertar/itemact")
+async def insertar_itemact(datos_itemact: dict, asincrono: bool = Query(False)):
+    return await insertar_fila("itemact", datos_itemact, asincrono,
+                               "Registro de itemact insertado correctamente")
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al insertar en la tabla oedet: {str(e)}")
+@app.post("/insertar/itemact/lote")
+async def insertar_itemact_lote(movimientos: List[dict], parcial: bool = Query(False)):
+    return await insertar_lote("itemact", movimientos, parcial)
 
-@app.post("/insertar/pagos")
-async def insertar_pagos(datos_pagos: dict):
-    # Verificar que todos los campos requeridos estén presentes
-    required_fields = [
-        'ID_EMPRESA', 'ID_SUCURSAL', 'NUMERO', 'TIPO', 'USUARIO', 'ACCT', 'CONCEPTO',
-        'DESCRIPCION', 'PORC', 'FECHA', 'NUM_DOC', 'VLR_PAGO', 'CONTA', 'ID_N', 'VALORECIB', 'CONTEO'
-    ]
-    
-    for field in required_fields:
-        if field not in datos_pagos:
-            raise HTTPException(status_code=400, detail=f"Falta el campo requerido: {field}")
-    
-    try:
-        # Conexión a la base de datos Firebird
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Insertar en la tabla pagos.
-        insert_query = """
-        INSERT INTO pagos (
-            EMPRESA, SUCURSAL, NUMERO, TIPO, USUARIO, ACCT, CONCEPTO, DESCRIPCION, 
-            PORC, FECHA, NUM_DOC, VLR_PAGO, CONTA, ID_N, VALRECIB, CONTEO
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        cursor.execute(insert_query, (
-            datos_pagos['EMPRESA'], datos_pagos['SUCURSAL'], datos_pagos['NUMERO'], 
-            datos_pagos['TIPO'], datos_pagos['USUARIO'], datos_pagos['ACCT'], datos_pagos['CONCEPTO'], 
-            datos_pagos['DESCRIPCION'], datos_pagos['PORC'], datos_pagos['FECHA'], 
-            datos_pagos['NUM_DOC'], datos_pagos['VLR_PAGO'], datos_pagos['CONTA'], 
-            datos_pagos['ID_N'], datos_pagos['VALRECIB'], datos_pagos['CONTEO']
-        ))
-        conn.commit()
-        conn.close()
 
-        return {"message": "Registro de pagos insertado correctamente"}
+# Documento completo
+@app.post("/documentos")
+async def insertar_documento(documento: dict):
+    # Encabezado oe con sus líneas (oedet), pagos y movimientos (itemact) en una
+    # sola transacción; las líneas toman del encabezado la llave del documento
+    errores = prepare_document(documento)
+    if errores:
+        raise HTTPException(status_code=400, detail={"message": "Documento inválido", "errores": errores})
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al insertar en la tabla pagos: {str(e)}")
+    max_batch = config.BULK_CONFIG['max_batch']
+    if sum(len(documento[seccion]) for seccion in SECCIONES_DOCUMENTO) > max_batch:
+        raise HTTPException(status_code=413, detail=f"El documento supera el máximo de {max_batch} filas")
 
-@app.post("/insertar/itemact")
-async def insertar_itemact(datos_itemact: dict):
-    # Verificar que todos los campos requeridos estén presentes
-    required_fields = [
-        'LOCATION', 'ITEM', 'TIPO', 'BATCH', 'FECHA', 'QTY', 'NUMITEM', 
-        'COD_TALLA', 'VALUNIT', 'COSTOP', 'TOTPARCIAL'
-    ]
-    
-    for field in required_fields:
-        if field not in datos_itemact:
-            raise HTTPException(status_code=400, detail=f"Falta el campo requerido: {field}")
-    
     try:
-        # Conexión a la base de datos Firebird
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Insertar en la tabla itemact.
-        insert_query = """
-        INSERT INTO itemact (
-            LOCATION, ITEM, TIPO, BATCH, FECHA, QTY, NUMITEM, COD_TALLA, 
-            VALUNIT, COSTOP, TOTPARCIAL
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """
-        cursor.execute(insert_query, (
-            datos_itemact['LOCATION'], datos_itemact['ITEM'], datos_itemact['TIPO'], 
-            datos_itemact['BATCH'], datos_itemact['FECHA'], datos_itemact['QTY'], 
-            datos_itemact['NUMITEM'], datos_itemact['COD_TALLA'], datos_itemact['VALUNIT'], 
-            datos_itemact['COSTOP'], datos_itemact['TOTPARCIAL']
-        ))
-        conn.commit()
-        conn.close()
+        errores = await run_db(insert_document, documento)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al insertar el documento: {str(e)}")
 
-        return {"message": "Registro de itemact insertado correctamente"}
+    if errores:
+        raise HTTPException(status_code=400, detail={
+            "message": "Error al insertar el documento; no se insertó ninguna fila",
+            "errores": errores})
 
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al insertar en la tabla itemact: {str(e)}")
+    for tabla in ["oe"] + SECCIONES_DOCUMENTO:
+        query_cache.invalidate(tabla)
+    resultado = {"message": "Documento insertado correctamente", "oe": 1}
+    for seccion in SECCIONES_DOCUMENTO:
+        resultado[seccion] = len(documento[seccion])
+    return resultado
 
 
 #Update
+async def actualizar_lote(tabla, filas, insertar, parcial):
+    # Cada fila trae la clave y solo los campos que cambian; con ``insertar`` las
+    # que no existen se crean (UPDATE OR INSERT). Todo el lote va en una transacción
+    max_batch = config.BULK_CONFIG['max_batch']
+    if len(filas) > max_batch:
+        raise HTTPException(status_code=413, detail=f"El lote supera el máximo de {max_batch} filas")
+
+    errores = []
+    for indice, datos in enumerate(filas):
+        error = upsert_error(tabla, datos)
+        if error is not None:
+            errores.append({"fila": indice, "error": error})
+    if errores:
+        raise HTTPException(status_code=400, detail={"message": "Lote inválido", "errores": errores})
+    if not filas:
+        return {"aplicados": 0, "resultados": [], "errores": []}
+
+    try:
+        resultados, errores = await run_db(upsert_batch, tabla, filas, insertar, parcial)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error al actualizar en la tabla {tabla}: {str(e)}")
+
+    aplicados = resultados.count("ok")
+    if aplicados:
+        query_cache.invalidate(tabla)
+    if errores and not parcial:
+        raise HTTPException(status_code=400, detail={
+            "message": f"Error al actualizar en la tabla {tabla}; no se aplicó ninguna fila",
+            "resultados": resultados, "errores": errores})
+    return {"aplicados": aplicados, "resultados": resultados, "errores": errores}
+
+# Antes de /actualizar/shipto/{id_n}, que también acepta "lote" como id_n
+@app.put("/actualizar/cust/lote")
+async def actualizar_cust_lote(clientes: List[dict], insertar: bool = Query(True), parcial: bool = Query(False)):
+    return await actualizar_lote("cust", clientes, insertar, parcial)
+
+@app.put("/actualizar/shipto/lote")
+async def actualizar_shipto_lote(sucursales: List[dict], insertar: bool = Query(True),
+                                 parcial: bool = Query(False)):
+    return await actualizar_lote("shipto", sucursales, insertar, parcial)
+
 @app.put("/actualizar/shipto/{id_n}")
 async def actualizar_shipto(id_n: int, datos_shipto: dict):
     # Asegurarse de que todos los campos sean proporcionados
@@ -455,24 +648,28 @@ async def actualizar_shipto(id_n: int, datos_shipto: dict):
         if field not in datos_shipto or datos_shipto[field] is None:
             raise HTTPException(status_code=400, detail=f"Falta el campo requerido: {field}")
     
-    try:
-        # Conexión a la base de datos Firebird
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
+    def actualizar(conn):
         # Actualizar en la tabla shipto.
         update_query = """
         UPDATE SHIPTO
         SET ADDR1 = ?, PHONE1 = ?, EMAIL = ?, EMAIL_FAC_ELEC = ?
         WHERE ID_N = ?
         """
-        cursor.execute(update_query, (
+        params = (
             datos_shipto['ADDR1'], datos_shipto['PHONE1'], datos_shipto['EMAIL'], datos_shipto['EMAIL_FAC_ELEC'], id_n
-        ))
+        )
+        cursor, sentencia = conn.statement(update_query)
+        with medir("execute", update_query, params, "shipto"):
+            cursor.execute(sentencia, params)
         conn.commit()
-        conn.close()
-
-        return {"message": "Datos de Shipto actualizados correctamente"}
 
+    try:
+        # La escritura corre en el executor de base de datos
+        await run_db(actualizar)
+        query_cache.invalidate("shipto")
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error al actualizar en la tabla shipto: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error al actualizar en la tabla shipto: {str(e)}")
+
+    return {"message": "Datos de Shipto actualizados correctamente"}
\ No newline at end of file
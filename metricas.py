@@ -0,0 +1,191 @@
+"""Métricas en memoria con salida en formato de texto de Prometheus.
+
+Registrar una observación cuesta un ``bisect`` y unas sumas bajo un lock, así
+que se puede dejar activo en producción. Las etiquetas de ruta y tabla viajan
+en ``contextvars`` y llegan también a los hilos del executor de base de datos.
+"""
+import contextvars
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+import config
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+# Scope ASGI de la petición en curso (el router agrega la ruta) y tabla que trabaja
+_scope = contextvars.ContextVar("scope", default=None)
+_tabla = contextvars.ContextVar("tabla", default="")
+
+slow_log = logging.getLogger("api.slow_query")
+
+
+def _escape(valor):
+    return str(valor).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(nombres, valores, extra=""):
+    pares = [f'{n}="{_escape(v)}"' for n, v in zip(nombres, valores)]
+    if extra:
+        pares.append(extra)
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+
+class Counter:
+    def __init__(self, nombre, ayuda, etiquetas=()):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self._valores = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *valores, cantidad=1):
+        with self._lock:
+            self._valores[valores] = self._valores.get(valores, 0) + cantidad
+
+    def render(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} counter"]
+        with self._lock:
+            for valores, total in sorted(self._valores.items()):
+                lineas.append(f"{self.nombre}{_labels(self.etiquetas, valores)} {total}")
+        return lineas
+
+
+class Histogram:
+    def __init__(self, nombre, ayuda, etiquetas=(), buckets=LATENCY_BUCKETS):
+        self.nombre = nombre
+        self.ayuda = ayuda
+        self.etiquetas = etiquetas
+        self.buckets = tuple(buckets)
+        self._series = {}  # etiquetas -> [conteos por bucket..., suma, total]
+        self._lock = threading.Lock()
+
+    def observe(self, valor, *valores):
+        indice = bisect_left(self.buckets, valor)
+        with self._lock:
+            serie = self._series.get(valores)
+            if serie is None:
+                serie = self._series[valores] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            serie[indice] += 1
+            serie[-2] += valor
+            serie[-1] += 1
+
+    def render(self):
+        lineas = [f"# HELP {self.nombre} {self.ayuda}", f"# TYPE {self.nombre} histogram"]
+        with self._lock:
+            series = sorted((k, list(v)) for k, v in self._series.items())
+        for valores, serie in series:
+            acumulado = 0
+            for limite, cantidad in zip(self.buckets + ("+Inf",), serie):
+                acumulado += cantidad
+                le = f'le="{limite}"'
+                lineas.append(f"{self.nombre}_bucket{_labels(self.etiquetas, valores, le)} {acumulado}")
+            lineas.append(f"{self.nombre}_sum{_labels(self.etiquetas, valores)} {serie[-2]}")
+            lineas.append(f"{self.nombre}_count{_labels(self.etiquetas, valores)} {serie[-1]}")
+        return lineas
+
+
+fase_seconds = Histogram("api_db_phase_seconds",
+                         "Tiempo por fase (connect, execute, fetch, serialize)",
+                         ("fase", "ruta", "tabla"))
+request_seconds = Histogram("api_request_seconds", "Duración de las peticiones HTTP",
+                            ("metodo", "ruta", "status"))
+response_bytes = Histogram("api_response_bytes", "Tamaño del cuerpo de las respuestas",
+                           ("ruta",), SIZE_BUCKETS)
+rows_total = Counter("api_rows_total", "Filas leídas o escritas", ("ruta", "tabla"))
+slow_queries_total = Counter("api_slow_queries_total", "Sentencias sobre el umbral de lentitud",
+                             ("ruta", "tabla"))
+
+_METRICAS = [fase_seconds, request_seconds, response_bytes, rows_total, slow_queries_total]
+_COLECTORES = []
+
+
+def register_gauges(prefijo, fuente):
+    """Publica como gauges los valores numéricos de ``fuente()`` (p. ej. ``pool.stats``)."""
+    _COLECTORES.append((prefijo, fuente))
+
+
+def current_route():
+    scope = _scope.get()
+    if scope is None:
+        return ""
+    ruta = scope.get("route")
+    if ruta is not None and getattr(ruta, "path", None):
+        return ruta.path
+    endpoint = scope.get("endpoint")
+    return endpoint.__name__ if endpoint is not None else "sin_ruta"
+
+
+def set_table(tabla):
+    _tabla.set(tabla)
+
+
+@contextmanager
+def medir(fase, sql=None, params=None, tabla=None, filas=None):
+    """Mide una fase; si es una sentencia lenta la registra en el log.
+
+    En un ``executemany`` van los parámetros de la primera fila y ``filas``.
+    """
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        ruta, tabla = current_route(), tabla or _tabla.get()
+        fase_seconds.observe(duracion, fase, ruta, tabla)
+        if sql is not None and duracion >= config.METRICS_CONFIG['slow_query_seconds']:
+            slow_queries_total.inc(ruta, tabla)
+            lote = f" (primera de {filas} filas)" if filas is not None else ""
+            slow_log.warning("Consulta lenta (%.3fs) en %s: %s params=%r%s",
+                             duracion, ruta or "-", " ".join(str(sql).split()), params, lote)
+
+
+def count_rows(cantidad, tabla=None):
+    if cantidad:
+        rows_total.inc(current_route(), tabla or _tabla.get(), cantidad=cantidad)
+
+
+def render():
+    lineas = []
+    for metrica in _METRICAS:
+        lineas.extend(metrica.render())
+    for prefijo, fuente in _COLECTORES:
+        for clave, valor in sorted(fuente().items()):
+            if isinstance(valor, (int, float)) and not isinstance(valor, bool):
+                nombre = f"{prefijo}_{clave}"
+                lineas.append(f"# TYPE {nombre} gauge")
+                lineas.append(f"{nombre} {valor}")
+    return "\n".join(lineas) + "\n"
+
+
+class MetricsMiddleware:
+    """Middleware ASGI: duración, status y bytes enviados por ruta."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = _scope.set(scope)
+        inicio = time.perf_counter()
+        estado = {"status": 500, "bytes": 0}
+
+        async def enviar(mensaje):
+            if mensaje["type"] == "http.response.start":
+                estado["status"] = mensaje["status"]
+            elif mensaje["type"] == "http.response.body":
+                estado["bytes"] += len(mensaje.get("body", b""))
+            await send(mensaje)
+
+        try:
+            await self.app(scope, receive, enviar)
+        finally:
+            ruta = current_route()
+            request_seconds.observe(time.perf_counter() - inicio, scope["method"], ruta, estado["status"])
+            response_bytes.observe(estado["bytes"], ruta)
+            _scope.reset(token)
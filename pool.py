@@ -0,0 +1,374 @@
+import ctypes
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+import fdb
+
+from metricas import medir
+
+# fdb no expone fb_cancel_operation: ``PooledConnection.cancel`` la llama en la
+# librería cliente con estos nombres de fdb. Se resuelven al importar para que
+# otra versión de fdb (o un error de tipeo) falle al arrancar y no al cancelar.
+_load_api = fdb.fbcore.load_api
+_STATUS_ARRAY = fdb.ibase.ISC_STATUS_ARRAY
+_CANCEL_RAISE = fdb.ibase.fb_cancel_raise
+
+
+class PoolTimeout(Exception):
+    """No se obtuvo una conexión del pool dentro del tiempo de espera."""
+
+
+class PoolClosed(Exception):
+    """El pool fue cerrado y ya no entrega conexiones."""
+
+
+class StatementCache:
+    """Sentencias preparadas de una conexión, por texto SQL, con desalojo LRU.
+
+    Cada sentencia tiene su propio cursor: en fdb un PreparedStatement solo
+    se ejecuta con el cursor que lo preparó. Con ``max_size`` 0 no se cachea
+    y se devuelve el texto SQL tal cual.
+    """
+
+    def __init__(self, con, max_size):
+        self.con = con
+        self.max_size = max_size
+        self._sentencias = OrderedDict()
+        self.prepares = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def get(self, sql):
+        if self.max_size <= 0:
+            return self.con.cursor(), sql
+        entrada = self._sentencias.get(sql)
+        if entrada is not None:
+            self._sentencias.move_to_end(sql)
+            self.hits += 1
+            return entrada
+        cursor = self.con.cursor()
+        entrada = (cursor, cursor.prep(sql))
+        self.prepares += 1
+        self._sentencias[sql] = entrada
+        if len(self._sentencias) > self.max_size:
+            _, viejo = self._sentencias.popitem(last=False)
+            self._cerrar(viejo)
+            self.evictions += 1
+        return entrada
+
+    def _cerrar(self, entrada):
+        # Al soltar la última referencia fdb libera el handle en el servidor
+        cursor, ps = entrada
+        try:
+            ps.close()
+            cursor.close()
+        except Exception:
+            pass
+
+    def __len__(self):
+        return len(self._sentencias)
+
+    def clear(self):
+        for entrada in self._sentencias.values():
+            self._cerrar(entrada)
+        self._sentencias.clear()
+
+
+class PooledConnection:
+    """Conexión fdb administrada por el pool.
+
+    Delegamos todo en la conexión real (cursor, commit, rollback...) y
+    guardamos cuándo se creó, cuándo se usó por última vez y sus sentencias
+    preparadas.
+    """
+
+    def __init__(self, con, statement_cache_size=64):
+        self.con = con
+        self.created = time.monotonic()
+        self.last_used = self.created
+        self.statements = StatementCache(con, statement_cache_size)
+        self.statement_timeout = 0
+
+    def statement(self, sql):
+        """Devuelve ``(cursor, sentencia)`` listos para ``cursor.execute(sentencia, params)``.
+
+        La sentencia se prepara una sola vez por conexión y se reutiliza en
+        las siguientes llamadas con el mismo texto SQL.
+        """
+        return self.statements.get(sql)
+
+    def __getattr__(self, name):
+        return getattr(self.con, name)
+
+    def close(self):
+        # Los handlers no deben cerrar la conexión real; el pool la recupera
+        pass
+
+    def set_statement_timeout(self, segundos):
+        """Límite de Firebird 4 para cada sentencia de la conexión (0 lo quita).
+
+        Lo aplica el servidor aunque el cliente no alcance a cancelar. Solo se
+        envía cuando cambia respecto del anterior.
+        """
+        milisegundos = int(segundos * 1000)
+        if milisegundos == self.statement_timeout:
+            return
+        cursor = self.con.cursor()
+        cursor.execute(f"SET STATEMENT TIMEOUT {milisegundos} MILLISECOND")
+        self.statement_timeout = milisegundos
+
+    def cancel(self):
+        """Aborta la sentencia en curso desde otro hilo (fb_cancel_operation).
+
+        El hilo que ejecuta la sentencia recibe un error de fdb y la conexión
+        vuelve al pool con rollback.
+        """
+        api = _load_api()
+        status = _STATUS_ARRAY()
+        api.client_library.fb_cancel_operation(status, ctypes.byref(self.con._db_handle), _CANCEL_RAISE)
+
+
+class ConnectionPool:
+    """Pool de conexiones Firebird con tamaño mínimo/máximo.
+
+    - Las conexiones inactivas más allá de ``idle_timeout`` se cierran (sin
+      bajar de ``min_size``).
+    - Antes de entregar una conexión que lleva más de ``validation_interval``
+      segundos sin usarse se verifica con ``liveness_query``; si falla se
+      reemplaza por una nueva.
+    - ``acquire`` espera como máximo ``checkout_timeout`` segundos.
+    - Con ``statement_timeouts`` (Firebird 4.0 o superior) las operaciones
+      fijan en la conexión el límite por sentencia del servidor.
+    """
+
+    def __init__(self, dsn, user, password, min_size=1, max_size=10,
+                 idle_timeout=300, checkout_timeout=10, validation_interval=5,
+                 liveness_query="SELECT 1 FROM RDB$DATABASE", statement_cache_size=64,
+                 statement_timeouts=False, **connect_args):
+        if min_size > max_size:
+            raise ValueError("min_size no puede ser mayor que max_size")
+        self.dsn = dsn
+        self.user = user
+        self.password = password
+        self.connect_args = connect_args
+        self.min_size = min_size
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.checkout_timeout = checkout_timeout
+        self.validation_interval = validation_interval
+        self.liveness_query = liveness_query
+        self.statement_cache_size = statement_cache_size
+        self.statement_timeouts = statement_timeouts
+
+        self._idle = deque()
+        self._in_use = set()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._pending = 0
+        self._waiting = 0
+
+        # Contadores expuestos en stats()
+        self._checkouts = 0
+        self._timeouts = 0
+        self._created = 0
+        self._replaced = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        # Contadores de sentencias de conexiones ya descartadas
+        self._retired_prepares = 0
+        self._retired_hits = 0
+        self._retired_evictions = 0
+
+    # Ciclo de vida
+
+    def open(self):
+        """Crea las conexiones mínimas por adelantado."""
+        with self._cond:
+            faltantes = self.min_size - self._size()
+        for _ in range(max(faltantes, 0)):
+            pc = self._connect()
+            with self._cond:
+                self._idle.append(pc)
+                self._cond.notify()
+
+    def close(self):
+        """Cierra todas las conexiones y rechaza nuevos checkouts."""
+        with self._cond:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+        for pc in idle:
+            self._discard(pc)
+
+    def _connect(self):
+        with medir("connect"):
+            con = fdb.connect(dsn=self.dsn, user=self.user, password=self.password,
+                              **self.connect_args)
+        with self._cond:
+            self._created += 1
+        return PooledConnection(con, self.statement_cache_size)
+
+    def _discard(self, pc):
+        # Las sentencias preparadas mueren con su conexión
+        with self._cond:
+            self._retired_prepares += pc.statements.prepares
+            self._retired_hits += pc.statements.hits
+            self._retired_evictions += pc.statements.evictions
+        pc.statements.clear()
+        try:
+            pc.con.close()
+        except Exception:
+            pass
+
+    def _size(self):
+        return len(self._idle) + len(self._in_use) + self._pending
+
+    def _is_alive(self, pc):
+        try:
+            cur = pc.con.cursor()
+            cur.execute(self.liveness_query)
+            cur.fetchall()
+            pc.con.commit()
+            return True
+        except Exception:
+            return False
+
+    # Checkout / checkin
+
+    def acquire(self):
+        inicio = time.monotonic()
+        limite = inicio + self.checkout_timeout
+        while True:
+            pc = None
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise PoolClosed("El pool de conexiones está cerrado")
+                    if self._idle:
+                        pc = self._idle.pop()
+                        self._in_use.add(pc)
+                        break
+                    if self._size() < self.max_size:
+                        # Reservamos el cupo antes de conectar fuera del lock
+                        self._pending += 1
+                        break
+                    restante = limite - time.monotonic()
+                    if restante <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout(
+                            f"Sin conexiones disponibles tras {self.checkout_timeout}s "
+                            f"(max_size={self.max_size})")
+                    self._waiting += 1
+                    try:
+                        self._cond.wait(restante)
+                    finally:
+                        self._waiting -= 1
+
+            if pc is None:
+                try:
+                    pc = self._connect()
+                finally:
+                    with self._cond:
+                        self._pending -= 1
+                        if pc is None:
+                            self._cond.notify()
+                        else:
+                            self._in_use.add(pc)
+            else:
+                ahora = time.monotonic()
+                expirada = ahora - pc.last_used > self.idle_timeout
+                validar = ahora - pc.last_used > self.validation_interval
+                if expirada or (validar and not self._is_alive(pc)):
+                    with self._cond:
+                        self._in_use.discard(pc)
+                        self._replaced += 1
+                        self._cond.notify()
+                    self._discard(pc)
+                    continue
+
+            espera = time.monotonic() - inicio
+            with self._cond:
+                self._checkouts += 1
+                self._wait_total += espera
+                self._wait_max = max(self._wait_max, espera)
+            return pc
+
+    def release(self, pc, broken=False):
+        """Devuelve la conexión al pool.
+
+        Si ``broken`` es verdadero o la conexión no admite rollback, se
+        descarta y su cupo queda libre para una conexión nueva.
+        """
+        if not broken:
+            try:
+                # Sin efecto si el handler ya hizo commit
+                pc.con.rollback()
+            except Exception:
+                broken = True
+        pc.last_used = time.monotonic()
+        with self._cond:
+            self._in_use.discard(pc)
+            if broken or self._closed:
+                descartar = [pc]
+                if broken:
+                    self._replaced += 1
+            else:
+                self._idle.append(pc)
+                descartar = self._expire_idle()
+            self._cond.notify()
+        for viejo in descartar:
+            self._discard(viejo)
+
+    def _expire_idle(self):
+        # Llamado con el lock tomado; las más antiguas están al inicio
+        ahora = time.monotonic()
+        expiradas = []
+        while (self._idle and self._size() > self.min_size
+               and ahora - self._idle[0].last_used > self.idle_timeout):
+            expiradas.append(self._idle.popleft())
+        return expiradas
+
+    @contextmanager
+    def connection(self):
+        pc = self.acquire()
+        try:
+            yield pc
+        finally:
+            # Si la conexión quedó rota, el rollback de release() falla y se descarta
+            self.release(pc)
+
+    def load(self):
+        """Conexiones ocupadas o pedidas; lo usa la elección de réplica."""
+        with self._cond:
+            return len(self._in_use) + self._pending + self._waiting
+
+    def stats(self):
+        with self._cond:
+            en_uso = len(self._in_use)
+            conexiones = list(self._idle) + list(self._in_use)
+            prepares = self._retired_prepares + sum(pc.statements.prepares for pc in conexiones)
+            hits = self._retired_hits + sum(pc.statements.hits for pc in conexiones)
+            evictions = self._retired_evictions + sum(pc.statements.evictions for pc in conexiones)
+            return {
+                "size": self._size(),
+                "idle": len(self._idle),
+                "in_use": en_uso,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "waiting": self._waiting,
+                "saturation": en_uso / self.max_size,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "connections_created": self._created,
+                "connections_replaced": self._replaced,
+                "wait_avg_ms": (self._wait_total / self._checkouts * 1000) if self._checkouts else 0.0,
+                "wait_max_ms": self._wait_max * 1000,
+                "statements_cached": sum(len(pc.statements) for pc in conexiones),
+                "statements_prepared": prepares,
+                "statement_cache_hits": hits,
+                "statement_cache_hit_rate": hits / (hits + prepares) if hits + prepares else 0.0,
+                "statement_cache_evictions": evictions,
+            }
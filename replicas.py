@@ -0,0 +1,183 @@
+"""Reparto de lecturas entre réplicas de solo lectura.
+
+Las escrituras siempre usan la primaria. Las lecturas toman una réplica sana
+según la estrategia (``round_robin`` o ``least_connections``); si no hay
+ninguna, o la elegida falla, se leen en la primaria. Una réplica sale del
+reparto al no entregar conexión o tras ``max_fallos`` errores seguidos, y un
+hilo la vuelve a probar cada ``health_interval`` segundos.
+
+Para leer lo recién escrito, la petición manda ``X-Read-After-Write: 1`` y
+se atiende en la primaria.
+"""
+import contextvars
+import itertools
+import threading
+import time
+
+
+# La petición en curso pidió leer de la primaria
+_leer_primaria = contextvars.ContextVar("leer_primaria", default=False)
+
+ESTRATEGIAS = ("round_robin", "least_connections")
+
+
+class Replica:
+    def __init__(self, nombre, pool):
+        self.nombre = nombre
+        self.pool = pool
+        self.sana = True
+        self.fallos = 0
+        self.ultimo_error = None
+        self.caida_desde = None
+        self.lecturas = 0
+
+    def stats(self):
+        return dict(self.pool.stats(), healthy=int(self.sana), consecutive_failures=self.fallos,
+                    reads=self.lecturas)
+
+
+class ReplicaRouter:
+    def __init__(self, primaria, replicas, estrategia="least_connections", max_fallos=3,
+                 health_interval=5):
+        if estrategia not in ESTRATEGIAS:
+            raise ValueError(f"Estrategia desconocida: {estrategia} ({', '.join(ESTRATEGIAS)})")
+        self.primaria = primaria
+        self.replicas = [Replica(pool.dsn, pool) for pool in replicas]
+        self.estrategia = estrategia
+        self.max_fallos = max_fallos
+        self.health_interval = health_interval
+        self._turno = itertools.count()
+        self._lock = threading.Lock()
+        self._detener = threading.Event()
+        self._hilo = None
+        self.lecturas_primaria = 0
+        self.failovers = 0
+
+    # Ciclo de vida
+
+    def open(self):
+        """Precalienta las réplicas; las que no responden quedan fuera."""
+        for replica in self.replicas:
+            try:
+                replica.pool.open()
+            except Exception as e:
+                self._caida(replica, e)
+        if self.replicas:
+            self._hilo = threading.Thread(target=self._vigilar, name="replicas", daemon=True)
+            self._hilo.start()
+
+    def close(self):
+        self._detener.set()
+        for replica in self.replicas:
+            replica.pool.close()
+
+    def _vigilar(self):
+        while not self._detener.wait(self.health_interval):
+            self.check()
+
+    def check(self):
+        """Vuelve a probar las réplicas caídas con la consulta de vida del pool."""
+        for replica in self.replicas:
+            if replica.sana:
+                continue
+            try:
+                with replica.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    cursor.execute(replica.pool.liveness_query)
+                    cursor.fetchall()
+            except Exception as e:
+                with self._lock:
+                    replica.ultimo_error = str(e)
+                continue
+            with self._lock:
+                replica.sana = True
+                replica.fallos = 0
+                replica.caida_desde = None
+            print(f"Réplica {replica.nombre} disponible de nuevo")
+
+    # Elección
+
+    def choose(self):
+        """Réplica para la lectura en curso, o None para usar la primaria."""
+        if _leer_primaria.get():
+            return None
+        sanas = [r for r in self.replicas if r.sana]
+        if not sanas:
+            return None
+        if self.estrategia == "round_robin":
+            return sanas[next(self._turno) % len(sanas)]
+        # A igual carga, la que atendió menos lecturas
+        return min(sanas, key=lambda r: (r.pool.load(), r.lecturas))
+
+    def read(self, pool):
+        """Cuenta una lectura atendida por ``pool`` (una réplica o la primaria)."""
+        with self._lock:
+            if pool is self.primaria:
+                self.lecturas_primaria += 1
+            else:
+                self._replica(pool).lecturas += 1
+
+    def saturated(self, pool):
+        """La réplica de ``pool`` no tuvo conexión a tiempo; sigue en el reparto."""
+        with self._lock:
+            self.failovers += 1
+
+    def unavailable(self, pool, error):
+        """La réplica de ``pool`` no entregó conexión: sale del reparto."""
+        with self._lock:
+            self.failovers += 1
+        self._caida(self._replica(pool), error)
+
+    def _replica(self, pool):
+        return next(r for r in self.replicas if r.pool is pool)
+
+    def succeeded(self, pool):
+        """La lectura en la réplica de ``pool`` terminó bien."""
+        self._replica(pool).fallos = 0
+
+    def failed(self, pool, error):
+        """La lectura falló en la réplica de ``pool``; tras varios fallos seguidos sale."""
+        replica = self._replica(pool)
+        with self._lock:
+            replica.fallos += 1
+            replica.ultimo_error = str(error)
+            self.failovers += 1
+            caida = replica.fallos >= self.max_fallos and replica.sana
+        if caida:
+            self._caida(replica, error)
+
+    def _caida(self, replica, error):
+        with self._lock:
+            if not replica.sana:
+                return
+            replica.sana = False
+            replica.ultimo_error = str(error)
+            replica.caida_desde = time.time()
+        print(f"Réplica {replica.nombre} fuera del reparto: {error}")
+
+    def stats(self):
+        return {
+            "estrategia": self.estrategia,
+            "lecturas_primaria": self.lecturas_primaria,
+            "failovers": self.failovers,
+            "replicas": [dict(r.stats(), nombre=r.nombre, ultimo_error=r.ultimo_error,
+                              caida_desde=r.caida_desde) for r in self.replicas],
+        }
+
+
+class ReadAfterWriteMiddleware:
+    """Middleware ASGI: con ``X-Read-After-Write`` la petición lee de la primaria."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        valor = dict(scope["headers"]).get(b"x-read-after-write", b"").strip().lower()
+        token = _leer_primaria.set(valor not in (b"", b"0", b"false", b"no"))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _leer_primaria.reset(token)
@@ -0,0 +1,178 @@
+"""Reportes agregados (/reportes/{reporte}) sobre oe, oedet y pagos.
+
+Las sumas y conteos se calculan en Firebird con ``GROUP BY`` por día y por
+las dimensiones pedidas (``por``): el cliente recibe una fila por grupo en
+vez de las ventas crudas.
+
+Un día cerrado (anterior a hoy) ya no cambia, así que su resultado se guarda
+en ``RollupCache`` por (reporte, dimensiones, día) y una consulta de rango
+solo va a la base por los días que faltan. El día en curso se recalcula,
+con una caché corta (``ttl_hoy``) para que varios tableros refrescando a la
+vez hagan una sola consulta. Un ajuste con fecha pasada se ve al vencer
+``ttl_cerrados`` o tras ``DELETE /cache/reportes``.
+
+Conviene indexar la fecha de las tablas de origen::
+
+    CREATE INDEX IDX_OE_FECHA ON OE (FECHA);
+    CREATE INDEX IDX_PAGOS_FECHA ON PAGOS (FECHA);
+"""
+import datetime
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from itertools import groupby
+
+from fastapi import HTTPException
+
+from metricas import count_rows, medir
+
+# Origen, columna de fecha, dimensiones admitidas en ``por`` y medidas de cada reporte
+REPORTES = {
+    "ventas": {
+        "tabla": "oe",
+        "origen": "oe",
+        "fecha": "FECHA",
+        "dimensiones": {"vendedor": "SALESMAN", "sucursal": "ID_SUCURSAL"},
+        "medidas": {"DOCUMENTOS": "COUNT(*)", "TOTAL": "SUM(TOTAL)", "SALESTAX": "SUM(SALESTAX)"},
+    },
+    # Las líneas toman la fecha y el vendedor de su encabezado
+    "unidades": {
+        "tabla": "oedet",
+        "origen": ("oedet d JOIN oe e ON e.ID_EMPRESA = d.ID_EMPRESA AND e.ID_SUCURSAL = d.ID_SUCURSAL "
+                   "AND e.NUMBER = d.NUMBER AND e.TIPO = d.TIPO"),
+        "fecha": "e.FECHA",
+        "dimensiones": {"vendedor": "e.SALESMAN", "sucursal": "d.ID_SUCURSAL"},
+        "medidas": {"LINEAS": "COUNT(*)", "QTYSHIP": "SUM(d.QTYSHIP)"},
+    },
+    "pagos": {
+        "tabla": "pagos",
+        "origen": "pagos",
+        "fecha": "FECHA",
+        "dimensiones": {"sucursal": "SUCURSAL", "medio_pago": "CONCEPTO"},
+        "medidas": {"PAGOS": "COUNT(*)", "VLR_PAGO": "SUM(VLR_PAGO)"},
+    },
+}
+
+
+def get_reporte(reporte):
+    if reporte not in REPORTES:
+        raise HTTPException(status_code=404, detail="Reporte no encontrado")
+    return REPORTES[reporte]
+
+
+def parse_por(reporte, por):
+    """Valida ``por`` (dimensiones separadas por comas) y lo devuelve como tupla."""
+    dimensiones = get_reporte(reporte)["dimensiones"]
+    pedidas = []
+    for dimension in (por or "").split(","):
+        dimension = dimension.strip().lower()
+        if not dimension:
+            continue
+        if dimension not in dimensiones:
+            raise HTTPException(status_code=400, detail=(
+                f"Dimensión no permitida para {reporte}: {dimension} ({', '.join(dimensiones)})"))
+        pedidas.append(dimension)
+    return tuple(dict.fromkeys(pedidas))
+
+
+@lru_cache(maxsize=64)
+def build_report(reporte, por):
+    """``(sql, columnas)`` del reporte agrupado por día y por las dimensiones ``por``.
+
+    El rango va como ``fecha >= ? AND fecha < ?`` para que Firebird use el
+    índice de la fecha aunque la columna sea TIMESTAMP.
+    """
+    info = REPORTES[reporte]
+    dia = f"CAST({info['fecha']} AS DATE)"
+    grupos = [dia] + [info["dimensiones"][d] for d in por]
+    columnas = ["FECHA"] + [d.upper() for d in por] + list(info["medidas"])
+    expresiones = grupos + list(info["medidas"].values())
+    seleccion = ", ".join(f"{expresion} AS {columna}" for expresion, columna in zip(expresiones, columnas))
+    sql = (f"SELECT {seleccion} FROM {info['origen']} "
+           f"WHERE {info['fecha']} >= ? AND {info['fecha']} < ? "
+           f"GROUP BY {', '.join(grupos)} ORDER BY {', '.join(grupos)}")
+    return sql, columnas
+
+
+def report_rows(conn, sql, desde, hasta, tabla):
+    """Filas agregadas de ``desde`` a ``hasta`` (ambos incluidos)."""
+    params = (desde, hasta + datetime.timedelta(days=1))
+    cursor, sentencia = conn.statement(sql)
+    with medir("execute", sql, params, tabla):
+        cursor.execute(sentencia, params)
+    with medir("fetch"):
+        filas = cursor.fetchall()
+    count_rows(len(filas), tabla)
+    return filas
+
+
+def day_of(valor):
+    # El driver puede devolver date o datetime según el dialecto
+    return valor.date() if isinstance(valor, datetime.datetime) else valor
+
+
+def tramos(dias):
+    """Agrupa días ordenados en rangos consecutivos ``[(desde, hasta), ...]``."""
+    rangos = []
+    for _, grupo in groupby(enumerate(dias), key=lambda par: par[1].toordinal() - par[0]):
+        grupo = [dia for _, dia in grupo]
+        rangos.append((grupo[0], grupo[-1]))
+    return rangos
+
+
+class RollupCache:
+    """Filas de los días cerrados por (reporte, dimensiones, día), con desalojo LRU.
+
+    Un día sin ventas también se guarda (lista vacía) para no volver a
+    consultarlo. Se usa solo desde el event loop.
+    """
+
+    def __init__(self, ttl=21600, max_entries=20000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._dias = OrderedDict()  # clave -> (expira, filas)
+        self._generacion = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, clave):
+        entrada = self._dias.get(clave)
+        if entrada is None or entrada[0] < time.monotonic():
+            self._dias.pop(clave, None)
+            self.misses += 1
+            return None
+        self._dias.move_to_end(clave)
+        self.hits += 1
+        return entrada[1]
+
+    def generation(self):
+        return self._generacion
+
+    def put(self, clave, filas, generacion):
+        if generacion != self._generacion:
+            # Se invalidó mientras se consultaba
+            return
+        self._dias[clave] = (time.monotonic() + self.ttl, filas)
+        self._dias.move_to_end(clave)
+        while len(self._dias) > self.max_entries:
+            self._dias.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self):
+        self._generacion += 1
+        self._dias.clear()
+        self.invalidations += 1
+
+    def stats(self):
+        consultas = self.hits + self.misses
+        return {
+            "entries": len(self._dias),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / consultas if consultas else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,160 @@
+from decimal import Decimal
+
+from fastapi import HTTPException
+
+# Tablas expuestas por /consulta/{tabla}: columnas permitidas (en el orden de
+# la respuesta) y clave primaria usada para paginar
+TABLAS = {
+    "fatipdoc": {
+        "columnas": ["ID_USUARIO", "CLAVE", "PREFIJO", "TIPODEV"],
+        "clave": ["CLAVE"],
+    },
+    "vendedor": {
+        "columnas": ["IDVEND", "NOMBRE"],
+        "clave": ["IDVEND"],
+    },
+    "actividad_eco_enc": {
+        "columnas": ["CODACT", "DESCRIPCION", "COD_INTERNACIONAL"],
+        "clave": ["CODACT"],
+    },
+    "obligaciones_rut": {
+        "columnas": ["CODIGO", "DESCRIPCION"],
+        "clave": ["CODIGO"],
+    },
+    "tributos": {
+        "columnas": ["CODIGO", "DESCRIPCION"],
+        "clave": ["CODIGO"],
+    },
+    "tributaria_tipocontribuyente": {
+        "columnas": ["CODIGO", "DESCRIPCION"],
+        "clave": ["CODIGO"],
+    },
+    "tributaria_tipodocumento": {
+        "columnas": ["TDOC", "DESCRIPCION"],
+        "clave": ["TDOC"],
+    },
+    "paises": {
+        "columnas": ["ID_PAIS", "PAIS"],
+        "clave": ["ID_PAIS"],
+    },
+    "departamentos_elect": {
+        "columnas": ["ID_DEPTO", "DEPARTAMENTO"],
+        "clave": ["ID_DEPTO"],
+    },
+    "ciudades_elect": {
+        "columnas": ["ID_CIUDAD", "CIUDAD"],
+        "clave": ["ID_CIUDAD"],
+    },
+    "cust": {
+        "columnas": [
+            "ID_N", "COMPANY", "ADDR1", "CITY", "PAIS", "PHONE1", "GRAVABLE", "CLIENTE", "TIPOEMP",
+            "IDVEND", "CV", "FECHA_CREACION", "EMAIL", "DEPARTAMENTO", "INACTIVO", "REGIMEN", "RESIDENTE"
+        ],
+        "clave": ["ID_N"],
+    },
+    "shipto": {
+        "columnas": [
+            "ID_N", "SUCCLIENTE", "COMPANY", "ADDR1", "PHONE1", "ID_VEND", "PAIS", "EMAIL", "DEPARTAMENTO",
+            "PRIMER_APELLIDO", "SEGUNDO_APELLIDO", "PRIMER_NOMBRE", "SEGUNDO_NOMBRE", "FECHA_NACIMIENTO",
+            "COD_DPTO", "COD_MUNICIPIO", "CITY", "ESTADO", "EMAIL_FAC_ELEC"
+        ],
+        "clave": ["ID_N", "SUCCLIENTE"],
+    },
+    # Add the rest of the tables here as in your original code...
+    # "busqueda" (opcional) lista columnas indexadas para /consulta/{tabla}/lote;
+    # por defecto se usa la primera columna de la clave
+}
+
+
+def get_tabla(tabla):
+    if tabla not in TABLAS:
+        raise HTTPException(status_code=404, detail="Tabla no encontrada")
+    return TABLAS[tabla]
+
+
+def check_column(tabla, campo, permitidas=None):
+    """Normaliza ``campo`` y verifica que esté entre las columnas permitidas."""
+    if permitidas is None:
+        permitidas = get_tabla(tabla)["columnas"]
+    campo = campo.strip().upper()
+    if campo not in permitidas:
+        raise HTTPException(status_code=400, detail=f"Campo no permitido para {tabla}: {campo}")
+    return campo
+
+
+def parse_fields(tabla, fields):
+    """Valida ``fields`` (lista separada por comas) contra las columnas de la tabla."""
+    columnas = get_tabla(tabla)["columnas"]
+    if not fields:
+        return list(columnas)
+    pedidas = [check_column(tabla, f, columnas) for f in fields.split(",") if f.strip()]
+    # Sin duplicados, respetando el orden pedido
+    return list(dict.fromkeys(pedidas))
+
+
+def lookup_columns(tabla):
+    """Columnas admitidas en la búsqueda por lote: las que tienen índice."""
+    info = get_tabla(tabla)
+    return info.get("busqueda", info["clave"][:1])
+
+
+def key_value(valor, tipo):
+    """``valor`` del JSON convertido al tipo de la columna (``tipo`` de ``cursor.description``).
+
+    Lanza ValueError o ArithmeticError si no se puede convertir.
+    """
+    if valor is None or isinstance(valor, (bool, dict, list)):
+        raise ValueError(f"Valor no admitido: {valor!r}")
+    if tipo in (int, float, Decimal):
+        return tipo(str(valor).strip())
+    if tipo is str:
+        # Firebird compara los textos sin los espacios finales
+        return str(valor).rstrip()
+    return valor
+
+
+def build_select(tabla, columnas, filters=None, params=None, after=None, limit=None):
+    """Arma el SELECT de una tabla del catálogo.
+
+    Con ``limit`` se pagina por clave (keyset): ``FIRST ?`` más
+    ``WHERE clave > ?`` y ``ORDER BY clave``, de modo que cualquier página
+    cuesta lo mismo que la primera. Devuelve ``(query, params)``.
+    """
+    clave = get_tabla(tabla)["clave"]
+    filters = list(filters or [])
+    params = list(params or [])
+    first = ""
+
+    if after:
+        if len(after) != len(clave):
+            raise HTTPException(status_code=400,
+                                detail=f"'after' requiere {len(clave)} valor(es): {', '.join(clave)}")
+        if len(clave) > 1:
+            # Predicado redundante para que Firebird use el índice de la clave
+            filters.append(f"{clave[0]} >= ?")
+            params.append(after[0])
+        # (k1, k2) > (a1, a2)  =>  k1 > a1 OR (k1 = a1 AND k2 > a2)
+        opciones = []
+        for i, columna in enumerate(clave):
+            iguales = [f"{c} = ?" for c in clave[:i]]
+            opciones.append("(" + " AND ".join(iguales + [f"{columna} > ?"]) + ")")
+            params.extend(after[:i + 1])
+        filters.append("(" + " OR ".join(opciones) + ")")
+
+    if limit is not None:
+        first = "FIRST ? "
+        params.insert(0, limit)
+
+    query = f"SELECT {first}{', '.join(columnas)} FROM {tabla}"
+    if filters:
+        query += " WHERE " + " AND ".join(filters)
+    if limit is not None or after:
+        query += " ORDER BY " + ", ".join(clave)
+    return query, params
+
+
+def build_lookup(tabla, columnas, campo, cantidad):
+    """SELECT con ``campo IN (?, ...)`` para ``cantidad`` valores."""
+    marcadores = ", ".join(["?"] * cantidad)
+    query, _ = build_select(tabla, columnas, [f"{campo} IN ({marcadores})"])
+    return query
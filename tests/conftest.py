@@ -0,0 +1,11 @@
+"""Las pruebas corren contra ``bench/fdb_stub.py`` en lugar de fdb."""
+import os
+import sys
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.join(RAIZ, "bench"))
+
+import fdb_stub  # noqa: E402
+
+sys.modules["fdb"] = fdb_stub
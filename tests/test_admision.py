@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+import admision
+from admision import AdmissionController, ColaLlena, Cupos, EsperaVencida, classify
+
+
+def test_cupos_fifo_al_devolver():
+    async def prueba():
+        cupos = Cupos(1)
+        await cupos.tomar(1)
+        orden = []
+
+        async def pedido(nombre):
+            await cupos.tomar(1)
+            orden.append(nombre)
+
+        tareas = [asyncio.ensure_future(pedido(n)) for n in ("a", "b", "c")]
+        await asyncio.sleep(0)
+        assert cupos.stats()["en_espera"] == 3
+        for _ in range(3):
+            cupos.devolver()
+            await asyncio.sleep(0)
+        await asyncio.gather(*tareas)
+        assert orden == ["a", "b", "c"]
+        assert cupos.stats()["en_uso"] == 1
+
+    asyncio.run(prueba())
+
+
+def test_cupos_cola_llena_y_espera_vencida():
+    async def prueba():
+        cupos = Cupos(1, max_cola=1)
+        await cupos.tomar(1)
+        esperando = asyncio.ensure_future(cupos.tomar(0.05))
+        await asyncio.sleep(0)
+        with pytest.raises(ColaLlena):
+            await cupos.tomar(1)
+        with pytest.raises(EsperaVencida):
+            await esperando
+        stats = cupos.stats()
+        assert (stats["rechazados"], stats["vencidos"], stats["en_espera"]) == (1, 1, 0)
+
+    asyncio.run(prueba())
+
+
+def test_cupos_reserva_solo_para_prioritarios():
+    async def prueba():
+        cupos = Cupos(2, reservados=1)
+        await cupos.tomar(1)
+        with pytest.raises(EsperaVencida):
+            await cupos.tomar(0.01)
+        await cupos.tomar(0.01, prioritario=True)
+        assert cupos.libres == 0
+
+    asyncio.run(prueba())
+
+
+def test_cupos_cancelado_con_el_cupo_lo_pasa_al_siguiente():
+    async def prueba():
+        cupos = Cupos(1)
+        await cupos.tomar(1)
+        primero = asyncio.ensure_future(cupos.tomar(1))
+        segundo = asyncio.ensure_future(cupos.tomar(1))
+        await asyncio.sleep(0)
+        # El cupo llega al primero en el mismo paso en que se cancela
+        cupos.devolver()
+        primero.cancel()
+        await asyncio.sleep(0)
+        await asyncio.wait_for(segundo, 1)
+        assert primero.cancelled()
+        assert cupos.stats()["en_uso"] == 1
+
+    asyncio.run(prueba())
+
+
+def test_cupos_reserva_invalida():
+    with pytest.raises(ValueError):
+        Cupos(2, reservados=2)
+
+
+def test_classify():
+    assert classify("POST", "/insertar/cust", "") == admision.ESCRITURA
+    assert classify("GET", "/consulta/cust", "limit=10") == admision.LECTURA
+    assert classify("GET", "/consulta/cust", "stream=true") == admision.LECTURA_PESADA
+    assert classify("GET", "/consulta/cust", "") == admision.LECTURA_PESADA
+    assert classify("GET", "/consulta/paises", "") == admision.LECTURA
+    assert classify("POST", "/consulta/cust/lote", "") == admision.LECTURA_PESADA
+    assert classify("GET", "/metrics", "") is None
+
+
+def test_controller_cupos_por_loop():
+    clases = {"lectura": {"concurrencia": 2, "cola": 5, "espera": 1, "timeout": 5}}
+    controlador = AdmissionController(clases)
+
+    async def tomar():
+        cupos = controlador.cupos("lectura")
+        await cupos.tomar(1)
+        return cupos
+
+    primero = asyncio.run(tomar())
+    segundo = asyncio.run(tomar())
+    # Un loop nuevo no hereda los cupos tomados en el anterior
+    assert primero is not segundo
+    assert controlador.stats()["lectura"]["en_uso"] == 1
+    assert controlador.gauges()["lectura_total"] == 2
+
+
+def test_middleware_rechaza_con_retry_after():
+    clases = {admision.ESCRITURA: {"concurrencia": 1, "cola": 0, "espera": 1, "timeout": 5}}
+    liberar = []
+    vistas = []
+
+    async def app(scope, receive, send):
+        vistas.append(admision.clase())
+        await liberar[0].wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+    async def pedir(middleware):
+        mensajes = []
+
+        async def send(mensaje):
+            mensajes.append(mensaje)
+
+        scope = {"type": "http", "method": "POST", "path": "/insertar/cust", "query_string": b""}
+        await middleware(scope, None, send)
+        return mensajes[0]
+
+    async def prueba():
+        # El Event se crea dentro del loop (en Python 3.8 queda atado al loop actual)
+        liberar.append(asyncio.Event())
+        middleware = admision.AdmissionMiddleware(app, AdmissionController(clases, retry_after=3))
+        primero = asyncio.ensure_future(pedir(middleware))
+        await asyncio.sleep(0)
+        rechazo = await pedir(middleware)
+        liberar[0].set()
+        return (await primero)["status"], rechazo
+
+    status, rechazo = asyncio.run(prueba())
+    assert status == 200
+    assert vistas == [admision.ESCRITURA]
+    assert rechazo["status"] == 429
+    assert (b"retry-after", b"3") in rechazo["headers"]
@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from cache import QueryCache
+
+
+class Cargador:
+    """Loader que cuenta las llamadas y espera a que la prueba lo suelte."""
+
+    def __init__(self, filas):
+        self.filas = filas
+        self.llamadas = 0
+        self.soltar = None
+
+    async def __call__(self):
+        self.llamadas += 1
+        if self.soltar is not None:
+            await self.soltar.wait()
+        return list(self.filas)
+
+
+def test_single_flight():
+    async def prueba():
+        cache = QueryCache({"paises": 60})
+        cargar = Cargador([(1, "Colombia")])
+        cargar.soltar = asyncio.Event()
+        pedidos = [asyncio.ensure_future(cache.get_or_load("paises", "q", (), cargar)) for _ in range(5)]
+        await asyncio.sleep(0)
+        cargar.soltar.set()
+        resultados = await asyncio.gather(*pedidos)
+        assert cargar.llamadas == 1
+        assert all(r == [(1, "Colombia")] for r in resultados)
+        assert (cache.misses, cache.coalesced) == (5, 4)
+        assert await cache.get_or_load("paises", "q", (), cargar) == [(1, "Colombia")]
+        assert (cache.hits, cargar.llamadas) == (1, 1)
+
+    asyncio.run(prueba())
+
+
+def test_tabla_sin_ttl_no_se_cachea():
+    async def prueba():
+        cache = QueryCache({"paises": 60})
+        cargar = Cargador([(1,)])
+        await cache.get_or_load("cust", "q", (), cargar)
+        await cache.get_or_load("cust", "q", (), cargar)
+        assert cargar.llamadas == 2
+        assert cache.stats()["entries"] == 0
+
+    asyncio.run(prueba())
+
+
+def test_invalidate_descarta_la_carga_en_curso():
+    async def prueba():
+        cache = QueryCache({"paises": 60})
+        vieja = Cargador([("antes",)])
+        vieja.soltar = asyncio.Event()
+        primero = asyncio.ensure_future(cache.get_or_load("paises", "q", (), vieja))
+        await asyncio.sleep(0)
+        # Una escritura mientras se carga: la lectura previa no debe quedar guardada
+        cache.invalidate("paises")
+        nueva = Cargador([("despues",)])
+        assert await cache.get_or_load("paises", "q", (), nueva) == [("despues",)]
+        vieja.soltar.set()
+        assert await primero == [("antes",)]
+        assert await cache.get_or_load("paises", "q", (), vieja) == [("despues",)]
+        assert nueva.llamadas == 1
+
+    asyncio.run(prueba())
+
+
+def test_error_no_queda_en_cache():
+    async def prueba():
+        cache = QueryCache({"paises": 60})
+
+        async def falla():
+            raise RuntimeError("sin base")
+
+        with pytest.raises(RuntimeError):
+            await cache.get_or_load("paises", "q", (), falla)
+        cargar = Cargador([(1,)])
+        assert await cache.get_or_load("paises", "q", (), cargar) == [(1,)]
+
+    asyncio.run(prueba())
+
+
+def test_desalojo_lru_por_entradas_y_filas():
+    async def prueba():
+        cache = QueryCache({"paises": 60}, max_entries=2, max_rows=5)
+        for clave in ("a", "b"):
+            await cache.get_or_load("paises", clave, (), Cargador([(1,)]))
+        # "a" pasa a ser la más reciente; entra "c" y sale "b"
+        await cache.get_or_load("paises", "a", (), Cargador([]))
+        await cache.get_or_load("paises", "c", (), Cargador([(1,)]))
+        assert [clave[1] for clave in cache._entradas] == ["a", "c"]
+        await cache.get_or_load("paises", "d", (), Cargador([(1,)] * 4))
+        assert [clave[1] for clave in cache._entradas] == ["c", "d"]
+        assert (cache.stats()["rows"], cache.evictions) == (5, 2)
+        # Un resultado mayor que max_rows no se guarda
+        await cache.get_or_load("paises", "e", (), Cargador([(1,)] * 6))
+        assert ("paises", "e", ()) not in cache._entradas
+
+    asyncio.run(prueba())
@@ -0,0 +1,86 @@
+import asyncio
+
+import fdb
+import httpx
+import pytest
+
+import main
+from cambios import read_changes, table_version, trigger_name
+from pool import PooledConnection
+
+
+@pytest.fixture
+def conn():
+    # Conexión propia: las sentencias preparadas del pool ocultarían SIN_CAMBIOS
+    conexion = PooledConnection(fdb.connect())
+    yield conexion
+    conexion.close()
+
+
+def test_version_es_el_ultimo_cambio(conn):
+    assert table_version(conn, "cust", 60) == fdb.FILAS["api_cambios"]
+
+
+def test_sin_version_si_el_cambio_es_reciente(conn):
+    # El cambio del stub tiene una hora: con un margen mayor todavía es reciente
+    assert table_version(conn, "cust", 2 * 3600) is None
+
+
+def test_log_vacio_depende_del_trigger(conn, monkeypatch):
+    monkeypatch.setitem(fdb.FILAS, "api_cambios", 0)
+    assert table_version(conn, "cust", 60) == 0
+    monkeypatch.setattr(fdb, "SIN_TRIGGER", {trigger_name("cust")})
+    # Sin trigger el log no se mueve al escribir: no hay versión confiable
+    assert table_version(conn, "cust", 60) is None
+
+
+def test_sin_log_no_queda_marcado(conn, monkeypatch):
+    monkeypatch.setattr(fdb, "SIN_CAMBIOS", True)
+    assert table_version(conn, "cust", 60) is None
+    monkeypatch.setattr(fdb, "SIN_CAMBIOS", False)
+    # Instalado el log, la consulta siguiente ya tiene versión
+    assert table_version(conn, "cust", 60) == fdb.FILAS["api_cambios"]
+
+
+def test_otros_errores_se_propagan(conn, monkeypatch):
+    def falla(self, sql, cursor):
+        raise fdb.DatabaseError("Dynamic SQL Error\n-SQL error code = -104", -104, 335544569)
+
+    monkeypatch.setattr(fdb.PreparedStatement, "__init__", falla)
+    with pytest.raises(fdb.DatabaseError):
+        table_version(conn, "tributos", 60)
+
+
+def test_feed_avanza_solo_hasta_el_margen(conn):
+    # El stub registra un cambio por segundo hasta ahora: los últimos 60 son recientes
+    total = fdb.FILAS["api_cambios"]
+    viejos = read_changes(conn, "cust", ["ID_N", "EMAIL"], 100, 10, 60)
+    assert (viejos["siguiente"], viejos["mas"]) == (110, True)
+    assert all(c["op"] in ("U", "D") for c in viejos["cambios"])
+
+    # Página llena pero toda reciente: hay más, pero la marca no se mueve
+    recientes = read_changes(conn, "cust", ["ID_N", "EMAIL"], total - 20, 10, 60)
+    assert (recientes["siguiente"], recientes["mas"]) == (total - 20, True)
+
+    # Página incompleta: la terminal está al día
+    ultima = read_changes(conn, "cust", ["ID_N", "EMAIL"], total - 5, 10, 60)
+    assert (ultima["siguiente"], ultima["mas"], len(ultima["cambios"])) == (total - 5, False, 5)
+
+
+def test_consulta_condicional():
+    # Sin el ciclo de vida de la app: el apagado cerraría el pool compartido
+    async def prueba():
+        transporte = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://api") as cliente:
+            url = "/consulta/cust?limit=5&format=json"
+            primera = await cliente.get(url)
+            etag = primera.headers["etag"]
+            igual = await cliente.get(url, headers={"if-none-match": etag})
+            otro_formato = await cliente.get("/consulta/cust?limit=5&format=csv",
+                                             headers={"if-none-match": etag})
+            return primera.status_code, igual, otro_formato.status_code
+
+    status, igual, otro_formato = asyncio.run(prueba())
+    assert status == 200
+    assert (igual.status_code, igual.content) == (304, b"")
+    assert otro_formato == 200
@@ -0,0 +1,60 @@
+import asyncio
+import gzip
+import zlib
+
+from compresion import CompressionMiddleware, choose_encoding
+
+
+def test_choose_encoding():
+    assert choose_encoding("gzip;q=0.5, zstd", ("zstd", "gzip")) == "zstd"
+    assert choose_encoding("gzip, deflate", ("zstd", "gzip")) == "gzip"
+    assert choose_encoding("*;q=0.1", ("gzip",)) == "gzip"
+    assert choose_encoding("gzip;q=0", ("gzip",)) is None
+    assert choose_encoding("identity", ("gzip",)) is None
+
+
+def _responder(status, bloques, headers=()):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": status, "headers": list(headers)})
+        for i, bloque in enumerate(bloques):
+            await send({"type": "http.response.body", "body": bloque, "more_body": i < len(bloques) - 1})
+    return app
+
+
+def _pedir(app, accept_encoding="gzip"):
+    mensajes = []
+
+    async def send(mensaje):
+        mensajes.append(mensaje)
+
+    scope = {"type": "http", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    asyncio.run(CompressionMiddleware(app, min_bytes=100)(scope, None, send))
+    inicio = mensajes[0]
+    return dict(inicio["headers"]), inicio["status"], [m["body"] for m in mensajes[1:]]
+
+
+def test_respuesta_completa_comprimida():
+    cuerpo = b"fila,1\n" * 200
+    headers, status, cuerpos = _pedir(_responder(200, [cuerpo], [(b"content-length", b"1400")]))
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"content-length"] == str(len(cuerpos[0])).encode()
+    assert b"Accept-Encoding" in headers[b"vary"]
+    assert gzip.decompress(b"".join(cuerpos)) == cuerpo
+
+
+def test_stream_cada_bloque_se_puede_leer_al_llegar():
+    bloques = [b"a" * 50, b"b" * 50, b"c" * 50]
+    _, _, cuerpos = _pedir(_responder(200, bloques))
+    descompresor = zlib.decompressobj(31)
+    # Cada bloque sale con flush: se descomprime sin esperar al siguiente
+    assert [descompresor.decompress(c) for c in cuerpos[:2]] == bloques[:2]
+    assert descompresor.decompress(cuerpos[2]) + descompresor.flush() == bloques[2]
+
+
+def test_sin_comprimir():
+    chico = _pedir(_responder(200, [b"ok"]))
+    assert b"content-encoding" not in chico[0] and chico[2] == [b"ok"]
+    no_modificado = _pedir(_responder(304, [b""]))
+    assert b"content-encoding" not in no_modificado[0]
+    sin_gzip = _pedir(_responder(200, [b"x" * 500]), accept_encoding="identity")
+    assert sin_gzip[2] == [b"x" * 500]
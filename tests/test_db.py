@@ -0,0 +1,98 @@
+import asyncio
+import time
+
+import fdb
+import pytest
+from fastapi import HTTPException
+
+import db
+from db import StreamedQuery
+
+
+def _libre():
+    async def esperar():
+        # La conexión vuelve al pool desde el executor, después del último bloque
+        for _ in range(200):
+            if db.pool.stats()["in_use"] == 0:
+                return True
+            await asyncio.sleep(0.01)
+        return False
+    return esperar()
+
+
+def test_stream_por_bloques_y_devuelve_la_conexion():
+    async def prueba():
+        consulta = await StreamedQuery("SELECT FIRST ? ID_N, COMPANY FROM cust", (1200,), chunk_size=500).open()
+        assert consulta.columnas == ["ID_N", "COMPANY"]
+        tamanos = [len(filas) async for filas in consulta.chunks()]
+        return tamanos, await _libre()
+
+    tamanos, libre = asyncio.run(prueba())
+    assert tamanos == [500, 500, 200]
+    assert libre
+
+
+def test_stream_cortado_devuelve_la_conexion():
+    async def prueba():
+        consulta = await StreamedQuery("SELECT ID_N FROM cust", chunk_size=100).open()
+        bloques = consulta.chunks()
+        primero = await bloques.__anext__()
+        # El cliente se va después del primer bloque
+        await bloques.aclose()
+        return len(primero), await _libre()
+
+    assert asyncio.run(prueba()) == (100, True)
+
+
+def test_stream_lee_la_version_en_la_misma_conexion():
+    usadas = []
+
+    def version(conn):
+        usadas.append(conn)
+        return 42
+
+    async def prueba():
+        consulta = await StreamedQuery("SELECT FIRST ? ID_N FROM cust", (3,), version=version).open()
+        filas = [fila async for bloque in consulta.chunks() for fila in bloque]
+        return consulta.version, filas
+
+    assert asyncio.run(prueba()) == (42, [(0,), (1,), (2,)])
+    assert len(usadas) == 1
+
+
+def test_run_db_timeout_cancela_la_sentencia(monkeypatch):
+    cancelados = []
+    original = fdb._api.client_library.fb_cancel_operation
+    monkeypatch.setitem(fdb.LATENCIA, "execute", 0.5)
+    monkeypatch.setattr(fdb._api.client_library, "fb_cancel_operation",
+                        lambda *args: (cancelados.append(args[2]), original(*args))[1])
+
+    async def prueba():
+        with pytest.raises(HTTPException) as error:
+            await db.run_db(db.fetch_all, "SELECT ID_N FROM cust", timeout=0.05)
+        assert error.value.status_code == 504
+        return await _libre()
+
+    assert asyncio.run(prueba())
+    assert cancelados == [fdb.ibase.fb_cancel_raise]
+
+
+def test_cancelacion_lenta_no_frena_el_event_loop(monkeypatch):
+    original = fdb._api.client_library.fb_cancel_operation
+
+    def lenta(*args):
+        time.sleep(0.5)
+        return original(*args)
+
+    monkeypatch.setitem(fdb.LATENCIA, "execute", 0.5)
+    monkeypatch.setattr(fdb._api.client_library, "fb_cancel_operation", lenta)
+
+    async def prueba():
+        inicio = time.perf_counter()
+        with pytest.raises(HTTPException):
+            await db.run_db(db.fetch_all, "SELECT ID_N FROM cust", timeout=0.05)
+        demora = time.perf_counter() - inicio
+        await _libre()
+        return demora
+
+    assert asyncio.run(prueba()) < 0.3
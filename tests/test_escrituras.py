@@ -0,0 +1,107 @@
+import fdb
+import pytest
+
+import db
+from escrituras import INSERTS, insert_batch, insert_document, insert_group, row_error, upsert_batch
+
+
+@pytest.fixture
+def conn(monkeypatch):
+    monkeypatch.setattr(fdb, "RECHAZADOS", {"RECHAZADA"})
+    monkeypatch.setattr(fdb, "CORTES", {"CORTE"})
+    conexion = db.pool.acquire()
+    conexion.rollbacks = []
+    original = fdb.Connection.rollback
+
+    def rollback(self, retaining=False, savepoint=None):
+        conexion.rollbacks.append(savepoint)
+        return original(self, retaining, savepoint)
+
+    monkeypatch.setattr(fdb.Connection, "rollback", rollback)
+    yield conexion
+    db.pool.release(conexion)
+
+
+def _fila(tabla, i, **cambios):
+    datos = {campo: str(i) for campo in INSERTS[tabla]["campos"]}
+    datos.update(cambios)
+    return datos
+
+
+def test_row_error():
+    assert row_error(ValueError("largo"))
+    assert row_error(TypeError("tipo"))
+    assert row_error(fdb.DatabaseError("violation of FOREIGN KEY constraint", -530, 335544466))
+    assert not row_error(fdb.OperationalError("Error writing data to the connection", -902, 335544727))
+    assert not row_error(fdb.DatabaseError("operation was cancelled", -901, 335544794))
+    assert not row_error(RuntimeError("otro"))
+
+
+def test_lote_valido_un_solo_commit(conn):
+    assert insert_batch(conn, "oedet", [_fila("oedet", i) for i in range(3)]) == (3, [])
+    assert conn.rollbacks == []
+
+
+def test_fila_rechazada_se_informa_por_indice(conn):
+    filas = [_fila("cust", 0), _fila("cust", 1, EMAIL="RECHAZADA"), _fila("cust", 2)]
+    insertadas, errores = insert_batch(conn, "cust", filas)
+    assert insertadas == 0
+    assert [e["fila"] for e in errores] == [1]
+    assert "FOREIGN KEY" in errores[0]["error"]
+    # Falla el executemany: se deshace el lote, se repite con un savepoint por
+    # fila y sin parcial se deshace todo
+    assert conn.rollbacks == ["LOTE", "FILA_LOTE", None]
+
+
+def test_parcial_confirma_las_filas_validas(conn):
+    filas = [_fila("cust", 0, EMAIL="RECHAZADA"), _fila("cust", 1), _fila("cust", 2)]
+    insertadas, errores = insert_batch(conn, "cust", filas, parcial=True)
+    assert (insertadas, [e["fila"] for e in errores]) == (2, [0])
+    assert None not in conn.rollbacks
+
+
+def test_error_del_servidor_corta_el_lote(conn):
+    filas = [_fila("cust", 0), _fila("cust", 1, EMAIL="CORTE")]
+    with pytest.raises(fdb.OperationalError):
+        insert_batch(conn, "cust", filas, parcial=True)
+
+
+def test_insert_group_indices_entre_tablas(conn):
+    registros = [
+        ("cust", _fila("cust", 0)),
+        ("cust", {"ID_N": "1"}),
+        ("oedet", _fila("oedet", 2, ITEM="RECHAZADA")),
+        ("cust", _fila("cust", 3)),
+        ("desconocida", {}),
+    ]
+    errores = insert_group(conn, registros)
+    assert sorted(errores) == [1, 2, 4]
+    assert errores[1].startswith("Falta el campo requerido")
+    assert "FOREIGN KEY" in errores[2]
+    assert errores[4] == "Tabla no admitida: desconocida"
+
+
+def test_documento_se_deshace_completo(conn):
+    documento = {
+        "oe": _fila("oe", 1),
+        "oedet": [_fila("oedet", 1), _fila("oedet", 2, ITEM="RECHAZADA")],
+        "pagos": [],
+        "itemact": [],
+    }
+    errores = insert_document(conn, documento)
+    assert [(e["seccion"], e["fila"]) for e in errores] == [("oedet", 1)]
+    assert conn.rollbacks[-1] is None
+
+
+def test_upsert_estados_por_fila(conn):
+    filas = [
+        {"ID_N": 1, "EMAIL": "a@x.com"},
+        {"ID_N": 99999999, "EMAIL": "b@x.com"},
+        {"ID_N": 2, "EMAIL": "RECHAZADA"},
+    ]
+    resultados, errores = upsert_batch(conn, "cust", filas, insertar=False, parcial=True)
+    assert resultados == ["ok", "no_encontrada", "error"]
+    assert [e["fila"] for e in errores] == [2]
+
+    resultados, errores = upsert_batch(conn, "cust", filas, insertar=False)
+    assert resultados == ["sin_aplicar", "sin_aplicar", "error"]
@@ -0,0 +1,113 @@
+import datetime
+import struct
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+
+from formatos import (ColumnarEncoder, CsvEncoder, JsonColumnsEncoder, NdjsonEncoder, TextEncoder, etag_matches,
+                      json_bytes, make_etag, negotiate)
+
+
+def _leer_columnar(datos):
+    """Decodifica el formato columnar (ver formatos.py) en ``(columnas, filas)``."""
+    assert datos[:8] == b"API1COL1"
+    pos = 8
+    (cantidad,) = struct.unpack_from("<H", datos, pos)
+    pos += 2
+    columnas = []
+    for _ in range(cantidad):
+        (largo,) = struct.unpack_from("<H", datos, pos)
+        columnas.append(datos[pos + 2:pos + 2 + largo].decode("utf-8"))
+        pos += 2 + largo
+    filas = []
+    while True:
+        (n,) = struct.unpack_from("<I", datos, pos)
+        pos += 4
+        if n == 0:
+            break
+        valores = []
+        for _ in columnas:
+            tipo = datos[pos:pos + 1]
+            nulos = datos[pos + 1:pos + 1 + (n + 7) // 8]
+            pos += 1 + len(nulos)
+            if tipo in (b"q", b"d"):
+                columna = list(struct.unpack_from(f"<{n}{tipo.decode()}", datos, pos))
+                pos += 8 * n
+            elif tipo == b"D":
+                (escala,) = struct.unpack_from("<b", datos, pos)
+                enteros = struct.unpack_from(f"<{n}q", datos, pos + 1)
+                columna = [Decimal(v).scaleb(-escala) for v in enteros]
+                pos += 1 + 8 * n
+            else:
+                largos = struct.unpack_from(f"<{n}I", datos, pos)
+                pos += 4 * n
+                columna = []
+                for largo in largos:
+                    dato = datos[pos:pos + largo]
+                    columna.append(dato if tipo == b"b" else dato.decode("utf-8"))
+                    pos += largo
+            valores.append([None if nulos[i >> 3] & (1 << (i & 7)) else v for i, v in enumerate(columna)])
+        filas.extend(zip(*valores))
+    return columnas, filas
+
+
+def _codificar(columnas, bloques):
+    encoder = ColumnarEncoder()
+    return encoder.start(columnas) + b"".join(encoder.rows(b) for b in bloques) + encoder.end()
+
+
+def test_columnar_round_trip():
+    columnas = ["ID", "TOTAL", "PESO", "NOMBRE", "FECHA", "FOTO"]
+    filas = [
+        (1, Decimal("1520.50"), 2.5, "café", datetime.date(2024, 1, 31), b"\x00\x01"),
+        (2, Decimal("3"), None, None, None, b""),
+        (None, None, 0.125, "", datetime.date(2024, 2, 1), None),
+    ]
+    leidas_columnas, leidas = _leer_columnar(_codificar(columnas, [filas[:2], filas[2:]]))
+    assert leidas_columnas == columnas
+    assert [fila[:4] + fila[5:] for fila in leidas] == [fila[:4] + fila[5:] for fila in filas]
+    assert [fila[4] for fila in leidas] == ["2024-01-31", None, "2024-02-01"]
+
+
+def test_columnar_mezcla_int_float_es_double():
+    datos = _codificar(["X"], [[(1,), (2.5,), (None,)]])
+    assert datos[8 + 2 + 2 + 1 + 4:][:1] == b"d"
+    assert _leer_columnar(datos)[1] == [(1.0,), (2.5,), (None,)]
+
+
+def test_negotiate_por_format_y_accept():
+    assert isinstance(negotiate("csv"), CsvEncoder)
+    with pytest.raises(HTTPException) as error:
+        negotiate("xml")
+    assert error.value.status_code == 406
+    assert isinstance(negotiate(accept="application/x-ndjson"), NdjsonEncoder)
+    assert isinstance(negotiate(accept="text/csv;q=0.5, application/json"), JsonColumnsEncoder)
+    # text/plain empatado con el mejor: se mantiene el formato de siempre
+    assert isinstance(negotiate(accept="application/json, text/plain, */*"), TextEncoder)
+    assert isinstance(negotiate(accept="text/html, */*"), TextEncoder)
+    assert isinstance(negotiate(accept="application/json;q=0"), TextEncoder)
+    assert isinstance(negotiate(), TextEncoder)
+
+
+def test_json_decimal_como_texto():
+    assert json_bytes({"total": Decimal("1520.50")}) == b'{"total":"1520.50"}'
+
+
+def test_make_etag():
+    assert make_etag(None, "cust", "json") is None
+    etag = make_etag(7, "cust", "json")
+    assert etag.startswith('W/"7-')
+    assert etag != make_etag(7, "cust", "csv")
+    assert etag != make_etag(8, "cust", "json")
+
+
+def test_etag_matches():
+    etag = 'W/"7-abc"'
+    assert etag_matches('W/"7-abc"', etag)
+    assert etag_matches('"7-abc"', etag)
+    assert etag_matches('"otro", W/"7-abc"', etag)
+    assert etag_matches("*", etag)
+    assert not etag_matches('W/"8-abc"', etag)
+    assert not etag_matches(None, etag)
+    assert not etag_matches("*", None)
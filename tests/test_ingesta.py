@@ -0,0 +1,164 @@
+import asyncio
+import json
+import threading
+
+import fdb
+from fastapi import HTTPException
+
+from escrituras import INSERTS
+from ingesta import IngestQueue, Journal
+
+
+def _cliente(i):
+    return {campo: str(i) for campo in INSERTS["cust"]["campos"]}
+
+
+def _esperar(cola, condicion, limite=5.0):
+    async def esperar():
+        transcurrido = 0.0
+        while not condicion():
+            assert transcurrido < limite, cola.stats()
+            await asyncio.sleep(0.01)
+            transcurrido += 0.01
+    return esperar()
+
+
+def test_journal_relee_y_salta_la_linea_cortada(tmp_path):
+    ruta = str(tmp_path / "ingesta.journal")
+    journal = Journal(ruta)
+    assert journal.open() == []
+    journal.append({"op": "alta", "ticket": "a"}, {"op": "alta", "ticket": "b"})
+    journal.close()
+    # Una caída a mitad de un append deja la última línea incompleta
+    with open(ruta, "ab") as f:
+        f.write(b'{"op": "alta", "tick')
+
+    journal = Journal(ruta)
+    assert [r["ticket"] for r in journal.open()] == ["a", "b"]
+    journal.append({"op": "fin", "ticket": "a"})
+    journal.close()
+    assert [r["ticket"] for r in Journal(ruta).open()] == ["a", "b", "a"]
+
+
+def test_journal_rewrite_conserva_lo_agregado_durante_la_copia(tmp_path):
+    ruta = str(tmp_path / "ingesta.journal")
+    journal = Journal(ruta, fsync=False)
+    journal.open()
+    for i in range(100):
+        journal.append({"op": "alta", "ticket": str(i)})
+    desde = journal.size()
+    hilos = [threading.Thread(target=lambda k=k: [journal.append({"op": "alta", "ticket": f"n{k}-{i}"})
+                                                  for i in range(100)])
+             for k in range(4)]
+    for hilo in hilos:
+        hilo.start()
+    journal.rewrite([{"op": "alta", "ticket": "resumen"}], desde)
+    for hilo in hilos:
+        hilo.join()
+    journal.close()
+    tickets = [r["ticket"] for r in Journal(ruta).open()]
+    assert tickets[0] == "resumen"
+    assert sorted(tickets[1:]) == sorted(f"n{k}-{i}" for k in range(4) for i in range(100))
+
+
+def test_group_commit_y_reanudacion(tmp_path):
+    ruta = str(tmp_path / "ingesta.journal")
+
+    async def encolar():
+        cola = IngestQueue(ruta, max_lote=20, espera=0.01, fsync=False, tabla_control=None)
+        await cola.start()
+        tickets = [await cola.submit("cust", _cliente(i)) for i in range(50)]
+        await _esperar(cola, lambda: not cola._pendientes)
+        stats = cola.stats()
+        await cola.stop()
+        return tickets, stats
+
+    tickets, stats = asyncio.run(encolar())
+    assert (stats["confirmados"], stats["fallidos"]) == (50, 0)
+    assert stats["lotes"] < 50
+
+    # Un alta sin resultado en el journal se reencola al arrancar
+    with open(ruta, "a") as f:
+        f.write(json.dumps({"op": "alta", "ticket": "perdido", "tabla": "cust",
+                            "datos": _cliente(99), "creado": 0}) + "\n")
+
+    async def reanudar():
+        cola = IngestQueue(ruta, espera=0.01, fsync=False, tabla_control=None)
+        await cola.start()
+        await _esperar(cola, lambda: not cola._pendientes)
+        estados = [cola.status(t)["estado"] for t in tickets + ["perdido"]]
+        await cola.stop()
+        return estados
+
+    assert set(asyncio.run(reanudar())) == {"ok"}
+
+
+def test_lote_rechazado_por_sus_datos_falla_al_primer_intento(tmp_path):
+    async def prueba():
+        cola = IngestQueue(str(tmp_path / "ingesta.journal"), espera=0.01, fsync=False,
+                           tabla_control=None, reintento=0.01)
+        await cola.start()
+
+        def rechazar(conn, lote, revisar):
+            raise HTTPException(status_code=400, detail="Registro inválido")
+
+        cola._aplicar = rechazar
+        ticket = await cola.submit("cust", _cliente(1))
+        await _esperar(cola, lambda: not cola._pendientes)
+        estado = cola.status(ticket)
+        await cola.stop()
+        return estado, cola.reintentos
+
+    estado, reintentos = asyncio.run(prueba())
+    assert (estado["estado"], estado["error"], reintentos) == ("error", "Registro inválido", 0)
+
+
+def test_errores_de_la_base_con_reintentos_acotados(tmp_path):
+    async def prueba():
+        cola = IngestQueue(str(tmp_path / "ingesta.journal"), espera=0.01, fsync=False,
+                           tabla_control=None, reintento=0.01, max_reintentos=2)
+        await cola.start()
+
+        def caida(conn, lote, revisar):
+            raise fdb.DatabaseError("Error reading data from the connection", -902, 335544726)
+
+        cola._aplicar = caida
+        ticket = await cola.submit("cust", _cliente(1))
+        await _esperar(cola, lambda: not cola._pendientes)
+        estado = cola.status(ticket)
+        await cola.stop()
+        return estado, cola.reintentos
+
+    estado, reintentos = asyncio.run(prueba())
+    assert estado["estado"] == "error"
+    assert reintentos == 2
+
+
+def test_registro_incompleto_es_error_de_su_fila(tmp_path):
+    async def prueba():
+        cola = IngestQueue(str(tmp_path / "ingesta.journal"), espera=0.05, fsync=False, tabla_control=None)
+        await cola.start()
+        # submit no valida (lo hace la ruta): un registro incompleto llega al lote
+        malo = await cola.submit("cust", {"ID_N": "1"})
+        bueno = await cola.submit("cust", _cliente(2))
+        await _esperar(cola, lambda: not cola._pendientes)
+        estados = cola.status(malo), cola.status(bueno)
+        await cola.stop()
+        return estados
+
+    malo, bueno = asyncio.run(prueba())
+    assert malo["estado"] == "error" and malo["error"].startswith("Falta el campo requerido")
+    assert bueno["estado"] == "ok"
+
+
+def test_start_exige_la_tabla_de_control(tmp_path, monkeypatch):
+    monkeypatch.setattr(IngestQueue, "_control_existe", lambda self, conn: False)
+
+    async def prueba():
+        cola = IngestQueue(str(tmp_path / "ingesta.journal"), fsync=False)
+        try:
+            await cola.start()
+        except RuntimeError as e:
+            return str(e)
+
+    assert "API_INGESTA" in asyncio.run(prueba())
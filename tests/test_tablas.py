@@ -0,0 +1,83 @@
+import sqlite3
+from decimal import Decimal
+
+import pytest
+from fastapi import HTTPException
+
+from tablas import build_lookup, build_select, check_column, key_value, parse_fields
+
+
+@pytest.fixture
+def shipto():
+    # Clave compuesta (ID_N, SUCCLIENTE) con huecos y repetidos en la primera columna
+    base = sqlite3.connect(":memory:")
+    base.execute("CREATE TABLE shipto (ID_N INTEGER, SUCCLIENTE INTEGER, COMPANY TEXT)")
+    filas = [(id_n, suc, f"c{id_n}-{suc}") for id_n in (1, 2, 5, 7) for suc in range(3)]
+    base.executemany("INSERT INTO shipto VALUES (?, ?, ?)", filas)
+    yield base
+    base.close()
+
+
+def _ejecutar(base, query, params):
+    # FIRST ? de Firebird como LIMIT de SQLite
+    if query.startswith("SELECT FIRST ? "):
+        query = query.replace("FIRST ? ", "", 1) + " LIMIT ?"
+        params = params[1:] + params[:1]
+    return base.execute(query, params).fetchall()
+
+
+def test_keyset_con_clave_compuesta(shipto):
+    query, params = build_select("shipto", ["ID_N", "SUCCLIENTE"], after=["2", "1"])
+    assert query == ("SELECT ID_N, SUCCLIENTE FROM shipto WHERE ID_N >= ? AND "
+                     "((ID_N > ?) OR (ID_N = ? AND SUCCLIENTE > ?)) ORDER BY ID_N, SUCCLIENTE")
+    assert params == ["2", "2", "2", "1"]
+    esperadas = sorted(f for f in shipto.execute("SELECT ID_N, SUCCLIENTE FROM shipto") if f > (2, 1))
+    assert _ejecutar(shipto, query, [int(p) for p in params]) == esperadas
+
+
+def test_keyset_recorre_todas_las_paginas(shipto):
+    vistas = []
+    after = None
+    while True:
+        query, params = build_select("shipto", ["ID_N", "SUCCLIENTE", "COMPANY"], after=after, limit=5)
+        pagina = _ejecutar(shipto, query, params)
+        vistas.extend(pagina)
+        if len(pagina) < 5:
+            break
+        after = list(pagina[-1][:2])
+    assert vistas == shipto.execute("SELECT * FROM shipto ORDER BY ID_N, SUCCLIENTE").fetchall()
+
+
+def test_keyset_con_filtros_y_clave_simple():
+    query, params = build_select("cust", ["ID_N"], ["CITY = ?"], ["Cali"], after=["10"], limit=3)
+    assert query == "SELECT FIRST ? ID_N FROM cust WHERE CITY = ? AND ((ID_N > ?)) ORDER BY ID_N"
+    assert params == [3, "Cali", "10"]
+
+
+def test_after_incompleto():
+    with pytest.raises(HTTPException) as error:
+        build_select("shipto", ["ID_N"], after=["1"])
+    assert error.value.status_code == 400
+
+
+def test_build_lookup():
+    assert build_lookup("cust", ["ID_N", "EMAIL"], "ID_N", 3) == \
+        "SELECT ID_N, EMAIL FROM cust WHERE ID_N IN (?, ?, ?)"
+
+
+def test_columnas():
+    assert check_column("cust", " email ") == "EMAIL"
+    assert parse_fields("cust", "email,ID_N,email") == ["EMAIL", "ID_N"]
+    with pytest.raises(HTTPException):
+        parse_fields("cust", "ID_N,CLAVE_SECRETA")
+
+
+def test_key_value():
+    assert key_value(" 123 ", int) == 123
+    assert key_value("1520.50", Decimal) == Decimal("1520.50")
+    # Texto: como compara Firebird, sin los espacios finales pero con los iniciales
+    assert key_value(" 0123 ", str) == " 0123"
+    assert key_value(123, str) == "123"
+    for valor, tipo in (("12.5", int), ("abc", Decimal), (None, str), (True, int), ([1], int)):
+        with pytest.raises((ValueError, ArithmeticError)):
+            key_value(valor, tipo)